@@ -0,0 +1,79 @@
+"""
+Client-side cost of upserting an Arrow batch through `MergeInto.from_batch` (a parameter per column)
+& through `MergeInto.from_rows` (the batch converted to dicts, a single ARRAY<STRUCT> parameter):
+building the statements, compiling them & converting their parameters to the API's JSON payload,
+ie everything but the request itself.
+
+Usage: python -m benchmarks.columnar [--rows 1000000] [--max-rows 50000] [--repeat 3]
+"""
+import argparse
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Callable, Iterable
+
+import pyarrow  # type: ignore
+from google.cloud.bigquery.dbapi import _helpers, cursor
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table
+
+from pybigquery_merge_into.client import compile_statement
+from pybigquery_merge_into.merge_clause import MergeInto
+
+target = Table(
+    "target",
+    MetaData(),
+    Column("id", Integer),
+    Column("name", String),
+    Column("price", Float),
+    Column("updated_at", DateTime),
+)
+
+
+def batch(rows: int):
+    start = datetime(2021, 1, 1)
+    return pyarrow.table({
+        "id": pyarrow.array(range(rows), pyarrow.int64()),
+        "name": pyarrow.array([f"product #{i}" if i % 10 else None for i in range(rows)]),
+        "price": pyarrow.array([i / 100 for i in range(rows)]),
+        "updated_at": pyarrow.array([start + timedelta(seconds=i) for i in range(rows)], pyarrow.timestamp("us")),
+    })
+
+
+def submit(merges: Iterable[MergeInto]) -> int:
+    # what `client.BigQueryJobClient.query` does before sending the request
+    statements = 0
+    for merge in merges:
+        sql, parameters = compile_statement(merge)
+        sql, types = cursor._format_operation(sql, parameters)
+        [parameter.to_api_repr() for parameter in _helpers.to_query_parameters(parameters, types or {})]
+        statements += 1
+    return statements
+
+
+def measure(name: str, run: Callable[[], int], rows: int, repeat: int) -> None:
+    best, statements = float("inf"), 0
+    for _ in range(repeat):
+        started = perf_counter()
+        statements = run()
+        best = min(best, perf_counter() - started)
+
+    print(f"{name:<8} {statements:>10} {best:>9.2f} {rows / best:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--max-rows", type=int, default=50_000, help="Rows per statement")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of")
+    args = parser.parse_args()
+
+    data = batch(args.rows)
+
+    print(f"{'path':<8} {'statements':>10} {'time (s)':>9} {'rows/s':>10}")
+    measure("columns", lambda: submit(MergeInto.from_batch(target, data, ["id"], max_rows=args.max_rows)),
+            args.rows, args.repeat)
+    measure("dicts", lambda: submit(MergeInto.from_rows(target, data.to_pylist(), ["id"], max_rows=args.max_rows)),
+            args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
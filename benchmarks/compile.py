@@ -0,0 +1,218 @@
+"""
+Compile time & peak memory of MERGE INTO statements (`compile_merge_into`) & of lone WHEN clauses
+(`compile_when_clause`), over a range of shapes:
+  - the `tests/conftest.py` tables, as in BigQuery's documentation examples
+  - synthetic wide tables, from 10 to 1000 columns
+  - 1 to 16 WHEN clauses
+  - sources being subqueries with CTEs
+  - `literal_binds` on & off
+
+Results are compared to the baselines (a JSON file, `baselines/compile.json` by default) & the cases slower
+or bigger than their baseline (times `--time-tolerance`/`--memory-tolerance`) are flagged, making the command
+exit with 1. Timings depend on the machine (& are noisier than the memory figures), save your own baselines
+(`--save`) before comparing two revisions.
+
+Usage: python -m benchmarks.compile [--filter wide/] [--repeat 20] [--save] [--baselines PATH]
+"""
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Tuple, Union
+
+from sqlalchemy import Table, delete, insert, literal, select, update
+from sqlalchemy.sql import ClauseElement, Subquery
+from sqlalchemy_bigquery import BigQueryDialect
+
+from benchmarks.wide_tables import wide_tables
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatched, WhenNotMatchedBySource
+from tests.conftest import detailed_inventory, inventory, new_arrivals
+
+COLUMNS = [10, 100, 300, 1000]
+WHEN_CLAUSES = [1, 2, 4, 8, 16]
+
+DEFAULT_BASELINES = Path(__file__).parent / "baselines" / "compile.json"
+
+
+class Case(NamedTuple):
+    name: str
+    statement: ClauseElement  # a MergeInto, or a lone WHEN clause
+    literal_binds: bool
+
+
+def _binds(literal_binds: bool) -> str:
+    return "literals" if literal_binds else "params"
+
+
+def example_merge() -> MergeInto:
+    # https://cloud.google.com/bigquery/docs/reference/standard-sql/dml-syntax#merge_examples (example 2)
+    T, S = inventory.alias("T"), new_arrivals.alias("S")
+    return MergeInto(
+        target=T,
+        source=S,
+        onclause=T.c.product == S.c.product,
+        when_clauses=[
+            WhenMatched(update(T).values(quantity=T.c.quantity + S.c.quantity)),
+            WhenNotMatched(insert(T).values(product=S.c.product, quantity=S.c.quantity)),
+            WhenNotMatchedBySource(delete(T), condition=T.c.quantity < 10),
+        ],
+    )
+
+
+def example_cte_merge() -> MergeInto:
+    T = detailed_inventory.alias("T")
+    arrivals = select(new_arrivals).where(new_arrivals.c.warehouse != "unknown").cte("arrivals")
+    S = select(arrivals.c.product, arrivals.c.quantity).subquery("S")
+    return MergeInto(
+        target=T,
+        source=S,
+        onclause=T.c.product == S.c.product,
+        when_clauses=[
+            WhenMatched(update(T).values(quantity=S.c.quantity)),
+            WhenNotMatched(insert(T).values(product=S.c.product, quantity=S.c.quantity, supply_constrained=False)),
+        ],
+    )
+
+
+def wide_merge(columns: int, when_clauses: int = 2, cte: bool = False) -> MergeInto:
+    """
+    Upsert of every column, `when_clauses` - 1 conditional updates being added before the insert.
+    With `cte`, the source is a subquery reading from a CTE (itself filtering the source table).
+    """
+    target, table = wide_tables(columns)
+
+    source: Union[Table, Subquery] = table
+    if cte:
+        filtered = select(table).where(table.c.id > 0).cte("filtered")
+        source = select(filtered).where(filtered.c.c0 != "skip").subquery("source")
+
+    updates = [
+        WhenMatched(
+            update(target).values({target.c[c.name]: c for c in source.c if c.name != "id"}),
+            condition=source.c.c0 != f"value {i}",
+        )
+        for i in range(when_clauses - 1)
+    ]
+
+    return MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.id == source.c.id,
+        when_clauses=[
+            *updates,
+            WhenNotMatched(insert(target).values({target.c[c.name]: c for c in source.c}), condition=source.c.id > 0),
+        ],
+    )
+
+
+def wide_when_clause(columns: int) -> WhenMatched:
+    target, source = wide_tables(columns)
+    return WhenMatched(
+        update(target).values({target.c[c.name]: literal(f"value {i}") for i, c in enumerate(target.c)}),
+        condition=source.c.id > 0,
+    )
+
+
+def cases() -> Iterator[Case]:
+    for literal_binds in (False, True):
+        yield Case(f"examples/inventory/{_binds(literal_binds)}", example_merge(), literal_binds)
+        yield Case(f"examples/cte/{_binds(literal_binds)}", example_cte_merge(), literal_binds)
+
+    for columns in COLUMNS:
+        for literal_binds in (False, True):
+            binds = _binds(literal_binds)
+            yield Case(f"wide/{columns}/{binds}", wide_merge(columns), literal_binds)
+            yield Case(f"cte/{columns}/{binds}", wide_merge(columns, cte=True), literal_binds)
+            yield Case(f"when_clause/{columns}/{binds}", wide_when_clause(columns), literal_binds)
+
+    for when_clauses in WHEN_CLAUSES:
+        yield Case(f"clauses/{when_clauses}x100", wide_merge(100, when_clauses=when_clauses), False)
+
+    # in-memory rows, rendered inline (literal_binds) or as a single ARRAY<STRUCT> parameter
+    target, _ = wide_tables(10)
+    rows = [{c.name: i if c.name == "id" else f"value {i}" for c in target.c} for i in range(1000)]
+    for literal_binds in (False, True):
+        statement, = MergeInto.from_rows(target, rows, ["id"], literal_binds=literal_binds)
+        yield Case(f"rows/1000x10/{_binds(literal_binds)}", statement, literal_binds)
+
+
+def measure(case: Case, repeat: int) -> Tuple[float, int]:
+    """
+    :return: Best compile time (in seconds) & peak memory allocated while compiling (in bytes)
+    """
+    dialect = BigQueryDialect()
+    compile_kwargs = {"literal_binds": True} if case.literal_binds else {}
+
+    def compile_():
+        return case.statement.compile(dialect=dialect, compile_kwargs=compile_kwargs)
+
+    # small statements are compiled several times per run, so each run lasts long enough to be measured reliably
+    number = max(1, int(0.01 / timeit.timeit(compile_, number=1)))
+
+    # min() of the runs, the other values mostly measure the noise
+    seconds = min(timeit.repeat(compile_, number=number, repeat=repeat)) / number
+
+    # after the timing runs, so what's measured doesn't include warming up (lazy imports, etc)
+    tracemalloc.start()
+    try:
+        compile_()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="Only run the cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--time-tolerance", type=float, default=1.5, help="Time ratio to the baseline deemed a regression")
+    parser.add_argument("--memory-tolerance", type=float, default=1.1, help="Same, for the peak memory")
+    parser.add_argument("--baselines", type=Path, default=DEFAULT_BASELINES)
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baselines")
+    args = parser.parse_args()
+
+    baselines: Dict[str, Dict[str, float]] = {}
+    if args.baselines.exists():
+        baselines = json.loads(args.baselines.read_text())
+
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+
+    print(f"{'case':<28} {'time (ms)':>10} {'baseline':>10} {'peak (KiB)':>11} {'baseline':>10}")
+    for case in cases():
+        if args.filter not in case.name:
+            continue
+
+        seconds, peak = measure(case, args.repeat)
+        result = results[case.name] = {"time_ms": round(seconds * 1000, 3), "peak_kib": round(peak / 1024, 1)}
+        baseline = baselines.get(case.name, {})
+
+        tolerances = {"time_ms": args.time_tolerance, "peak_kib": args.memory_tolerance}
+        regressed = [
+            metric for metric, value in result.items()
+            if metric in baseline and value > baseline[metric] * tolerances[metric]
+        ]
+        if regressed:
+            regressions.append((case.name, regressed))
+
+        print(f"{case.name:<28} {result['time_ms']:>10.2f} {baseline.get('time_ms', float('nan')):>10.2f} "
+              f"{result['peak_kib']:>11.1f} {baseline.get('peak_kib', float('nan')):>10.1f}"
+              f"{'  REGRESSED (' + ', '.join(regressed) + ')' if regressed else ''}")
+
+    if args.save:
+        args.baselines.parent.mkdir(parents=True, exist_ok=True)
+        # keep the baselines of the cases that were filtered out
+        args.baselines.write_text(json.dumps({**baselines, **results}, indent=2, sort_keys=True) + "\n")
+        print(f"Saved the baselines to {args.baselines}")
+
+    elif regressions:
+        print(f"{len(regressions)} case(s) regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
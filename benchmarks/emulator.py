@@ -0,0 +1,71 @@
+"""
+Throughput of merges run by the local emulator (`pybigquery_merge_into.emulator`): a target of `--rows` rows
+is upserted with as many rows, half of them matching a target row, through:
+  - a table source (`MergeInto.upsert`)
+  - in-memory rows (`MergeInto.from_rows`), with bound parameters & with literals
+
+The figures are rows merged per second, excluding the loading of the tables. They measure SQLite, not BigQuery:
+use them to compare the client-side cost of two revisions (or two ways of building the same merge).
+
+Usage: python -m benchmarks.emulator [--rows 1000000] [--max-rows 100000] [--filter rows/]
+"""
+import argparse
+from datetime import date, timedelta
+from time import perf_counter
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import Column, Date, Integer, MetaData, String, Table
+
+from pybigquery_merge_into.client import JobStats
+from pybigquery_merge_into.emulator import MergeEmulator
+from pybigquery_merge_into.merge_clause import MergeInto
+from pybigquery_merge_into.rows import Row
+
+metadata = MetaData()
+
+target = Table("target", metadata, Column("id", Integer), Column("value", String), Column("day", Date))
+source = Table("source", metadata, Column("id", Integer), Column("value", String), Column("day", Date))
+
+
+def _rows(start: int, count: int, value: str) -> Iterator[Row]:
+    first = date(2021, 1, 1)
+    return ({"id": i, "value": value, "day": first + timedelta(days=i % 365)} for i in range(start, start + count))
+
+
+def cases(rows: int, max_rows: int) -> Iterator[Tuple[str, MergeEmulator, List[MergeInto]]]:
+    new_rows = list(_rows(rows // 2, rows, "new"))
+
+    emulator = MergeEmulator()
+    emulator.create_table(target, _rows(0, rows, "old"))
+    emulator.create_table(source, new_rows)
+    yield "table", emulator, [MergeInto.upsert(target, source, ["id"])]
+
+    for literal_binds in [False, True]:
+        emulator = MergeEmulator()
+        emulator.create_table(target, _rows(0, rows, "old"))
+        merges = list(MergeInto.from_rows(target, new_rows, ["id"], max_rows=max_rows, literal_binds=literal_binds))
+        yield f"rows/{'literals' if literal_binds else 'params'}", emulator, merges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Rows in the target, & in the source")
+    parser.add_argument("--max-rows", type=int, default=100_000, help="`from_rows` batch size")
+    parser.add_argument("--filter", default="", help="Only run the cases whose name contains this")
+    args = parser.parse_args()
+
+    print(f"{'case':<16} {'statements':>10} {'time (s)':>9} {'rows/s':>10} {'inserted':>9} {'updated':>9}")
+    for name, emulator, merges in cases(args.rows, args.max_rows):
+        if args.filter not in name:
+            continue
+
+        started = perf_counter()
+        stats = JobStats.total([emulator.execute(merge) for merge in merges])
+        elapsed = perf_counter() - started
+
+        print(f"{name:<16} {len(merges):>10} {elapsed:>9.2f} {args.rows / elapsed:>10.0f} "
+              f"{stats.inserted_row_count:>9} {stats.updated_row_count:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compile time of MERGE INTO statements updating/inserting every column of a wide table.
+
+Compares the WHEN clauses renderer with the previous implementation, which compiled full
+UPDATE/INSERT statements (and the target table, for UPDATEs) and cut the table name out of the result.
+
+Usage: python -m benchmarks.wide_tables [--columns 300] [--repeat 20]
+"""
+import argparse
+import timeit
+from typing import Type
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.dml import Delete, Insert, Update
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatched, _WhenClause
+
+
+class _LegacyWhenMatched(WhenMatched):
+    inherit_cache = True
+
+
+class _LegacyWhenNotMatched(WhenNotMatched):
+    inherit_cache = True
+
+
+@compiles(_LegacyWhenMatched, "bigquery")
+@compiles(_LegacyWhenNotMatched, "bigquery")
+def _compile_legacy_when_clause(element: _WhenClause, compiler: SQLCompiler, **kwargs):
+    text = element.when_type()
+
+    if element.condition is not None:
+        text += " AND {}".format(compiler.process(element.condition, **kwargs))
+
+    if isinstance(element.action, Delete):
+        action_text = "DELETE"
+    elif isinstance(element.action, Update):
+        action_text = compiler.process(element.action, **kwargs)
+        action_text = action_text.replace(compiler.process(element.action.table, asfrom=True), "", 1)
+    elif not (element.action._values or element.action._ordered_values):
+        action_text = "INSERT ROW"
+    else:
+        action_text = compiler.process(element.action, **kwargs)
+        action_text = action_text.replace(f"INTO `{element.action.table.name}` ", "", 1)
+
+    # used to be done by `compile_merge_into`
+    compiler.isinsert = compiler.isupdate = False
+
+    return text + " THEN \n\t{}\n".format(action_text)
+
+
+def wide_tables(columns: int):
+    metadata = MetaData()
+    target = Table("target", metadata, Column("id", Integer), *(Column(f"c{i}", String) for i in range(columns)))
+    source = Table("source", metadata, Column("id", Integer), *(Column(f"c{i}", String) for i in range(columns)))
+    return target, source
+
+
+def wide_merge(columns: int, when_matched: Type[WhenMatched], when_not_matched: Type[WhenNotMatched]) -> MergeInto:
+    target, source = wide_tables(columns)
+
+    return MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.id == source.c.id,
+        when_clauses=[
+            when_matched(update(target).values({target.c[c.name]: c for c in source.c if c.name != "id"})),
+            when_not_matched(insert(target).values({target.c[c.name]: c for c in source.c})),
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--columns", type=int, nargs="+", default=[10, 100, 300, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    dialect = BigQueryDialect()
+
+    print(f"{'columns':>8} {'legacy (ms)':>12} {'direct (ms)':>12} {'speedup':>8}")
+    for columns in args.columns:
+        legacy = wide_merge(columns, _LegacyWhenMatched, _LegacyWhenNotMatched)
+        direct = wide_merge(columns, WhenMatched, WhenNotMatched)
+
+        # min() of the runs, the other values mostly measure the noise
+        legacy_time = min(timeit.repeat(lambda: legacy.compile(dialect=dialect), number=1, repeat=args.repeat))
+        direct_time = min(timeit.repeat(lambda: direct.compile(dialect=dialect), number=1, repeat=args.repeat))
+
+        print(f"{columns:>8} {legacy_time * 1000:>12.2f} {direct_time * 1000:>12.2f} {legacy_time / direct_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
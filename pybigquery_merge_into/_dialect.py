@@ -0,0 +1,15 @@
+from functools import lru_cache
+
+from sqlalchemy.engine import Dialect
+
+
+@lru_cache(maxsize=None)
+def bigquery_dialect() -> Dialect:
+    """
+    Shared BigQuery dialect, for when no engine/connection is around to provide one.
+    Uses the DB-API's paramstyle, so parameters are rendered with their types (ie `%(name:STRING)s`).
+    """
+    # imported here so merely importing the constructs doesn't pull the whole google client in
+    from sqlalchemy_bigquery import BigQueryDialect  # type: ignore
+
+    return BigQueryDialect(paramstyle="pyformat")
@@ -0,0 +1,102 @@
+"""
+asyncio entry points: the jobs are submitted & polled in threads, so waiting for them doesn't block the event loop.
+"""
+import asyncio
+import time
+from functools import partial
+from typing import Iterable, List, Optional
+
+from sqlalchemy.sql import ClauseElement
+
+from pybigquery_merge_into import events
+from pybigquery_merge_into.client import JobClient, JobStats, _notify_executed, compile_statement, job_options
+
+
+async def execute_async(
+        client: JobClient,
+        statement: ClauseElement,
+        poll_interval: float = 1.0,
+        **options,
+) -> JobStats:
+    """
+    Run `statement` (typically a `MergeInto`), polling the job every `poll_interval` seconds until it's done.
+    Raises if the job failed.
+
+    Cancelling the coroutine stops the polling, not the job.
+
+    :param options: `google.cloud.bigquery.QueryJobConfig` attributes, on top of the statement's own
+    """
+    loop = asyncio.get_running_loop()
+    compile_started = time.monotonic()
+    sql, parameters = compile_statement(statement)
+    options = job_options(statement, **options)
+
+    # the actual client's calls are all blocking HTTP requests
+    started = time.monotonic()
+    job = None
+    try:
+        job = await loop.run_in_executor(None, partial(client.query, sql, parameters, **options))
+
+        while not await loop.run_in_executor(None, job.done):
+            await asyncio.sleep(poll_interval)
+        elapsed = time.monotonic() - started
+
+        # done, so this only raises the job's error (if any)
+        await loop.run_in_executor(None, job.result)
+    except Exception as error:
+        if events.observers:
+            _notify_executed(statement, started - compile_started, job, time.monotonic() - started, error)
+        raise
+
+    if events.observers:
+        _notify_executed(statement, started - compile_started, job, elapsed)
+    return JobStats.from_job(job, elapsed)
+
+
+class AsyncMergeRunner:
+    """
+    Runs statements concurrently, `max_concurrency` jobs at most.
+
+    Note that BigQuery runs at most 2 MERGE/UPDATE/DELETE statements against a table at the same time,
+    the others end up queued (or failing, past a point).
+    """
+
+    def __init__(self, client: JobClient, max_concurrency: int = 10, poll_interval: float = 1.0):
+        """
+        :param client: Runs the jobs, see `client.BigQueryJobClient`
+        :param max_concurrency: Maximum number of jobs running at the same time
+        :param poll_interval: Seconds between two checks of a running job
+        """
+        assert max_concurrency > 0, "At least one job has to be able to run"
+
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.poll_interval = poll_interval
+        # created on first use, it has to belong to the loop it's used in (python < 3.10)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def execute(self, statement: ClauseElement, **options) -> JobStats:
+        """
+        Same as `execute_async`, waiting for a slot first.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            return await execute_async(self.client, statement, self.poll_interval, **options)
+
+    async def execute_all(self, statements: Iterable[ClauseElement], **options) -> List[JobStats]:
+        """
+        Run all of `statements`, concurrently. The first error is raised once every job is done.
+
+        :return: The stats of the jobs, in the same order as `statements`
+        """
+        results = await asyncio.gather(
+            *(self.execute(statement, **options) for statement in statements),
+            return_exceptions=True,
+        )
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results  # type: ignore
@@ -0,0 +1,197 @@
+import atexit
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Table
+
+from pybigquery_merge_into.client import JobClient, execute
+from pybigquery_merge_into.merge_clause import MergeInto
+from pybigquery_merge_into.rows import Row
+
+# target, key columns, merged columns (None for all of them)
+_Shape = Tuple[Table, Tuple[str, ...], Optional[Tuple[str, ...]]]
+
+
+class UpsertBuffer:
+    """
+    Gathers single-row upserts & merges them in batches, one `MergeInto.from_rows` per target & merge shape
+    (key columns, merged columns). Rows with the same key are deduplicated, the last one added wins.
+
+    A batch is merged once it has `max_rows` rows, or once its oldest row has waited for `max_delay` seconds.
+    The merges run in a background thread, one at a time (merges into the same table would conflict anyway).
+    `add` blocks while `max_pending_rows` rows are waiting to be merged or being merged, the biggest batch is
+    merged right away then.
+
+    Whatever is left is merged by `close`, which is also called when the interpreter exits.
+    A failed merge's rows are lost, & its error is raised by the next `add`/`flush`/`close`.
+    """
+
+    def __init__(
+            self,
+            client: JobClient,
+            max_rows: int = 10_000,
+            max_delay: float = 5.0,
+            max_pending_rows: int = 100_000,
+            **merge_options: Any,
+    ):
+        """
+        :param client: Runs the merges, see `client.BigQueryJobClient`
+        :param max_rows: Number of (distinct) rows that triggers the merge of a batch
+        :param max_delay: Maximum time a row waits before being merged, in seconds
+        :param max_pending_rows: Maximum number of rows buffered or being merged, before `add` blocks
+        :param merge_options: Other `MergeInto.from_rows` parameters (literal_binds, partition_column, etc)
+        """
+        assert max_rows > 0 and max_pending_rows > 0
+
+        self.client = client
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending_rows = max_pending_rows
+        self.merge_options = merge_options
+
+        self._batches: Dict[_Shape, Dict[Tuple[Any, ...], Row]] = {}
+        self._oldest: Dict[_Shape, float] = {}  # when the first row of each batch was added
+        self._pending = 0
+        self._error: Optional[Exception] = None
+        self._closed = False
+
+        self._condition = threading.Condition()
+        # taking a batch & merging it is done as a whole, so the batches of a shape are merged in order
+        self._merging = threading.Lock()
+
+        self._flusher = threading.Thread(target=self._run, name="UpsertBuffer", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __enter__(self) -> "UpsertBuffer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def add(
+            self,
+            target: Table,
+            row: Row,
+            key_columns: Sequence[str],
+            columns: Optional[Sequence[str]] = None,
+            timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Buffer `row`, to be upserted into `target`.
+
+        :param row: Mapping keyed by column name
+        :param key_columns: Names of the columns identifying a row
+        :param columns: Names of the columns to merge, defaults to all the target's columns
+        :param timeout: Maximum time to wait for room in the buffer, in seconds. Raises a TimeoutError past it.
+        """
+        shape = (target, tuple(key_columns), tuple(columns) if columns is not None else None)
+        key = tuple(row.get(name) for name in key_columns)
+
+        with self._condition:
+            self._raise_error()
+            assert not self._closed, "The buffer is closed"
+
+            def has_room() -> bool:
+                return self._pending < self.max_pending_rows or self._error is not None
+
+            if not self._condition.wait_for(has_room, timeout):
+                raise TimeoutError(f"No room in the buffer after {timeout}s")
+            self._raise_error()
+
+            batch = self._batches.setdefault(shape, {})
+            if key not in batch:
+                self._pending += 1
+            batch[key] = row
+
+            # new deadline, full batch or full buffer: either way the flusher has something new to look at
+            if shape not in self._oldest or len(batch) == self.max_rows or self._pending == self.max_pending_rows:
+                self._oldest.setdefault(shape, time.monotonic())
+                self._condition.notify_all()
+
+    def _due(self, now: float) -> List[_Shape]:
+        due = [
+            shape for shape, batch in self._batches.items()
+            if len(batch) >= self.max_rows or now - self._oldest[shape] >= self.max_delay
+        ]
+        if not due and self._batches and self._pending >= self.max_pending_rows:
+            # `add` is blocked until some room is made, which can't wait for any threshold
+            due = [max(self._batches, key=lambda shape: len(self._batches[shape]))]
+        return due
+
+    def _next_deadline(self, now: float) -> Optional[float]:
+        if not self._oldest:
+            return None
+        return max(0.0, min(self._oldest.values()) + self.max_delay - now)
+
+    def _merge(self, shapes: Optional[List[_Shape]] = None) -> None:
+        """
+        Merge the batches of `shapes` (all of them by default), in the calling thread.
+        """
+        with self._merging:
+            with self._condition:
+                taken = [
+                    (shape, list(self._batches.pop(shape).values()))
+                    for shape in (list(self._batches) if shapes is None else shapes)
+                    if shape in self._batches
+                ]
+                for shape, _ in taken:
+                    del self._oldest[shape]
+
+            # rows keep being added while the flusher catches up, batches can end up bigger than `max_rows`
+            options: Dict[str, Any] = {"max_rows": self.max_rows, **self.merge_options}
+
+            for (target, key_columns, columns), rows in taken:
+                try:
+                    for statement in MergeInto.from_rows(target, rows, key_columns, columns, **options):
+                        execute(self.client, statement)
+                except Exception as error:
+                    with self._condition:
+                        self._error = self._error or error
+                finally:
+                    with self._condition:
+                        self._pending -= len(rows)
+                        self._condition.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                due = self._due(time.monotonic())
+                while not self._closed and not due:
+                    self._condition.wait(self._next_deadline(time.monotonic()))
+                    due = self._due(time.monotonic())
+
+                if self._closed:
+                    # `close` merges what's left
+                    return
+
+            self._merge(due)
+
+    def flush(self) -> None:
+        """
+        Merge every buffered row now, & wait for it to be done.
+        """
+        self._merge()
+        with self._condition:
+            self._raise_error()
+
+    def close(self) -> None:
+        """
+        Stop the background merges & merge whatever is left. Called on exit, if not before.
+        """
+        with self._condition:
+            if self._closed:
+                self._raise_error()
+                return
+            self._closed = True
+            self._condition.notify_all()
+
+        atexit.unregister(self.close)
+        self._flusher.join()
+        self.flush()
@@ -0,0 +1,373 @@
+import json
+from base64 import b64encode
+from datetime import date, datetime, time
+from decimal import Decimal
+from io import BytesIO
+from time import monotonic
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Protocol, Sequence, Tuple, TypeVar, Union
+from weakref import ref
+
+from sqlalchemy import ARRAY, Column
+from sqlalchemy.engine import Dialect
+from sqlalchemy.sql import ClauseElement
+
+from pybigquery_merge_into import events
+from pybigquery_merge_into._dialect import bigquery_dialect
+from pybigquery_merge_into.rows import MAX_QUERY_LENGTH, MAX_QUERY_PARAMETERS, MAX_REQUEST_SIZE, Row
+
+# Rows (mappings keyed by column name), a pandas.DataFrame or a pyarrow.RecordBatch/Table
+Batch = Union[Sequence[Row], Any]
+
+E = TypeVar("E", bound=ClauseElement)
+
+# Execution option holding the statement's own `QueryJobConfig` attributes
+_JOB_OPTIONS = "bigquery_job_options"
+
+
+class Job(Protocol):
+    """
+    The parts of `google.cloud.bigquery`'s jobs used by this package.
+    """
+    job_id: str
+
+    def done(self) -> bool:
+        """Whether the job finished, successfully or not. Doesn't wait."""
+
+    def result(self) -> Any:
+        """Waits for the job to finish, raises if it failed."""
+
+
+class JobClient(Protocol):
+    """
+    What's needed to run merges & their side jobs (loads, table drops).
+    `BigQueryJobClient` is the actual implementation, see `testing.FakeJobClient` for a local one.
+    """
+
+    def query(self, sql: str, parameters: Mapping[str, Any], **options) -> Job:
+        """
+        Submit a query, without waiting for it to finish.
+
+        :param sql: Statement, using the DB-API's paramstyle (ie `%(name:TYPE)s` placeholders)
+        :param parameters: Values of the placeholders
+        :param options: `google.cloud.bigquery.QueryJobConfig` attributes
+        """
+
+    def load(self, table: str, columns: Sequence[Column], data: Batch) -> Job:
+        """
+        Submit a load job (appending `data` to `table`, creating it if needed), without waiting for it to finish.
+        """
+
+    def delete_table(self, table: str) -> None:
+        """
+        Drop `table`, if it exists.
+        """
+
+
+class JobStats(NamedTuple):
+    """
+    Statistics of a finished query job. What BigQuery didn't report (or the job client doesn't know) is None.
+    The row counts of a MERGE are broken down by action, straight from the job's metadata.
+    """
+    job_id: str
+    elapsed: float  # seconds the job ran for, from BigQuery's timestamps (see `from_job`)
+    total_bytes_processed: Optional[int] = None
+    total_bytes_billed: Optional[int] = None
+    slot_millis: Optional[int] = None
+    num_dml_affected_rows: Optional[int] = None
+    inserted_row_count: Optional[int] = None
+    updated_row_count: Optional[int] = None
+    deleted_row_count: Optional[int] = None
+
+    @classmethod
+    def from_job(cls, job: Job, elapsed: float) -> "JobStats":
+        """
+        :param elapsed: Time the job took as seen by the client, in seconds. Only used when the job doesn't have
+                        its start (or creation) & end times, which don't include the client's polling delays.
+        """
+        dml_stats = getattr(job, "dml_stats", None)
+        started = getattr(job, "started", None) or getattr(job, "created", None)
+        ended = getattr(job, "ended", None)
+
+        return cls(
+            job_id=job.job_id,
+            elapsed=(ended - started).total_seconds() if isinstance(started, datetime) and ended else elapsed,
+            total_bytes_processed=getattr(job, "total_bytes_processed", None),
+            total_bytes_billed=getattr(job, "total_bytes_billed", None),
+            slot_millis=getattr(job, "slot_millis", None),
+            num_dml_affected_rows=getattr(job, "num_dml_affected_rows", None),
+            inserted_row_count=getattr(dml_stats, "inserted_row_count", None),
+            updated_row_count=getattr(dml_stats, "updated_row_count", None),
+            deleted_row_count=getattr(dml_stats, "deleted_row_count", None),
+        )
+
+    @classmethod
+    def total(cls, stats: Sequence["JobStats"]) -> "JobStats":
+        """
+        The stats of several jobs (ie the statements of a `MergeInto.from_rows`, or the shards of a merge) added up.
+        Their ids are joined with commas, & a figure is None if one of the jobs didn't report it.
+        `elapsed` is summed too: that's the total job time, not the wall-clock time of jobs which ran concurrently.
+        """
+        assert stats, "At least one job is required"
+
+        def add(values: Sequence[Any]) -> Any:
+            return None if None in values else sum(values)
+
+        return cls(
+            ",".join(job.job_id for job in stats),
+            *(add(values) for values in list(zip(*stats))[1:]),
+        )
+
+
+class StatementTooLarge(Exception):
+    """
+    A statement goes over BigQuery's limits (query length, number of parameters, request size),
+    it would be rejected by the server.
+    """
+
+    def __init__(self, problems: Sequence[str]):
+        super().__init__("The statement is too large: {}".format(", ".join(problems)))
+        self.problems = list(problems)
+
+
+def check_limits(sql: str, parameters: Mapping[str, Any]) -> None:
+    """
+    Raise a `StatementTooLarge` if a compiled statement goes over BigQuery's limits.
+    The request size is a lower bound (the parameters' values as JSON), the API's format is more verbose.
+    """
+    problems = []
+
+    if len(sql) > MAX_QUERY_LENGTH:
+        problems.append(f"{len(sql)} characters > {MAX_QUERY_LENGTH}")
+    if len(parameters) > MAX_QUERY_PARAMETERS:
+        problems.append(f"{len(parameters)} parameters > {MAX_QUERY_PARAMETERS}")
+    if parameters and len(sql) + len(json.dumps(parameters, default=str)) > MAX_REQUEST_SIZE:
+        problems.append(f"request over {MAX_REQUEST_SIZE} bytes")
+
+    if problems:
+        raise StatementTooLarge(problems)
+
+
+# Attribute holding the SQL & parameters of a statement compiled with `keep=True`, until it's compiled again
+# (ie executed). Along with a reference to the statement: its copies (ie `with_job_options`) get the attribute too.
+_CHECKED = "_bigquery_checked"
+
+
+def compile_statement(
+        statement: ClauseElement,
+        dialect: Optional[Dialect] = None,
+        keep: bool = False,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Raises a `StatementTooLarge` if the statement goes over BigQuery's limits, so it doesn't even get submitted.
+
+    :param keep: Keep the result for the next call with the same statement (& the default dialect),
+                 ie the one executing it, which doesn't compile it (& check it) again then
+    :return: The SQL & parameters to submit `statement` through a `JobClient`
+    """
+    if dialect is None:
+        checked = vars(statement).pop(_CHECKED, None)
+        if checked is not None and checked[0]() is statement:
+            return checked[1], checked[2]
+
+    compiled = statement.compile(dialect=dialect or bigquery_dialect())
+
+    # same as what `Connection.execute` would do, ie go through the types' bind processors
+    processors = compiled._bind_processors  # type: ignore
+    parameters = {
+        name: processors[name](value) if name in processors else value
+        for name, value in (compiled.construct_params() or {}).items()
+    }
+
+    sql = str(compiled)
+    check_limits(sql, parameters)
+
+    if keep and dialect is None:
+        vars(statement)[_CHECKED] = (ref(statement), sql, parameters)
+    return sql, parameters
+
+
+def with_job_options(statement: E, **options) -> E:
+    """
+    A copy of `statement` (any executable one: `MergeInto`, `MergeScript`, `Insert`, etc) run with `options`,
+    ie `maximum_bytes_billed=10 ** 12, labels={"team": "data"}, priority="BATCH"`.
+    Added to the statement's previous ones, & overridden by the ones given at execution.
+
+    :param options: `google.cloud.bigquery.QueryJobConfig` attributes
+    """
+    return statement.execution_options(**{_JOB_OPTIONS: {**job_options(statement), **options}})  # type: ignore
+
+
+def job_options(statement: ClauseElement, **options) -> Dict[str, Any]:
+    """
+    :return: The job options of `statement` (see `with_job_options`), overridden by `options`
+    """
+    execution_options: Mapping[str, Any] = getattr(statement, "get_execution_options", dict)()
+    return {**execution_options.get(_JOB_OPTIONS, {}), **options}
+
+
+class BytesBudgetExceeded(Exception):
+    """
+    A statement would process more bytes than it's allowed to bill.
+    """
+
+    def __init__(self, estimated: int, maximum: int):
+        super().__init__(f"The statement would process {estimated} bytes, over its budget of {maximum} bytes")
+        self.estimated = estimated
+        self.maximum = maximum
+
+
+def dry_run(client: JobClient, statement: ClauseElement, **options) -> int:
+    """
+    Submit `statement` as a dry run job: nothing is run (or billed), BigQuery only validates & prices it.
+    Raises a `BytesBudgetExceeded` if the statement would process more than its `maximum_bytes_billed`,
+    which BigQuery only enforces when the statement is actually run.
+
+    :param options: `google.cloud.bigquery.QueryJobConfig` attributes, on top of the statement's own
+    :return: Number of bytes the statement would process
+    """
+    options = job_options(statement, **options)
+    sql, parameters = compile_statement(statement)
+
+    job = client.query(sql, parameters, **{**options, "dry_run": True, "use_query_cache": False})
+    estimated = getattr(job, "total_bytes_processed", None) or 0
+
+    maximum = options.get("maximum_bytes_billed")
+    if maximum is not None and estimated > maximum:
+        raise BytesBudgetExceeded(estimated, maximum)
+
+    return estimated
+
+
+def execute(client: JobClient, statement: ClauseElement, **options) -> Job:
+    """
+    Run `statement` (typically a `MergeInto`) & wait for it to finish.
+
+    :param options: `google.cloud.bigquery.QueryJobConfig` attributes, on top of the statement's own
+    """
+    if events.observers:
+        return _execute_observed(client, statement, **options)
+
+    sql, parameters = compile_statement(statement)
+
+    job = client.query(sql, parameters, **job_options(statement, **options))
+    job.result()
+
+    return job
+
+
+def _execute_observed(client: JobClient, statement: ClauseElement, **options) -> Job:
+    started = monotonic()
+    sql, parameters = compile_statement(statement)
+    compiled = monotonic()
+
+    job = None
+    try:
+        job = client.query(sql, parameters, **job_options(statement, **options))
+        job.result()
+    except Exception as error:
+        _notify_executed(statement, compiled - started, job, monotonic() - compiled, error)
+        raise
+
+    _notify_executed(statement, compiled - started, job, monotonic() - compiled)
+    return job
+
+
+def _notify_executed(
+        statement: ClauseElement,
+        compile_time: float,
+        job: Optional[Job],
+        elapsed: float,
+        error: Optional[BaseException] = None,
+) -> None:
+    stats = JobStats.from_job(job, elapsed) if job is not None else None
+    events.notify(events.StatementExecuted(statement, compile_time, elapsed, stats, error))
+
+
+def execute_with_stats(client: JobClient, statement: ClauseElement, **options) -> JobStats:
+    """
+    Same as `execute`, returning the job's statistics (ie the number of rows inserted/updated/deleted by a merge),
+    without any extra query.
+    """
+    started = monotonic()
+    job = execute(client, statement, **options)
+
+    return JobStats.from_job(job, monotonic() - started)
+
+
+def _json_value(value: Any) -> Any:
+    # what `json.dumps` can't serialize on its own, as BigQuery expects it in JSON loads
+    if isinstance(value, (date, time)):  # datetime is a date
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return b64encode(value).decode()
+    return value
+
+
+class BigQueryJobClient:
+    """
+    `JobClient` backed by a `google.cloud.bigquery.Client`.
+    """
+
+    def __init__(self, client):
+        """
+        :param client: `google.cloud.bigquery.Client` instance
+        """
+        self.client = client
+
+    def query(self, sql: str, parameters: Mapping[str, Any], **options) -> Job:
+        from google.cloud.bigquery import QueryJobConfig
+        from google.cloud.bigquery.dbapi import _helpers, cursor
+
+        # same conversion as the DB-API's `Cursor.execute`, which sqlalchemy-bigquery goes through
+        sql, parameter_types = cursor._format_operation(sql, parameters)
+
+        job_config = QueryJobConfig(
+            query_parameters=_helpers.to_query_parameters(parameters, parameter_types or {}),
+            **options,
+        )
+
+        return self.client.query(sql, job_config=job_config)
+
+    def load(self, table: str, columns: Sequence[Column], data: Batch) -> Job:
+        from google.cloud.bigquery import LoadJobConfig, SourceFormat
+
+        job_config = LoadJobConfig(schema=[self._schema_field(column) for column in columns])
+
+        if type(data).__module__.startswith("pandas"):
+            return self.client.load_table_from_dataframe(data, table, job_config=job_config)
+
+        if type(data).__module__.startswith("pyarrow"):
+            import pyarrow  # type: ignore
+            import pyarrow.parquet  # type: ignore
+
+            if isinstance(data, pyarrow.RecordBatch):
+                data = pyarrow.Table.from_batches([data])
+
+            # parquet keeps the whole thing columnar, no per-row Python objects
+            buffer = BytesIO()
+            pyarrow.parquet.write_table(data, buffer)
+            buffer.seek(0)
+
+            job_config.source_format = SourceFormat.PARQUET
+            return self.client.load_table_from_file(buffer, table, job_config=job_config)
+
+        rows = [{name: _json_value(value) for name, value in row.items()} for row in data]
+        return self.client.load_table_from_json(rows, table, job_config=job_config)
+
+    def delete_table(self, table: str) -> None:
+        self.client.delete_table(table, not_found_ok=True)
+
+    @staticmethod
+    def _schema_field(column: Column):
+        from google.cloud.bigquery import SchemaField
+
+        type_, mode = column.type, "NULLABLE"
+        if isinstance(type_, ARRAY):
+            type_, mode = type_.item_type, "REPEATED"
+
+        # SchemaField wants the base type only, ie `STRING` rather than `STRING(10)`
+        field_type = bigquery_dialect().type_compiler.process(type_).split("(")[0]
+
+        return SchemaField(column.name, field_type, mode=mode)
@@ -0,0 +1,183 @@
+"""
+`MergeInto` sources made of columnar batches (pyarrow RecordBatches/Tables, pandas DataFrames), without going
+through a dict per row: each column is sent as its own ARRAY query parameter & the rows are put back together
+by offset, ie `SELECT @id[OFFSET(_row)] AS id, ... FROM UNNEST(GENERATE_ARRAY(0, @row_count - 1)) AS _row`.
+
+BigQuery's API takes JSON, so the values still end up as Python objects, but they are converted a column at
+a time (& numeric columns straight from their buffers). For batches too big for query parameters, use a staging
+load (`staging.staged_merge`), which sends them as Parquet.
+
+pyarrow is only imported when used, pandas DataFrames are converted to Arrow (without copies, when possible).
+"""
+from typing import Any, Iterator, List, Optional, Sequence
+
+from sqlalchemy import (
+    ARRAY, Boolean, Column, Date, DateTime, Float, Integer, LargeBinary, Numeric, String, Time, bindparam, cast, null,
+    select,
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import ColumnElement, Subquery
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import Function
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.types import TypeEngine
+
+from pybigquery_merge_into.rows import DEFAULT_MAX_PARAMETER_SIZE
+
+# a pyarrow.RecordBatch/Table or a pandas.DataFrame
+Batch = Any
+
+
+def _arrow_type(type_: TypeEngine):
+    """
+    Arrow type of a column's values, as BigQuery expects them for its SQLAlchemy type.
+    """
+    import pyarrow  # type: ignore
+
+    # most specific first, ie a Float is a Numeric
+    if isinstance(type_, Boolean):
+        return pyarrow.bool_()
+    if isinstance(type_, Integer):
+        return pyarrow.int64()
+    if isinstance(type_, Float):
+        return pyarrow.float64()
+    if isinstance(type_, Numeric):
+        return pyarrow.decimal128(type_.precision or 38, type_.scale if type_.scale is not None else 9)
+    if isinstance(type_, String):
+        return pyarrow.string()
+    if isinstance(type_, LargeBinary):
+        return pyarrow.binary()
+    if isinstance(type_, DateTime):
+        return pyarrow.timestamp("us", tz="UTC" if type_.timezone else None)
+    if isinstance(type_, Date):
+        return pyarrow.date32()
+    if isinstance(type_, Time):
+        return pyarrow.time64("us")
+
+    raise TypeError(f"Can't send {type_!r} columns as query parameters, use a staging load")
+
+
+def to_arrow(columns: Sequence[Column], batch: Batch):
+    """
+    `batch` as a `pyarrow.Table` of `columns`, in order, cast to their types (which fails on lossy casts,
+    ie an overflowing integer). Missing columns are NULLs, as with `rows.rows_source`.
+    """
+    import pyarrow  # type: ignore
+
+    if type(batch).__module__.startswith("pandas"):
+        batch = pyarrow.Table.from_pandas(batch, preserve_index=False)
+    elif isinstance(batch, pyarrow.RecordBatch):
+        batch = pyarrow.Table.from_batches([batch])
+
+    arrays = []
+    for c in columns:
+        type_ = _arrow_type(c.type)
+        if c.name in batch.column_names:
+            arrays.append(batch.column(c.name).cast(type_))
+        else:
+            arrays.append(pyarrow.nulls(batch.num_rows, type_))
+
+    return pyarrow.Table.from_arrays(arrays, names=[c.name for c in columns])
+
+
+def _values(array) -> List[Any]:
+    # Python values of an array without NULLs: `tolist` on a numpy array is much faster than `to_pylist`.
+    # Its timestamps lose their timezone, they're in UTC though, which is what BigQuery takes naive ones as.
+    import pyarrow  # type: ignore
+
+    if pyarrow.types.is_integer(array.type) or pyarrow.types.is_floating(array.type) \
+            or pyarrow.types.is_boolean(array.type) or pyarrow.types.is_date(array.type) \
+            or pyarrow.types.is_timestamp(array.type):
+        return array.to_numpy(zero_copy_only=False).tolist()
+    return array.to_pylist()
+
+
+class _RowOffsets(ColumnElement):
+    """
+    `GENERATE_ARRAY(0, <row_count> - 1)`, the offsets of the rows of a batch.
+    The batch is kept (but isn't part of the cache key) for the emulator, which can't unnest arrays.
+    """
+    _traverse_internals = [("row_count", InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, data, row_count: ColumnElement):
+        self.data = data
+        self.row_count = row_count
+        self.type = ARRAY(Integer)
+
+
+@compiles(_RowOffsets, "bigquery")
+def compile_row_offsets(element: _RowOffsets, compiler: SQLCompiler, **kwargs):
+    return "GENERATE_ARRAY(0, {} - 1)".format(compiler.process(element.row_count, **kwargs))
+
+
+def _column(c: Column, array, row: ColumnElement) -> ColumnElement:
+    import pyarrow.compute  # type: ignore
+
+    if array.null_count == len(array):
+        return cast(null(), c.type)
+
+    if not array.null_count:
+        return bindparam(f"{c.name}_values", _values(array), type_=ARRAY(c.type), unique=True)[row]
+
+    # BigQuery arrays can't hold NULLs: those are replaced by another value of the column, & listed separately
+    filled = array.fill_null(array.drop_null()[0])
+    nulls = bindparam(
+        f"{c.name}_nulls", _values(pyarrow.compute.indices_nonzero(array.is_null())),
+        type_=Integer, unique=True, expanding=True,
+    )
+    values = bindparam(f"{c.name}_values", _values(filled), type_=ARRAY(c.type), unique=True)
+    # `IF(<row> IN UNNEST(<nulls>), NULL, <values>[OFFSET(<row>)])`
+    return Function("IF", row.in_(nulls), cast(null(), c.type), values[row], type_=c.type)
+
+
+def batch_source(columns: Sequence[Column], batch: Batch, name: str = "source") -> Subquery:
+    """
+    `MergeInto` source made of a columnar batch, one ARRAY query parameter per column (see the module's docstring).
+
+    :param columns: Columns of the source, usually the target's. They give the parameters' names & types.
+    :param batch: pyarrow RecordBatch/Table or pandas DataFrame, with (at least) the columns' names
+    :param name: Name of the resulting subquery
+    """
+    data = to_arrow(columns, batch)
+    assert data.num_rows, "Can't build a source out of 0 rows"
+
+    row_count = bindparam("row_count", data.num_rows, type_=Integer, unique=True)
+    offsets = Function("unnest", _RowOffsets(data, row_count), type_=Integer).alias("_row")
+    row = offsets.column
+
+    return select(*(
+        _column(c, array.combine_chunks(), row).label(c.name) for c, array in zip(columns, data.columns)
+    )).select_from(offsets).subquery(name)
+
+
+def _estimated_row_size(data) -> int:
+    # Rough (& pessimistic) size of a row in the request: `{"value": "<value>"}, ` per column,
+    # its value's JSON taking a few times what it takes in Arrow
+    if not data.num_rows:
+        return 0
+    return sum(16 + 3 * array.nbytes // data.num_rows for array in data.columns)
+
+
+def chunk_batch(
+        columns: Sequence[Column],
+        batch: Batch,
+        max_size: Optional[int] = None,
+        max_rows: Optional[int] = None,
+) -> Iterator[Any]:
+    """
+    Split `batch` into `pyarrow.Table` slices (no copies) small enough to stay under BigQuery's request size limit
+    once passed to `batch_source`.
+
+    :param max_size: Size budget of a slice, in bytes. Defaults to 90% of BigQuery's limit.
+    :param max_rows: Maximum number of rows per slice, if any
+    """
+    data = to_arrow(columns, batch)
+    if max_size is None:
+        max_size = DEFAULT_MAX_PARAMETER_SIZE
+
+    rows = max(1, max_size // max(1, _estimated_row_size(data)))
+    if max_rows is not None:
+        rows = min(rows, max_rows)
+
+    for offset in range(0, data.num_rows, rows):
+        yield data.slice(offset, rows)
@@ -0,0 +1,283 @@
+"""
+Local MERGE emulator: runs `MergeInto` statements (& plain SQLAlchemy statements) over tables kept in SQLite,
+following BigQuery's MERGE semantics. Meant for tests & offline benchmarks, not as a BigQuery replacement:
+only what SQLite can express is supported (no ARRAY/STRUCT columns, no BigQuery-specific functions).
+
+The statement isn't translated from its BigQuery SQL, its clauses are evaluated as a few set-based SQLite
+statements, all against the state of the tables before the merge:
+  1. the source is copied into a temp table (deduplicated, if asked to)
+  2. the (target row, source row) pairs the ON clause matches are gathered, along with the first WHEN MATCHED
+     clause applying to each pair
+  3. the rows updated & inserted are computed into a temp table
+  4. the updated & deleted target rows are removed, & the rows from 3. inserted
+"""
+from itertools import count
+from time import monotonic
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    Column, Integer, MetaData, Table, and_, case, create_engine, func, insert, literal_column, null, select,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import ClauseElement, ColumnElement, FromClause, Subquery
+from sqlalchemy.sql.dml import Delete
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.functions import Function
+from sqlalchemy.sql.selectable import Select, TableValuedAlias
+
+from pybigquery_merge_into.client import JobStats
+from pybigquery_merge_into.columnar import _RowOffsets
+from pybigquery_merge_into.merge_clause import (
+    MergeInto, WhenMatched, WhenNotMatched, WhenNotMatchedBySource, _WhenClause, _dml_values, _restrict,
+    _source_name, _with_source,
+)
+from pybigquery_merge_into.rows import Row, _RowsLiteral
+
+_job_ids = count()
+
+
+class MergeError(Exception):
+    """
+    What BigQuery fails a MERGE with when a target row is matched by several source rows.
+    """
+
+    def __init__(self):
+        super().__init__("UPDATE/MERGE must match at most one source row for each target row")
+
+
+def _rows_of(source: FromClause) -> Optional[List[Row]]:
+    # the rows of a `rows.rows_source` or a `columnar.batch_source`, ie `SELECT ... FROM UNNEST(<rows>)`,
+    # which SQLite can't do
+    if not isinstance(source, Subquery) or not isinstance(source.element, Select):  # type: ignore
+        return None
+
+    for from_ in source.element.get_final_froms():  # type: ignore
+        if isinstance(from_, TableValuedAlias):
+            from_ = from_.element  # type: ignore
+        if isinstance(from_, Function) and from_.name == "unnest":
+            array, = from_.clauses
+            if isinstance(array, BindParameter):
+                return array.value
+            if isinstance(array, _RowsLiteral):
+                return list(array.rows)
+            if isinstance(array, _RowOffsets):
+                return array.data.to_pylist()
+    return None
+
+
+class MergeEmulator:
+    """
+    Tables in a SQLite database (in memory by default), & the statements run against them.
+    The tables are created from the `Table`s the statements use, with the same names & columns.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        # a single connection, an in-memory database lives as long as it does
+        self.engine: Engine = create_engine(f"sqlite:///{path}")
+        self.connection: Connection = self.engine.connect()
+        self.metadata = MetaData()
+
+    def create_table(self, table: Table, rows: Iterable[Row] = ()) -> None:
+        """
+        Create (or replace) `table`, with `rows` in it.
+        """
+        if table.name in self.metadata.tables:
+            self.metadata.remove(self.metadata.tables[table.name])
+        copy = Table(table.name, self.metadata, *(Column(c.name, c.type) for c in table.c))
+
+        with self.connection.begin():
+            copy.drop(self.connection, checkfirst=True)
+            copy.create(self.connection)
+            self._insert_rows(copy, rows)
+
+    def _insert_rows(self, table: Table, rows: Iterable[Row]) -> None:
+        # straight to the driver, SQLAlchemy's per-row overhead is what takes the most time with millions of rows
+        dialect = self.connection.dialect
+        columns = [(c.name, c.type._cached_bind_processor(dialect)) for c in table.c]  # type: ignore
+        sql = str(insert(table).compile(dialect=dialect))
+
+        parameters = [
+            tuple(process(row.get(name)) if process else row.get(name) for name, process in columns)
+            for row in rows
+        ]
+        if parameters:
+            self.connection.exec_driver_sql(sql, parameters)  # type: ignore
+
+    def rows(self, table: Table) -> List[Dict[str, Any]]:
+        """
+        The rows of `table`, in insertion order (the updated ones come last).
+        """
+        query = select(self.metadata.tables[table.name]).order_by(literal_column("rowid"))
+        return [dict(row._mapping) for row in self.connection.execute(query)]
+
+    def execute(self, statement: ClauseElement) -> JobStats:
+        """
+        Run `statement`, a `MergeInto` or any statement SQLite can run.
+
+        :return: Its stats, with the numbers of rows inserted, updated & deleted by a merge
+        """
+        started = monotonic()
+        job_id = f"emulated_job_{next(_job_ids)}"
+
+        with self.connection.begin():
+            if not isinstance(statement, MergeInto):
+                affected = self.connection.execute(statement).rowcount
+                return JobStats(job_id, monotonic() - started, num_dml_affected_rows=max(affected, 0))
+
+            inserted, updated, deleted = _Merge(self, statement).run()
+
+        return JobStats(
+            job_id, monotonic() - started,
+            num_dml_affected_rows=inserted + updated + deleted,
+            inserted_row_count=inserted, updated_row_count=updated, deleted_row_count=deleted,
+        )
+
+
+def _rowid(table: FromClause) -> ColumnElement:
+    # SQLite's implicit rowid, qualified by the table's (or alias') name
+    return literal_column(f'"{table.name}".rowid', Integer)  # type: ignore
+
+
+class _Merge:
+    """
+    A `MergeInto` run by a `MergeEmulator`, see the module's docstring.
+    """
+
+    def __init__(self, emulator: MergeEmulator, merge: MergeInto):
+        self.emulator = emulator
+        self.connection = emulator.connection
+        self.metadata = MetaData()
+        self.merge = self._materialize_source(merge)
+
+    def _temp_table(self, name: str, *columns: Column) -> Table:
+        table = Table(name, self.metadata, *columns, prefixes=["TEMPORARY"])
+        table.drop(self.connection, checkfirst=True)
+        table.create(self.connection)
+        return table
+
+    def _materialize_source(self, merge: MergeInto) -> MergeInto:
+        name = _source_name(merge.source) or "source"
+
+        rows = _rows_of(merge.source)
+        if rows is not None:
+            rows_table = self._temp_table("_merge_rows", *(Column(c.name, c.type) for c in merge.source.c))
+            self.emulator._insert_rows(rows_table, rows)
+            merge = _with_source(merge, rows_table.alias(name))
+
+        query = select(merge.source)
+        if merge.dedup_partition_by:
+            # no QUALIFY in SQLite
+            row_number = func.row_number().over(partition_by=merge.dedup_partition_by, order_by=merge.dedup_order_by)
+            numbered = select(merge.source, row_number.label("_row_number")).subquery()
+            query = select(*(numbered.c[c.key] for c in merge.source.c)).where(numbered.c._row_number == 1)
+
+        source = self._temp_table("_merge_source", *(Column(c.key, c.type) for c in merge.source.c))
+        self.connection.execute(insert(source).from_select([c.key for c in merge.source.c], query))
+
+        merge = _with_source(merge, source.alias(name))
+        merge.dedup_partition_by, merge.dedup_order_by = [], None
+        return merge
+
+    def _clauses(self, kind: type) -> List[Tuple[int, _WhenClause]]:
+        return [(i, clause) for i, clause in enumerate(self.merge.when_clauses) if type(clause) is kind]
+
+    def _first_applying(self, clauses: Sequence[Tuple[int, _WhenClause]]) -> ColumnElement:
+        # index of the first clause whose condition holds, NULL if none does
+        compiler = self.connection.dialect.statement_compiler(self.connection.dialect, None)
+        whens: List[Tuple[ColumnElement, int]] = []
+        for i, clause in clauses:
+            condition = clause._full_condition(compiler)
+            if condition is None:
+                return case(*whens, else_=i) if whens else literal_column(str(i), Integer)
+            whens.append((condition, i))
+        return case(*whens)
+
+    def _values(self, clause: _WhenClause, source: FromClause) -> List[ColumnElement]:
+        # the target row, as the clause's UPDATE/INSERT leaves it
+        target = self.merge.target
+        values = dict(_dml_values(clause.action))  # type: ignore
+
+        if isinstance(clause, WhenNotMatched):
+            if not values:
+                # INSERT ROW, the source's columns in order
+                return list(source.c)
+            return [values.get(c, null()) for c in target.c]  # type: ignore
+
+        return [values.get(c, c) for c in target.c]  # type: ignore
+
+    def run(self) -> Tuple[int, int, int]:
+        merge, connection = self.merge, self.connection
+        target, source = merge.target, merge.source
+        table = self.emulator.metadata.tables[getattr(target, "original", target).name]
+
+        onclause = merge.onclause
+        not_matched_by_source = self._clauses(WhenNotMatchedBySource)
+        if merge.partition_predicate is not None:
+            onclause = and_(onclause, merge.partition_predicate)
+            not_matched_by_source = [(i, _restrict(c, merge.partition_predicate)) for i, c in not_matched_by_source]
+
+        # 2. matched pairs, & the WHEN MATCHED clause applying to each
+        matched = self._clauses(WhenMatched)
+        pairs = self._temp_table(
+            "_merge_pairs", Column("t", Integer, index=True), Column("s", Integer, index=True), Column("clause", Integer),
+        )
+        connection.execute(insert(pairs).from_select(["t", "s", "clause"], select(
+            _rowid(target), _rowid(source),
+            self._first_applying(matched) if matched else literal_column("NULL", Integer),
+        ).select_from(target.join(source, onclause))))
+
+        if matched:
+            several = select(pairs.c.t).group_by(pairs.c.t).having(func.count() > 1).limit(1)
+            if connection.execute(several).first() is not None:
+                raise MergeError()
+
+        # target rows not matched by the source, & the WHEN NOT MATCHED BY SOURCE clause applying to each
+        unmatched = self._temp_table("_merge_unmatched", Column("t", Integer, primary_key=True), Column("clause", Integer))
+        if not_matched_by_source:
+            applying = self._first_applying(not_matched_by_source)
+            query = select(_rowid(target), applying).select_from(target) \
+                .where(_rowid(target).not_in(select(pairs.c.t)), applying.is_not(None))
+            connection.execute(insert(unmatched).from_select(["t", "clause"], query))
+
+        # 3. the updated & inserted rows
+        changed = self._temp_table("_merge_changed", *(Column(c.name, c.type) for c in table.c))
+        names = [c.name for c in table.c]
+        inserted = updated = deleted = 0
+
+        for i, clause in matched:
+            applied = select(func.count()).where(pairs.c.clause == i)
+            if isinstance(clause.action, Delete):
+                deleted += connection.execute(applied).scalar_one()
+                continue
+            query = select(*self._values(clause, source)) \
+                .select_from(target.join(pairs, _rowid(target) == pairs.c.t).join(source, _rowid(source) == pairs.c.s)) \
+                .where(pairs.c.clause == i)
+            updated += connection.execute(insert(changed).from_select(names, query)).rowcount
+
+        for i, clause in not_matched_by_source:
+            if isinstance(clause.action, Delete):
+                deleted += connection.execute(select(func.count()).where(unmatched.c.clause == i)).scalar_one()
+                continue
+            query = select(*self._values(clause, source)) \
+                .select_from(target.join(unmatched, _rowid(target) == unmatched.c.t)) \
+                .where(unmatched.c.clause == i)
+            updated += connection.execute(insert(changed).from_select(names, query)).rowcount
+
+        not_matched = self._clauses(WhenNotMatched)
+        if not_matched:
+            applying = self._first_applying(not_matched)
+            candidates = select(_rowid(source).label("s"), applying.label("clause")).select_from(source) \
+                .where(_rowid(source).not_in(select(pairs.c.s))).subquery()
+            for i, clause in not_matched:
+                query = select(*self._values(clause, source)) \
+                    .select_from(source.join(candidates, _rowid(source) == candidates.c.s)) \
+                    .where(candidates.c.clause == i)
+                inserted += connection.execute(insert(changed).from_select(names, query)).rowcount
+
+        # 4. out with the old rows, in with the new ones
+        removed = select(pairs.c.t).where(pairs.c.clause.is_not(None)).union_all(select(unmatched.c.t))
+        connection.execute(table.delete().where(_rowid(table).in_(removed)))
+        connection.execute(insert(table).from_select(names, select(changed)))
+
+        self.metadata.drop_all(connection)
+        return inserted, updated, deleted
@@ -0,0 +1,91 @@
+"""
+Instrumentation: observers are called with an event each time a `MergeInto` is compiled & each time a statement
+is run (`client.execute`, `aio.execute_async` & everything built on them).
+
+Without any observer registered, nothing is measured: compiling & running statements only checks `observers`.
+"""
+import logging
+from typing import TYPE_CHECKING, Any, Callable, List, NamedTuple, Optional, Union
+
+if TYPE_CHECKING:
+    from pybigquery_merge_into.client import JobStats
+
+logger = logging.getLogger(__name__)
+
+
+class MergeCompiled(NamedTuple):
+    """
+    A `MergeInto` was compiled. Times are in seconds.
+    Statements found in the compiled cache aren't compiled again, & don't trigger this event.
+    """
+    statement: Any  # MergeInto
+    elapsed: float
+    when_clause_times: List[float]  # in the order of the statement's WHEN clauses
+    sql_length: int
+    bind_count: int  # parameters the statement added to the compiled query
+
+
+class StatementExecuted(NamedTuple):
+    """
+    A statement was run, successfully or not. Times are in seconds.
+    """
+    statement: Any
+    compile_time: float  # compilation & parameter processing, on the client
+    wait_time: float  # from the submission to the end of the job, as seen by the client (queueing & polling included)
+    stats: Optional["JobStats"]  # None if the job couldn't even be submitted
+    error: Optional[BaseException]
+
+
+Event = Union[MergeCompiled, StatementExecuted]
+Observer = Callable[[Event], None]
+
+# Called in order, with every event
+observers: List[Observer] = []
+
+
+def add_observer(observer: Observer) -> None:
+    observers.append(observer)
+
+
+def remove_observer(observer: Observer) -> None:
+    observers.remove(observer)
+
+
+def notify(event: Event) -> None:
+    for observer in list(observers):
+        try:
+            observer(event)
+        except Exception:
+            # the metrics are not worth failing a merge over
+            logger.exception("Observer %r failed on %s", observer, type(event).__name__)
+
+
+class LoggingObserver:
+    """
+    Observer logging a line per event, ie `add_observer(LoggingObserver(level=logging.INFO))`.
+    """
+
+    def __init__(self, logger: logging.Logger = logger, level: int = logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, event: Event) -> None:
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        if isinstance(event, MergeCompiled):
+            self.logger.log(
+                self.level, "Compiled a MERGE in %.3fs (WHEN clauses: %s), %d characters, %d parameters",
+                event.elapsed, ", ".join(f"{t:.3f}s" for t in event.when_clause_times), event.sql_length,
+                event.bind_count,
+            )
+        elif event.error is not None:
+            self.logger.log(
+                self.level, "Statement failed after %.3fs of compilation & %.3fs of waiting: %s",
+                event.compile_time, event.wait_time, event.error,
+            )
+        else:
+            self.logger.log(
+                self.level, "Statement compiled in %.3fs, waited for %.3fs, ran as %s",
+                event.compile_time, event.wait_time, event.stats,
+            )
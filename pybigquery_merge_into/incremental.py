@@ -0,0 +1,166 @@
+"""
+Incremental merges: only the source rows past a watermark (ie an `updated_at` column) are merged,
+the watermark being kept between runs in a `WatermarkStore`.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional, Protocol
+
+from sqlalchemy import and_, func, select
+
+from pybigquery_merge_into.client import Job, JobClient, execute, job_options
+from pybigquery_merge_into.merge_clause import MergeInto, WhenNotMatchedBySource, _filter_source
+
+
+class WatermarkStore(Protocol):
+    """
+    Where the watermarks are kept between runs, by key (one per merge).
+    """
+
+    def get(self, key: str) -> Any:
+        """
+        :return: The watermark of `key`, None if there is none yet
+        """
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Replace the watermark of `key`, atomically: a failure leaves the previous one as is.
+        """
+
+
+def _encode(value: Any) -> str:
+    # JSON, with the types a watermark column typically has (TIMESTAMP, DATE, NUMERIC) tagged to be read back
+    if isinstance(value, datetime):
+        return json.dumps({"datetime": value.isoformat()})
+    if isinstance(value, date):
+        return json.dumps({"date": value.isoformat()})
+    if isinstance(value, Decimal):
+        return json.dumps({"decimal": str(value)})
+    return json.dumps({"value": value})
+
+
+def _decode(encoded: str) -> Any:
+    (kind, value), = json.loads(encoded).items()
+    if kind == "datetime":
+        return datetime.fromisoformat(value)
+    if kind == "date":
+        return date.fromisoformat(value)
+    if kind == "decimal":
+        return Decimal(value)
+    return value
+
+
+class FileWatermarkStore:
+    """
+    `WatermarkStore` backed by a JSON file, rewritten as a whole (through a temp file & a rename) on each update.
+    Fine for a single process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, key: str) -> Any:
+        encoded = self._read().get(key)
+        return _decode(encoded) if encoded is not None else None
+
+    def set(self, key: str, value: Any) -> None:
+        watermarks = self._read()
+        watermarks[key] = _encode(value)
+
+        # the rename is atomic, the file is either the previous one or the new one
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as file:
+            json.dump(watermarks, file, indent=2, sort_keys=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, self.path)
+
+
+class SQLiteWatermarkStore:
+    """
+    `WatermarkStore` backed by a SQLite database, ":memory:" by default (ie for tests).
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS watermarks (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get(self, key: str) -> Any:
+        row = self.connection.execute("SELECT value FROM watermarks WHERE key = ?", (key,)).fetchone()
+        return _decode(row[0]) if row is not None else None
+
+    def set(self, key: str, value: Any) -> None:
+        # one transaction, committed on exit
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO watermarks (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, _encode(value)),
+            )
+
+
+def incremental_merge(merge: MergeInto, watermark_column: str, low: Any, high: Any) -> MergeInto:
+    """
+    A copy of `merge` only merging the source rows with `low < <watermark_column> <= high`.
+
+    :param low: Previous watermark, None to merge everything up to `high`
+    """
+    assert not any(isinstance(clause, WhenNotMatchedBySource) for clause in merge.when_clauses), \
+        "The target rows missing from an increment aren't 'not matched by source'"
+
+    def predicate(source):
+        column = source.c[watermark_column]
+        return column <= high if low is None else and_(column > low, column <= high)
+
+    return _filter_source(merge, predicate)
+
+
+def execute_incremental(
+        client: JobClient,
+        merge: MergeInto,
+        watermark_column: str,
+        store: WatermarkStore,
+        key: Optional[str] = None,
+        **options,
+) -> Optional[Job]:
+    """
+    Merge the source rows added (or updated) since the previous run, & advance the watermark once that's done.
+    If the merge fails, the watermark is left as is, so the next run merges those rows again.
+
+    The new watermark is the greatest value of `watermark_column` in the source, looked up before the merge:
+    the rows landing in the source meanwhile are left to the next run. Rows with a NULL watermark are never merged.
+
+    :param merge: Statement to run incrementally, without WHEN NOT MATCHED BY SOURCE clauses
+    :param watermark_column: Name of the source column to track, growing with each new (or updated) row
+    :param store: Where the watermark is kept between runs
+    :param key: Key of the watermark in `store`, defaults to the target table's name
+    :param options: `google.cloud.bigquery.QueryJobConfig` attributes, for the watermark lookup too
+    :return: The merge's job, None if there was nothing new to merge
+    """
+    key = key or getattr(merge.target, "original", merge.target).fullname
+    low = store.get(key)
+
+    column = merge.source.c[watermark_column]
+    latest = select(func.max(column))
+    if low is not None:
+        latest = latest.where(column > low)
+
+    # same job options (location, labels, etc) as the merge
+    (high,), = execute(client, latest, **job_options(merge, **options)).result()
+    if high is None:
+        return None
+
+    job = execute(client, incremental_merge(merge, watermark_column, low, high), **options)
+    store.set(key, high)
+    return job
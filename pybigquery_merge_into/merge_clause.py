@@ -1,20 +1,45 @@
+import re
 from abc import abstractmethod
+from functools import partial
 from textwrap import dedent
-from typing import Generic, List, NoReturn, Optional, TypeVar, Union
+from time import perf_counter
+from typing import Any, Callable, Generic, Iterable, Iterator, List, NoReturn, Optional, Sequence, Set, Tuple, TypeVar, Union
 
-from sqlalchemy import Table
+from sqlalchemy import (
+    Column, Table, and_, bindparam, false, func, insert, literal, literal_column, null, or_, select, text, true,
+    union_all, update,
+)
+from sqlalchemy.engine import Dialect
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.sql import ClauseElement, ColumnElement, Subquery
+from sqlalchemy.sql import ClauseElement, ColumnElement, Subquery, coercions, roles
 from sqlalchemy.sql.base import Executable
 from sqlalchemy.sql.compiler import SQLCompiler
 from sqlalchemy.sql.dml import Delete, Insert, Update
-from sqlalchemy.sql.selectable import SelectBase
+from sqlalchemy.sql.elements import BindParameter, ColumnClause, _anonymous_label, _truncated_label
+from sqlalchemy.sql.functions import Function
+from sqlalchemy.sql.selectable import FromClause, SelectBase
+from sqlalchemy.sql.visitors import InternalTraversal, replacement_traverse
+from sqlalchemy.types import NullType
+
+from pybigquery_merge_into import events
+from pybigquery_merge_into._dialect import bigquery_dialect
+from pybigquery_merge_into.client import JobClient, StatementTooLarge, compile_statement, dry_run, with_job_options
+from pybigquery_merge_into.columnar import batch_source, chunk_batch
+from pybigquery_merge_into.rows import Row, chunk_rows, renders_literals, rows_source
 
 _Ops = Union[Insert, Update, Delete]
 T = TypeVar("T", bound=_Ops)
+C = TypeVar("C", bound=ClauseElement)
 
 
 class _WhenClause(ClauseElement, Generic[T]):
+    # Lets SQLAlchemy build a cache key (and thus reuse the compiled string) for these clauses.
+    # The subclass itself is part of the key, so the `when_type` is accounted for.
+    _traverse_internals = [
+        ("action", InternalTraversal.dp_clauseelement),
+        ("condition", InternalTraversal.dp_clauseelement),
+    ]
+
     def __init__(
             self,
             action: T,
@@ -23,6 +48,10 @@ class _WhenClause(ClauseElement, Generic[T]):
         self.action = action
         self.condition = condition
 
+    def _full_condition(self, compiler: SQLCompiler) -> Optional[ColumnElement]:
+        # condition to render, which might be more than the user-given one
+        return self.condition
+
     @classmethod
     @abstractmethod
     # shitty name, FIXME
@@ -30,29 +59,124 @@ class _WhenClause(ClauseElement, Generic[T]):
         pass
 
 
+def _inserts_row(action: _Ops) -> bool:
+    # an INSERT without values, ie `INSERT ROW`
+    return isinstance(action, Insert) and not (action._values or action._ordered_values)  # type: ignore
+
+
+def _default_value(column: Column, action: Union[Insert, Update]) -> Optional[ClauseElement]:
+    """
+    The value SQLAlchemy's crud would give `column` when `action` doesn't set it, ie its (on update) default.
+    Python callables are called when the statement's parameters are built, with no execution context.
+    """
+    default = column.default if isinstance(action, Insert) else column.onupdate
+    if default is None or default.is_sequence:
+        return None
+    if default.is_clause_element:
+        return default.arg
+    # untyped, like the literals given to `values()`, so they get the column's type & name the same way
+    if default.is_callable:
+        return bindparam(None, type_=NullType(), unique=True, callable_=partial(default.arg, None))
+    return bindparam(None, default.arg, type_=NullType(), unique=True)
+
+
+def _dml_values(action: Union[Insert, Update], defaults: bool = True) -> List[Tuple[Column, ClauseElement]]:
+    """
+    (column, value) pairs of an INSERT/UPDATE, in the order SQLAlchemy would render them,
+    ie the `ordered_values()` order if there is one, the table's column order otherwise.
+
+    :param defaults: Whether to add the columns' defaults (on update defaults for an UPDATE) for the columns
+                     the statement doesn't set, as SQLAlchemy does. INSERT ROW has none.
+    """
+    assert not action._multi_values, "Multi-row VALUES are not supported in a MERGE INTO statement"  # type: ignore
+
+    def column(key) -> Column:
+        return action.table.c[coercions.expect_as_key(roles.DMLColumnRole, key)]
+
+    if action._ordered_values:  # type: ignore
+        values = {column(key): value for key, value in action._ordered_values}  # type: ignore
+        order = [*values, *(col for col in action.table.c if col not in values)]
+    else:
+        values = {column(key): value for key, value in (action._values or {}).items()}  # type: ignore
+        order = list(action.table.c)
+
+    if not defaults or _inserts_row(action):
+        return [(col, values[col]) for col in order if col in values]
+
+    pairs = []
+    for col in order:
+        value = values[col] if col in values else _default_value(col, action)
+        if value is not None:
+            pairs.append((col, value))
+    return pairs
+
+
+def _dml_bind(column: Column, value: BindParameter) -> BindParameter:
+    # Copies share their `_cloned_set`, which is how the compiler (& its cache) knows they're the same parameter.
+    # They aren't flagged as INSERT/UPDATE values either, as the compiler refuses to render those twice
+    # (ie in the SET clause & in a change-detection condition).
+    bind = value._with_binary_element_type(column.type) if value.type._isnull else value._clone()  # type: ignore
+    bind._is_crud = False
+    return bind
+
+
+def _render_dml_value(compiler: SQLCompiler, column: Column, value: ClauseElement, **kwargs) -> str:
+    if value._is_bind_parameter:  # type: ignore
+        # Name the parameter after the column & give it the column's type, as a plain UPDATE/INSERT would.
+        # Several WHEN clauses can set the same column though, so only the first one gets the column's name.
+        # (a parameter that was already rendered, ie by a change-detection condition, keeps its name)
+        if (value.unique and isinstance(value.key, _truncated_label) and column.key not in compiler.binds  # type: ignore
+                and ("bindparam", value.key) not in compiler.truncated_names):  # type: ignore
+            compiler.truncated_names[("bindparam", value.key)] = column.key  # type: ignore
+        value = _dml_bind(column, value)  # type: ignore
+    else:
+        value = value.self_group()
+
+    return compiler.process(value, **kwargs)
+
+
+# Types BigQuery can't compare with `=`/`IS DISTINCT FROM`, compared through their JSON representation instead
+_NOT_COMPARABLE_TYPES = {"ARRAY", "STRUCT", "JSON", "GEOGRAPHY"}
+
+
+def _changed(dialect: Dialect, column: ColumnElement, value: ClauseElement) -> ColumnElement:
+    if value._is_bind_parameter:  # type: ignore
+        value = _dml_bind(column, value)  # type: ignore
+    type_name = re.split(r"[<(]", dialect.type_compiler.process(column.type))[0]
+
+    if type_name in _NOT_COMPARABLE_TYPES:
+        return func.to_json_string(column).is_distinct_from(func.to_json_string(value))
+    return column.is_distinct_from(value)
+
+
 @compiles(_WhenClause, "bigquery")
 def compile_when_clause(element: _WhenClause[_Ops], compiler: SQLCompiler, **kwargs):
     text = element.when_type()
+    condition = element._full_condition(compiler)
 
-    if element.condition is not None:
-        text += " AND {}".format(compiler.process(element.condition, **kwargs))
+    if condition is not None:
+        text += " AND {}".format(compiler.process(condition, **kwargs))
 
-    # The when_clause specs are ever so slightly different from the classic UPDATE/INSERT/DELETE clauses, so this sucks
+    # The when_clause specs are ever so slightly different from the classic UPDATE/INSERT/DELETE clauses
+    # (no table name), so the actions are rendered from the statements' parameters instead of being compiled.
     if isinstance(element.action, Delete):
-        action_text = "DELETE"  # this one's alright though
+        action_text = "DELETE"
 
     elif isinstance(element.action, Update):
-        action_text = compiler.process(element.action, **kwargs)
-        # remove the `<table>` from `UPDATE <table> SET`
-        action_text = action_text.replace(compiler.process(element.action.table, asfrom=True), "", 1)
+        action_text = "UPDATE SET {}".format(", ".join(
+            "{}={}".format(compiler.preparer.format_column(column), _render_dml_value(compiler, column, value, **kwargs))
+            for column, value in _dml_values(element.action)
+        ))
 
     elif isinstance(element.action, Insert):
-        if not (element.action._values or element.action._ordered_values):  # type: ignore
+        if _inserts_row(element.action):
             action_text = "INSERT ROW"
         else:
-            action_text = compiler.process(element.action, **kwargs)
-            # remove the `INTO <table>` from `INSERT INTO <table> (...) VALUES`, handling the potential aliasing
-            action_text = action_text.replace(f"INTO `{element.action.table.name}` ", "", 1)
+            values = _dml_values(element.action)
+            action_text = "INSERT ({}) VALUES ({})".format(
+                ", ".join(compiler.preparer.format_column(column) for column, _ in values),
+                ", ".join(_render_dml_value(compiler, column, value, **kwargs) for column, value in values),
+            )
 
     else:
         _: NoReturn = element.action
@@ -64,36 +188,106 @@ def compile_when_clause(element: _WhenClause[_Ops], compiler: SQLCompiler, **kwa
 
 
 class WhenMatched(_WhenClause[Union[Update, Delete]]):
+    _traverse_internals = _WhenClause._traverse_internals + [
+        ("skip_unchanged", InternalTraversal.dp_boolean),
+    ]
+
+    def __init__(
+            self,
+            action: Union[Update, Delete],
+            condition: Optional[ColumnElement] = None,
+            skip_unchanged: bool = False,
+    ):
+        """
+        :param skip_unchanged: Only update the rows where at least one of the updated columns actually changes,
+                               ie add `AND (<column> IS DISTINCT FROM <value> OR ...)` to the condition.
+                               NULLs count as values, ARRAY/STRUCT/JSON columns are compared as JSON strings.
+        """
+        assert not skip_unchanged or isinstance(action, Update), "`skip_unchanged` only makes sense with an UPDATE"
+        super().__init__(action, condition)
+        self.skip_unchanged = skip_unchanged
+
+    def _full_condition(self, compiler: SQLCompiler) -> Optional[ColumnElement]:
+        if not self.skip_unchanged:
+            return self.condition
+
+        assert isinstance(self.action, Update)
+        # on update defaults would always count as a change
+        changed = or_(*(
+            _changed(compiler.dialect, column, value) for column, value in _dml_values(self.action, defaults=False)
+        ))
+        return changed if self.condition is None else and_(self.condition, changed)
+
     @classmethod
     def when_type(cls) -> str:
         return "WHEN MATCHED"
 
 
 class WhenNotMatched(_WhenClause[Insert]):
+    inherit_cache = True
+
     @classmethod
     def when_type(cls) -> str:
         return "WHEN NOT MATCHED BY TARGET"
 
 
 class WhenNotMatchedBySource(_WhenClause[Union[Update, Delete]]):
+    inherit_cache = True
+
     @classmethod
     def when_type(cls) -> str:
         return "WHEN NOT MATCHED BY SOURCE"
 
 
 class MergeInto(Executable, ClauseElement):
+    # `when_clauses` is traversed as a list, so the order of the clauses is part of the cache key
+    _traverse_internals = [
+        ("target", InternalTraversal.dp_clauseelement),
+        ("source", InternalTraversal.dp_clauseelement),
+        ("onclause", InternalTraversal.dp_clauseelement),
+        ("when_clauses", InternalTraversal.dp_clauseelement_list),
+        ("partition_predicate", InternalTraversal.dp_clauseelement),
+        ("prune_source_columns", InternalTraversal.dp_boolean),
+        ("dedup_partition_by", InternalTraversal.dp_clauseelement_list),
+        ("dedup_order_by", InternalTraversal.dp_clauseelement),
+    ] + Executable._executable_traverse_internals  # type: ignore
+
     def __init__(
             self,
             target: Table,
             source: Union[Table, Subquery],
             onclause: ColumnElement,
-            when_clauses: List[_WhenClause]
+            when_clauses: List[_WhenClause],
+            partition_column: Optional[str] = None,
+            partition_range: Optional[Tuple[Any, Any]] = None,
+            prune_source_columns: bool = False,
+            deduplicate_on: Optional[Sequence[str]] = None,
+            deduplicate_order_by: Optional[Union[str, ColumnElement]] = None,
     ):
         """
         :param target: Table to be updated
         :param source: Origin of the new data. Must be either a table or a subquery
         :param onclause: SQLAlchemy condition, will be used to match the data between tables
         :param when_clauses: List of [WhenMatched, WhenNotMatched, WhenNotMatchedBySource] instances
+        :param partition_column: Name of the target's partition column, the source must have a column of the same name.
+                                 If given, the ON clause & the WHEN NOT MATCHED BY SOURCE conditions are restricted
+                                 to the partitions found in the source, so BigQuery doesn't scan the other ones.
+                                 Note that this means WHEN NOT MATCHED BY SOURCE only applies to those partitions too,
+                                 & that the target rows outside of those partitions aren't matched at all: if a key's
+                                 row moves to another partition, its old row isn't matched & an upsert inserts a
+                                 second one. So a key's partition must never change (or be part of the key).
+        :param partition_range: (min, max) of the source's partitions, if known beforehand.
+                                Restricts the partitions with a literal range, rather than with a
+                                `IN (SELECT DISTINCT <partition_column> FROM <source>)` semi-join.
+        :param prune_source_columns: Only read the source columns the statement actually uses, by wrapping the
+                                     source in a projection of those (BigQuery bills every column it reads).
+                                     An `INSERT ROW` takes every source column, it isn't pruned then.
+        :param deduplicate_on: Names of the source columns identifying a row. Only one source row per key is merged,
+                               so a target row can't match several of them (which fails the whole statement).
+                               ie `USING (SELECT ... QUALIFY ROW_NUMBER() OVER (PARTITION BY <deduplicate_on>) = 1)`
+        :param deduplicate_order_by: Which row of a key to keep: the first one in that order. Either a source column
+                                     name, the greatest value being kept (ie the latest `updated_at`), or an
+                                     expression like `source.c.version.asc()`. Any row is kept if not given.
         """
         assert when_clauses, "An MERGE INTO statement requires at least one `when_clause`"
         assert not isinstance(source, SelectBase), "A source should not be a Selectable. If you intend to pass a subquery " \
@@ -106,37 +300,492 @@ class MergeInto(Executable, ClauseElement):
         self.source = source
         self.onclause = onclause
         self.when_clauses = when_clauses
+        self.partition_predicate = self._partition_predicate(partition_column, partition_range)
+        self.prune_source_columns = prune_source_columns
+
+        assert deduplicate_on or deduplicate_order_by is None, "`deduplicate_order_by` requires `deduplicate_on`"
+        self.dedup_partition_by = [source.c[name] for name in deduplicate_on or []]
+        self.dedup_order_by = (
+            source.c[deduplicate_order_by].desc() if isinstance(deduplicate_order_by, str) else deduplicate_order_by
+        )
+
+    def _partition_predicate(
+            self,
+            partition_column: Optional[str],
+            partition_range: Optional[Tuple[Any, Any]],
+    ) -> Optional[ColumnElement]:
+        if partition_column is None:
+            assert partition_range is None, "A `partition_range` requires a `partition_column`"
+            return None
+
+        column = self.target.c[partition_column]
+
+        if partition_range is not None:
+            return column.between(*partition_range)
+
+        return column.in_(select(self.source.c[partition_column]).distinct())
+
+    @classmethod
+    def upsert(
+            cls,
+            target: Table,
+            source: Union[Table, Subquery],
+            key_columns: Sequence[str],
+            columns: Optional[Sequence[str]] = None,
+            when_clauses: Optional[Callable[[Union[Table, Subquery]], List[_WhenClause]]] = None,
+            skip_unchanged: bool = False,
+            **kwargs,
+    ) -> "MergeInto":
+        """
+        MERGE INTO statement matching the target & source rows on `key_columns`, the source
+        having the same column names as the target.
+
+        :param target: Table to be updated
+        :param source: Origin of the new data. Must be either a table or a subquery
+        :param key_columns: Names of the columns identifying a row, used to match the target & source rows
+        :param columns: Names of the columns to merge, defaults to all the target's columns
+        :param when_clauses: Builds the WHEN clauses out of the source.
+                             Defaults to updating the matched rows & inserting the others.
+        :param skip_unchanged: Leave the matched rows that wouldn't change alone, see `WhenMatched`.
+                               Only applies to the default WHEN clauses.
+        :param kwargs: Other `__init__` parameters (partition_column, etc)
+        """
+        assert key_columns, "At least one key column is required to match the rows"
+        merged_columns = [target.c[name] for name in (columns or target.c.keys())]
+
+        def upsert_clauses(source: Union[Table, Subquery]) -> List[_WhenClause]:
+            values = {column: source.c[column.name] for column in merged_columns}
+            updated = {column: value for column, value in values.items() if column.name not in key_columns}
+
+            clauses: List[_WhenClause] = [WhenNotMatched(insert(target).values(values))]
+            if updated:
+                clauses.insert(0, WhenMatched(update(target).values(updated), skip_unchanged=skip_unchanged))
+            return clauses
+
+        return cls(
+            target=target,
+            source=source,
+            onclause=and_(*(target.c[key] == source.c[key] for key in key_columns)),
+            when_clauses=(when_clauses or upsert_clauses)(source),
+            **kwargs,
+        )
+
+    @classmethod
+    def scd2(
+            cls,
+            target: Table,
+            source: Union[Table, Subquery],
+            key_columns: Sequence[str],
+            tracked_columns: Optional[Sequence[str]] = None,
+            columns: Optional[Sequence[str]] = None,
+            valid_from: str = "valid_from",
+            valid_to: str = "valid_to",
+            current_flag: Optional[str] = None,
+            effective_at: Optional[Union[str, ColumnElement]] = None,
+            open_valid_to: Any = None,
+            **kwargs,
+    ) -> "MergeInto":
+        """
+        MERGE INTO statement keeping the history of the source's rows in `target` (a slowly changing dimension,
+        type 2): when a tracked column of a row changes, its current version is closed & the new one inserted.
+        Rows with new keys are inserted, unchanged ones left alone.
+
+        All of that in a single (atomic) statement rather than an UPDATE & an INSERT. The target is still read twice:
+        the source is used twice, with a merge key:
+          - as is, matching the current versions: the ones that changed are closed, the new keys inserted
+          - the changed rows only, found by joining the current versions, with a NULL merge key:
+            they never match, & are inserted as new versions
+
+        :param target: History table, with the columns of the source & the validity columns
+        :param source: Latest version of the rows, at most one per key
+        :param key_columns: Names of the columns identifying a row (not a version)
+        :param tracked_columns: Names of the columns whose changes make a new version, defaults to all the non-key ones
+        :param columns: Names of the columns to insert (besides the validity ones), defaults to all the target's
+        :param valid_from: Name of the target column holding when a version starts
+        :param valid_to: Name of the target column holding when a version ends, `open_valid_to` for current ones
+        :param current_flag: Name of a target BOOL column flagging the current versions, if any
+        :param effective_at: When the source's changes happened: the name of a source column, or an expression.
+                             Defaults to the current date/datetime/timestamp, depending on `valid_from`'s type.
+        :param open_valid_to: `valid_to` of the current versions, NULL by default (ie `TIMESTAMP '9999-12-31'`)
+        :param kwargs: Other `__init__` parameters (partition_column, etc)
+        """
+        assert key_columns, "At least one key column is required to match the rows"
+        # the versions to close & to insert share their key
+        assert not kwargs.get("deduplicate_on"), "Deduplicate the source itself, not the versions built out of it"
+        validity = {valid_from, valid_to, current_flag}
+        inserted = [name for name in (columns or target.c.keys()) if name not in validity]
+        tracked = tracked_columns or [name for name in inserted if name not in key_columns]
+        assert tracked, "At least one tracked column is required to tell versions apart"
+
+        def is_current(table: FromClause) -> ColumnElement:
+            column = table.c[valid_to]
+            return column.is_(None) if open_valid_to is None else column == open_valid_to
+
+        def changed(current: FromClause, new: FromClause) -> ColumnElement:
+            # grouped, so it reads as a single condition after `WHEN MATCHED AND`
+            return or_(*(_changed(bigquery_dialect(), current.c[name], new.c[name]) for name in tracked)).self_group() \
+                if len(tracked) > 1 else _changed(bigquery_dialect(), current.c[tracked[0]], new.c[tracked[0]])
+
+        merge_keys = [f"_merge_key_{name}" for name in key_columns]
+
+        # the target's current versions the source rows change
+        current = getattr(target, "original", target).alias("_current")
+        new_versions = select(*(null().label(merge_key) for merge_key in merge_keys), source) \
+            .select_from(source.join(current, and_(
+                *(current.c[key] == source.c[key] for key in key_columns),
+                is_current(current),
+            ))) \
+            .where(changed(current, source))
+
+        versions = union_all(
+            select(*(source.c[key].label(merge_key) for key, merge_key in zip(key_columns, merge_keys)), source),
+            new_versions,
+        ).subquery(_source_name(source))
+
+        if effective_at is None:
+            # CURRENT_DATE(), CURRENT_DATETIME() or CURRENT_TIMESTAMP(), whichever `valid_from` holds
+            type_ = target.c[valid_from].type
+            effective: ColumnElement = Function(f"CURRENT_{bigquery_dialect().type_compiler.process(type_)}", type_=type_)
+        else:
+            effective = versions.c[effective_at] if isinstance(effective_at, str) else effective_at
+
+        closed = {valid_to: effective}
+        opened = {
+            valid_from: effective,
+            valid_to: null() if open_valid_to is None else literal(open_valid_to, target.c[valid_to].type),
+        }
+        if current_flag is not None:
+            closed[current_flag], opened[current_flag] = false(), true()
+
+        return cls(
+            target=target,
+            source=versions,
+            onclause=and_(
+                *(target.c[key] == versions.c[merge_key] for key, merge_key in zip(key_columns, merge_keys)),
+                is_current(target),
+            ),
+            when_clauses=[
+                WhenMatched(update(target).values(closed), condition=changed(target, versions)),
+                WhenNotMatched(insert(target).values({**{name: versions.c[name] for name in inserted}, **opened})),
+            ],
+            **kwargs,
+        )
+
+    @classmethod
+    def from_rows(
+            cls,
+            target: Table,
+            rows: Iterable[Row],
+            key_columns: Sequence[str],
+            columns: Optional[Sequence[str]] = None,
+            when_clauses: Optional[Callable[[Union[Table, Subquery]], List[_WhenClause]]] = None,
+            literal_binds: bool = False,
+            max_size: Optional[int] = None,
+            max_rows: Optional[int] = None,
+            partition_column: Optional[str] = None,
+            **kwargs,
+    ) -> Iterator["MergeInto"]:
+        """
+        Upsert in-memory rows into `target`, using `UNNEST(<rows>)` as the source (see `rows.rows_source`).
+        The rows are split in as many MERGE INTO statements as needed to stay under BigQuery's limits.
+        Each statement is compiled to make sure of it: the rows of a statement still going over the limits
+        are sent as a query parameter rather than inlined, or split further. That compilation is kept for the
+        statement's execution (see `client.compile_statement`).
+
+        :param rows: Rows to merge, as mappings keyed by column name
+        :param literal_binds: Render the rows inline rather than as a single ARRAY<STRUCT> query parameter.
+                              Rows with values that can't be rendered inline (ie JSON) are sent as a parameter.
+        :param max_size: Size budget of a statement's rows, see `rows.chunk_rows`
+        :param max_rows: Maximum number of rows per statement, if any
+        :param partition_column: Name of the target's partition column.
+                                 The partitions are pruned using the range of each statement's rows.
+
+        See `upsert` for the other parameters.
+        """
+        merged_columns = [target.c[name] for name in (columns or target.c.keys())]
+        literal_binds = literal_binds and renders_literals(merged_columns)
+
+        def statement(chunk: List[Row], literal_binds: bool) -> MergeInto:
+            source = rows_source(merged_columns, chunk, literal_binds)
+
+            partition_range = None
+            if partition_column is not None:
+                partitions: List[Any] = [row.get(partition_column) for row in chunk]
+                # a NULL partition can't be part of a range, scan the source's partitions (whatever they are) instead
+                if None not in partitions:
+                    partition_range = (min(partitions), max(partitions))
+
+            return cls.upsert(
+                target, source, key_columns, columns, when_clauses,
+                partition_column=partition_column, partition_range=partition_range, **kwargs
+            )
+
+        def fitted(chunk: List[Row], literal_binds: bool) -> Iterator[MergeInto]:
+            # The chunks' sizes are estimated, the rest of the statement (WHEN clauses, etc) isn't accounted for:
+            # a statement over the limits has its rows sent as a parameter instead, or split in two.
+            # One that fits is kept compiled, for its execution.
+            merge = statement(chunk, literal_binds)
+            try:
+                compile_statement(merge, keep=True)
+            except StatementTooLarge:
+                if literal_binds:
+                    yield from fitted(chunk, False)
+                elif len(chunk) > 1:
+                    yield from fitted(chunk[:len(chunk) // 2], False)
+                    yield from fitted(chunk[len(chunk) // 2:], False)
+                else:
+                    raise
+            else:
+                yield merge
+
+        for chunk in chunk_rows(merged_columns, rows, literal_binds, max_size, max_rows):
+            yield from fitted(chunk, literal_binds)
+
+    @classmethod
+    def from_batch(
+            cls,
+            target: Table,
+            batch: Any,
+            key_columns: Sequence[str],
+            columns: Optional[Sequence[str]] = None,
+            when_clauses: Optional[Callable[[Union[Table, Subquery]], List[_WhenClause]]] = None,
+            max_size: Optional[int] = None,
+            max_rows: Optional[int] = None,
+            partition_column: Optional[str] = None,
+            **kwargs,
+    ) -> Iterator["MergeInto"]:
+        """
+        Upsert a columnar batch into `target`, without a dict per row: each column is a query parameter
+        (see `columnar.batch_source`). Like `from_rows`, the batch is split in as many MERGE INTO statements
+        as needed to stay under BigQuery's limits.
+
+        :param batch: pyarrow RecordBatch/Table or pandas DataFrame. Its columns are cast to the target's types.
+        :param max_size: Size budget of a statement's parameters, see `columnar.chunk_batch`
+        :param max_rows: Maximum number of rows per statement, if any
+        :param partition_column: Name of the target's partition column.
+                                 The partitions are pruned using the range of each statement's rows.
+
+        See `upsert` for the other parameters.
+        """
+        import pyarrow.compute  # type: ignore
+
+        merged_columns = [target.c[name] for name in (columns or target.c.keys())]
+
+        def fitted(data) -> Iterator[MergeInto]:
+            partition_range = None
+            if partition_column is not None and not data.column(partition_column).null_count:
+                bounds = pyarrow.compute.min_max(data.column(partition_column))
+                partition_range = (bounds["min"].as_py(), bounds["max"].as_py())
+
+            merge = cls.upsert(
+                target, batch_source(merged_columns, data), key_columns, columns, when_clauses,
+                partition_column=partition_column, partition_range=partition_range, **kwargs
+            )
+            try:
+                compile_statement(merge, keep=True)
+            except StatementTooLarge:
+                # the slices' sizes are estimated
+                if data.num_rows == 1:
+                    raise
+                yield from fitted(data.slice(0, data.num_rows // 2))
+                yield from fitted(data.slice(data.num_rows // 2))
+            else:
+                yield merge
+
+        for data in chunk_batch(merged_columns, batch, max_size, max_rows):
+            yield from fitted(data)
+
+    def with_job_options(self, **options) -> "MergeInto":
+        """
+        A copy of the statement, run with `options` (ie `maximum_bytes_billed`, `labels`, `priority="BATCH"`),
+        see `client.with_job_options`.
+        """
+        return with_job_options(self, **options)
+
+    def estimate(self, client: JobClient, **options) -> int:
+        """
+        Number of bytes the statement would process, from a dry run (see `client.dry_run`).
+        Raises a `client.BytesBudgetExceeded` if that's over the statement's `maximum_bytes_billed`.
+        """
+        return dry_run(client, self, **options)
+
+
+def _restrict(when_clause: _WhenClause, predicate: ColumnElement) -> _WhenClause:
+    restricted = when_clause._clone()  # type: ignore
+    restricted.condition = predicate if when_clause.condition is None else and_(when_clause.condition, predicate)
+    return restricted
+
+
+def _referenced_columns(source: Union[Table, Subquery], elements: Iterable[ClauseElement]) -> Set[ColumnElement]:
+    referenced: Set[ColumnElement] = set()
+    stack = list(elements)
+
+    while stack:
+        element = stack.pop()
+        if element is source:
+            # don't walk the source's own columns, they'd all look used (ie in a `SELECT ... FROM <source>`)
+            continue
+        if isinstance(element, ColumnClause) and element.table is source:
+            referenced.add(element)
+        stack.extend(element.get_children())
+
+    return referenced
+
+
+def _source_name(source: Union[Table, Subquery]) -> Optional[str]:
+    """
+    Name to give to a subquery wrapping `source`, so the statement stays readable
+    """
+    name = source.name.split(".")[-1] if isinstance(source, Table) else source.name  # type: ignore
+    return None if isinstance(name, _anonymous_label) else name
+
+
+def _source_replacer(source: Union[Table, Subquery], replacement: FromClause) -> Callable[[C], C]:
+    """
+    :return: Function pointing the references to `source` in a clause to `replacement`, a subquery selecting from it
+             (or a table with the same columns)
+    """
+    def replace(element: ClauseElement) -> Optional[ClauseElement]:
+        # only the source's own columns: a `ClauseAdapter` would also rewrite the columns the source is derived from,
+        # which can be the target's (ie `USING (SELECT ... FROM target)`)
+        if isinstance(element, ColumnClause) and element.table is source:
+            column = replacement.corresponding_column(element)
+            # a table the source was copied into has the same columns, but isn't derived from it
+            return column if column is not None else replacement.c[element.key]
+        return None
+
+    def traverse(clause: C) -> C:
+        return replacement_traverse(clause, {}, replace)
+
+    return traverse
+
+
+def _with_source(merge: MergeInto, replacement: FromClause) -> MergeInto:
+    """
+    :return: A copy of `merge` using `replacement` (derived from its source, or with the same columns) as its source
+    """
+    replace_source = _source_replacer(merge.source, replacement)
+
+    copy = merge._clone()  # type: ignore
+    copy.source = replacement
+    copy.onclause = replace_source(merge.onclause)
+    copy.when_clauses = [replace_source(clause) for clause in merge.when_clauses]
+    if merge.partition_predicate is not None:
+        copy.partition_predicate = replace_source(merge.partition_predicate)
+    copy.dedup_partition_by = [replace_source(column) for column in merge.dedup_partition_by]
+    if merge.dedup_order_by is not None:
+        copy.dedup_order_by = replace_source(merge.dedup_order_by)
+
+    return copy
+
+
+def _filter_source(merge: MergeInto, predicate: Callable[[Union[Table, Subquery]], ColumnElement]) -> MergeInto:
+    """
+    :return: A copy of `merge` only merging the source rows matching `predicate` (built from the source)
+    """
+    source = merge.source
+    return _with_source(merge, select(source).where(predicate(source)).subquery(_source_name(source)))
+
+
+def _deduplicate_source(
+        source: Union[Table, Subquery],
+        partition_by: List[ColumnElement],
+        order_by: Optional[ColumnElement],
+) -> Subquery:
+    row_number = func.row_number().over(partition_by=partition_by, order_by=order_by)
+
+    # SQLAlchemy has no QUALIFY, but it can go where the suffixes go.
+    # BigQuery wants a WHERE (or GROUP BY/HAVING) along with it.
+    deduplicated = select(source).where(true()).suffix_with(text("QUALIFY"), row_number == literal_column("1"))
+    return deduplicated.subquery(_source_name(source))
+
+
+def _prune_source_columns(
+        source: Union[Table, Subquery],
+        onclause: ColumnElement,
+        when_clauses: List[_WhenClause],
+) -> Tuple[Union[Table, Subquery], ColumnElement, List[_WhenClause]]:
+    """
+    Wraps `source` in a projection of the columns `onclause` & `when_clauses` use,
+    & points those to the projection instead.
+    """
+    if any(_inserts_row(clause.action) for clause in when_clauses):
+        # INSERT ROW takes every source column, by position
+        return source, onclause, when_clauses
+
+    referenced = _referenced_columns(source, [onclause, *when_clauses])
+    columns = [column for column in source.c if column in referenced]
+
+    if not columns:
+        return source, onclause, when_clauses
+
+    projection = select(*columns).subquery(_source_name(source))
+    replace_source = _source_replacer(source, projection)
+
+    return projection, replace_source(onclause), [replace_source(clause) for clause in when_clauses]
 
 
 @compiles(MergeInto, "bigquery")
 def compile_merge_into(element: MergeInto, compiler: SQLCompiler, **kwargs):
+    if not events.observers:
+        return _compile_merge_into(element, compiler, None, **kwargs)
+
+    started, binds = perf_counter(), len(compiler.binds)
+    when_clause_times: List[float] = []
+    text = _compile_merge_into(element, compiler, when_clause_times, **kwargs)
+
+    events.notify(events.MergeCompiled(
+        element, perf_counter() - started, when_clause_times, len(text), len(compiler.binds) - binds,
+    ))
+    return text
+
+
+def _compile_merge_into(
+        element: MergeInto,
+        compiler: SQLCompiler,
+        when_clause_times: Optional[List[float]],
+        **kwargs,
+) -> str:
     base_template = dedent("""\
         MERGE INTO {target}
         USING {source}
         ON {cond}
     """)
 
-    # Compile the INSERT/UPDATE/DELETE parts first.
-    # This is because CTEs in the `source` value (and elsewhere, but there really shouldn't
-    # ever be a CTE in `target` and/or `cond`) would appear in the INSERT/UPDATE (SQLAlchemy
-    # sees a CTE in the context, so it pushes it to the top of the INSERT/UPDATE part).
-    # This feels pretty hackish, but it works well for now.
-    # Another solution might be to process the `when_clauses` in a copy() of the compiler
-    # with the .ctes emptied, ie in a "blank" state.
-    actions = []
-    for when_clause in element.when_clauses:
-        actions.append(compiler.process(when_clause, **kwargs))
+    source = element.source
+    onclause = element.onclause
+    when_clauses = element.when_clauses
+
+    if element.partition_predicate is not None:
+        onclause = and_(onclause, element.partition_predicate)
+        when_clauses = [
+            _restrict(when_clause, element.partition_predicate) if isinstance(when_clause, WhenNotMatchedBySource)
+            else when_clause
+            for when_clause in when_clauses
+        ]
+
+    if element.dedup_partition_by:
+        source = _deduplicate_source(source, element.dedup_partition_by, element.dedup_order_by)
+        replace_source = _source_replacer(element.source, source)
+        onclause, when_clauses = replace_source(onclause), [replace_source(clause) for clause in when_clauses]
+
+    if element.prune_source_columns:
+        source, onclause, when_clauses = _prune_source_columns(source, onclause, when_clauses)
 
     query = base_template.format(
         target=compiler.process(element.target, asfrom=True, **kwargs),
-        source=compiler.process(element.source, asfrom=True, **kwargs),
-        cond=compiler.process(element.onclause, **kwargs),
+        source=compiler.process(source, asfrom=True, **kwargs),
+        cond=compiler.process(onclause, **kwargs),
     )
 
-    query += "".join(actions)
-
-    # deactivate all "fetch PK" or "implicit-returning" features
-    # XXX should we set isdelete = False too?
-    compiler.isinsert = compiler.isupdate = False
+    # The actions aren't compiled as INSERT/UPDATE statements (see `compile_when_clause`),
+    # so CTEs in the `source` stay in the USING subquery and never get hoisted into the actions.
+    if when_clause_times is None:
+        query += "".join(compiler.process(when_clause, **kwargs) for when_clause in when_clauses)
+    else:
+        for when_clause in when_clauses:
+            started = perf_counter()
+            query += compiler.process(when_clause, **kwargs)
+            when_clause_times.append(perf_counter() - started)
 
     return dedent(query)
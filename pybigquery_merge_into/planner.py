@@ -0,0 +1,170 @@
+"""
+Picks the cheapest statement doing the same as a `MergeInto`: a MERGE has to join the source with the target
+& rewrite the matched data, which isn't always needed.
+"""
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import and_, delete, exists, false, insert, select
+from sqlalchemy.engine import Dialect
+from sqlalchemy.sql import ClauseElement, ColumnElement, operators
+from sqlalchemy.sql.dml import Insert, Update
+from sqlalchemy.sql.elements import BinaryExpression, BooleanClauseList, ColumnClause
+
+from pybigquery_merge_into.client import compile_statement
+from pybigquery_merge_into.merge_clause import (
+    MergeInto, WhenMatched, WhenNotMatched, WhenNotMatchedBySource, _deduplicate_source, _dml_values, _source_replacer,
+)
+
+
+class Strategy(Enum):
+    MERGE = "merge"
+    # INSERT ... SELECT, skipping the source rows matching a target one
+    INSERT_MISSING = "insert_missing"
+    # INSERT ... SELECT, all of the source
+    APPEND = "append"
+    # MERGE ... ON FALSE, deleting the target's partitions & inserting the source
+    PARTITION_OVERWRITE = "partition_overwrite"
+
+
+class Plan(NamedTuple):
+    strategy: Strategy
+    statement: ClauseElement
+    reasons: List[str]
+
+    def explain(self, dialect: Optional[Dialect] = None) -> str:
+        """
+        :return: The chosen strategy, why, & the SQL it runs
+        """
+        sql, _ = compile_statement(self.statement, dialect)
+        return "Strategy: {}\n{}\n\n{}".format(
+            self.strategy.value,
+            "\n".join(f"- {reason}" for reason in self.reasons),
+            sql.strip(),
+        )
+
+
+def _key_pairs(merge: MergeInto) -> Set[Tuple[str, str]]:
+    """
+    (target column, source column) names the ON clause requires to be equal, ie `target.id = source.id AND ...`
+    """
+    onclause = merge.onclause
+    clauses = onclause.clauses if isinstance(onclause, BooleanClauseList) and onclause.operator is operators.and_ \
+        else [onclause]
+
+    pairs = set()
+    for clause in clauses:
+        if isinstance(clause, BinaryExpression) and clause.operator is operators.eq:
+            for left, right in [(clause.left, clause.right), (clause.right, clause.left)]:
+                if isinstance(left, ColumnClause) and isinstance(right, ColumnClause) \
+                        and left.table is merge.target and right.table is merge.source:
+                    pairs.add((left.name, right.key))
+    return pairs
+
+
+def _inserted(merge: MergeInto, action: Insert) -> Dict[str, ClauseElement]:
+    values = _dml_values(action)
+    if not values:
+        # INSERT ROW, the source's columns in order
+        return {column.name: value for column, value in zip(merge.target.c, merge.source.c)}
+    return {column.name: value for column, value in values}
+
+
+def _replaces_rows(merge: MergeInto, update: Update, insert_: Insert) -> Optional[str]:
+    """
+    Whether updating a matched row gives the same row as inserting it, ie deleting & inserting is the same.
+    :return: Why not, None if it does
+    """
+    inserted = _inserted(merge, insert_)
+    updated = {column.name: value for column, value in _dml_values(update)}
+    keys = _key_pairs(merge)
+
+    missing = [column.name for column in merge.target.c if column.name not in inserted]
+    if missing:
+        return "the INSERT doesn't set {}, the matched rows' values would be lost".format(", ".join(missing))
+
+    for name, value in inserted.items():
+        if name in updated:
+            if not updated[name].compare(value):
+                return f"`{name}` is updated & inserted with different values"
+        elif not (isinstance(value, ColumnClause) and value.table is merge.source and (name, value.key) in keys):
+            return f"`{name}` isn't updated, the matched rows' values would be lost"
+
+    return None
+
+
+def _insert_select(merge: MergeInto, clause: WhenNotMatched, skip_matched: bool) -> Insert:
+    source = merge.source
+    if merge.dedup_partition_by:
+        source = _deduplicate_source(source, merge.dedup_partition_by, merge.dedup_order_by)
+    replace_source = _source_replacer(merge.source, source)
+
+    inserted = _inserted(merge, clause.action)
+    conditions: List[ColumnElement] = [] if clause.condition is None else [clause.condition]
+    if skip_matched:
+        matched = merge.onclause if merge.partition_predicate is None else and_(merge.onclause, merge.partition_predicate)
+        # correlated to the source, the only other table of the outer SELECT
+        conditions.append(~exists().where(matched))
+
+    query = select(*(replace_source(value) for value in inserted.values())) \
+        .select_from(source) \
+        .where(*(replace_source(condition) for condition in conditions))
+    return insert(getattr(merge.target, "original", merge.target)).from_select(list(inserted), query)
+
+
+def plan_merge(merge: MergeInto, covers_partitions: bool = False, new_keys_only: bool = False) -> Plan:
+    """
+    Pick the cheapest way to do what `merge` does:
+     * A merge only inserting rows (a single WHEN NOT MATCHED clause) is an `INSERT ... SELECT` of the source rows
+       without a match. Unlike a MERGE, an INSERT never conflicts with concurrent DML statements.
+       With `new_keys_only`, there's no need to look for matches, it's a plain append.
+     * An upsert of partitions the source has all of the rows of (`covers_partitions`, along with a `partition_column`)
+       replaces those partitions, ie `MERGE ... ON FALSE WHEN NOT MATCHED BY SOURCE AND <partitions> THEN DELETE
+       WHEN NOT MATCHED THEN INSERT`: no join with the target.
+     * Anything else stays a MERGE.
+
+    :param covers_partitions: The source holds the whole new content of the partitions it has rows of
+                              (or of the `partition_range`). With duplicate keys in the source, replacing the
+                              partitions inserts all of them, where the MERGE would fail.
+    :param new_keys_only: None of the source's keys are in the target already
+    """
+    clauses = merge.when_clauses
+    reasons: List[str] = []
+
+    if len(clauses) == 1 and isinstance(clauses[0], WhenNotMatched):
+        if new_keys_only:
+            reasons += ["only inserts rows", "the source's keys are all new, no need to look for matches"]
+            return Plan(Strategy.APPEND, _insert_select(merge, clauses[0], skip_matched=False), reasons)
+
+        reasons += ["only inserts rows", "an INSERT doesn't conflict with concurrent DML, unlike a MERGE"]
+        return Plan(Strategy.INSERT_MISSING, _insert_select(merge, clauses[0], skip_matched=True), reasons)
+
+    if covers_partitions:
+        why_not = None
+        if merge.partition_predicate is None:
+            why_not = "no `partition_column` to know which partitions to replace"
+        elif not (len(clauses) == 2 and isinstance(clauses[0], WhenMatched) and isinstance(clauses[1], WhenNotMatched)
+                  and isinstance(clauses[0].action, Update)):
+            why_not = "not an upsert (a WHEN MATCHED UPDATE followed by a WHEN NOT MATCHED INSERT)"
+        elif clauses[0].condition is not None or clauses[1].condition is not None:
+            why_not = "conditional WHEN clauses"
+        else:
+            why_not = _replaces_rows(merge, clauses[0].action, clauses[1].action)
+
+        if why_not is None:
+            overwrite = merge._clone()  # type: ignore
+            overwrite.onclause = false()
+            overwrite.when_clauses = [WhenNotMatchedBySource(delete(merge.target), merge.partition_predicate), clauses[1]]
+            overwrite.partition_predicate = None
+
+            reasons += ["upserts partitions the source covers", "replacing them doesn't join the source with the target"]
+            return Plan(Strategy.PARTITION_OVERWRITE, overwrite, reasons)
+
+        reasons.append(f"can't replace the partitions: {why_not}")
+
+    if any(isinstance(clause, (WhenMatched, WhenNotMatchedBySource)) for clause in clauses):
+        reasons.append("updates or deletes existing rows")
+    else:
+        reasons.append("several WHEN NOT MATCHED clauses, the first matching one applies")
+
+    return Plan(Strategy.MERGE, merge, reasons)
@@ -0,0 +1,103 @@
+from typing import Any, Callable, Dict, Mapping, Optional, Set
+
+from sqlalchemy.types import TypeEngine
+
+from pybigquery_merge_into._dialect import bigquery_dialect
+from pybigquery_merge_into.client import Job, JobClient, check_limits, job_options
+from pybigquery_merge_into.merge_clause import MergeInto
+
+
+def _bind_processors(types: Mapping[str, TypeEngine]) -> Dict[str, Callable[[Any], Any]]:
+    dialect = bigquery_dialect()
+    processors = {name: type_._cached_bind_processor(dialect) for name, type_ in types.items()}  # type: ignore
+    return {name: processor for name, processor in processors.items() if processor is not None}
+
+
+class PreparedMerge:
+    """
+    `MergeInto` compiled once, to be run many times with different parameter values.
+    Running it only binds the new values, the clause tree isn't rebuilt & the SQL isn't recompiled.
+
+    The parameters are named after the bind parameters of the statement, see `parameter_names`.
+    Use `bindparam("<name>")` in the statement to give them meaningful names.
+
+    Callable values (ie `Column(onupdate=datetime.utcnow)`) are called again on each run.
+    Instances can be pickled (ie sent to a process pool's workers) without recompiling anything,
+    unless they have such values.
+    """
+
+    def __init__(self, statement: MergeInto):
+        compiled = statement.compile(dialect=bigquery_dialect())
+
+        self.sql = str(compiled)
+        # `bindparam("<name>")` without a value has to be given one on every run
+        self.required: Set[str] = {name for bind, name in compiled.bind_names.items() if bind.required}
+        self.types: Dict[str, TypeEngine] = {name: bind.type for bind, name in compiled.bind_names.items()}
+        self.options = job_options(statement)
+
+        self._processors = _bind_processors(self.types)
+        self._callables: Dict[str, Callable[[], Any]] = {
+            name: bind.callable for bind, name in compiled.bind_names.items() if bind.callable is not None
+        }
+        self.defaults = self._process({
+            name: value for name, value in (compiled.construct_params(_check=False) or {}).items()
+            if name not in self._callables
+        })
+
+    @property
+    def parameter_names(self) -> Set[str]:
+        return set(self.types)
+
+    def _process(self, values: Mapping[str, Any]) -> Dict[str, Any]:
+        # same as what `Connection.execute` would do, ie go through the types' bind processors
+        processors = self._processors
+        return {
+            name: processors[name](value) if name in processors else value
+            for name, value in values.items()
+        }
+
+    def parameters(self, values: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+        """
+        :param values: New values of (some of) the parameters, the others keep the statement's values
+        :return: The parameters to submit `sql` with
+        """
+        values = values or {}
+
+        unknown = values.keys() - self.types.keys()
+        assert not unknown, f"Unknown parameters: {sorted(unknown)}"
+        missing = self.required - values.keys()
+        assert not missing, f"Missing values for the required parameters: {sorted(missing)}"
+
+        called = {name: function() for name, function in self._callables.items() if name not in values}
+        return {**self.defaults, **self._process({**called, **values})}
+
+    def submit(self, client: JobClient, values: Optional[Mapping[str, Any]] = None, **options) -> Job:
+        """
+        Submit the statement with the given parameter values, without waiting for it to finish.
+
+        :param options: `google.cloud.bigquery.QueryJobConfig` attributes, on top of the statement's own
+        """
+        parameters = self.parameters(values)
+        check_limits(self.sql, parameters)
+
+        return client.query(self.sql, parameters, **{**self.options, **options})
+
+    def execute(self, client: JobClient, values: Optional[Mapping[str, Any]] = None, **options) -> Job:
+        """
+        Same as `submit`, but waits for the statement to finish.
+        """
+        job = self.submit(client, values, **options)
+        job.result()
+
+        return job
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the processors might be closures, they're rebuilt out of the types instead
+        assert not self._callables, "Statements with callable values (ie column defaults) can't be pickled"
+        state = self.__dict__.copy()
+        del state["_processors"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._processors = _bind_processors(self.types)
@@ -0,0 +1,157 @@
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+from sqlalchemy import ARRAY, Column, bindparam, column, select
+from sqlalchemy.engine import Dialect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import ColumnElement, Subquery
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import Function
+from sqlalchemy.types import UserDefinedType
+
+from pybigquery_merge_into._dialect import bigquery_dialect
+
+# https://cloud.google.com/bigquery/quotas#query_jobs
+MAX_QUERY_LENGTH = 1024 * 1024  # characters
+MAX_REQUEST_SIZE = 10 * 1024 * 1024  # bytes, this is what bounds the query parameters
+MAX_QUERY_PARAMETERS = 10_000
+
+# What a chunk of rows is allowed to use of the limits above, the rest of the statement has to fit too
+DEFAULT_MAX_LITERALS_SIZE = int(MAX_QUERY_LENGTH * 0.9)
+DEFAULT_MAX_PARAMETER_SIZE = int(MAX_REQUEST_SIZE * 0.9)
+
+Row = Mapping[str, Any]
+
+
+def _struct_spec(dialect: Dialect, columns: Sequence[Column]) -> str:
+    # Field names are left unquoted: the DB-API only parses plain identifiers in its parameters' types
+    return "STRUCT<{}>".format(", ".join(f"{c.name} {dialect.type_compiler.process(c.type)}" for c in columns))
+
+
+class _StructType(UserDefinedType):
+    """
+    STRUCT<...> type, the fields being the given columns. Values are dicts keyed by column name.
+
+    Only used for the rows of `rows_source`, ie as `ARRAY(_StructType(columns))`.
+    """
+    cache_ok = True
+
+    def __init__(self, columns: Sequence[Column]):
+        self.columns = tuple(columns)
+
+    def get_col_spec(self, **kw):
+        # The dialect isn't passed down to user-defined types, but this one only makes sense for bigquery anyway
+        return _struct_spec(bigquery_dialect(), self.columns)
+
+
+def renders_literals(columns: Sequence[Column], dialect: Optional[Dialect] = None) -> bool:
+    """
+    Whether the values of `columns` can be rendered inline, which isn't the case of some types (ie JSON).
+    """
+    dialect = dialect or bigquery_dialect()
+    try:
+        return all(c.type._cached_literal_processor(dialect) is not None for c in columns)  # type: ignore
+    except NotImplementedError:
+        return False
+
+
+class _RowsLiteral(ColumnElement):
+    """
+    Inline ARRAY<STRUCT<...>> literal, ie `ARRAY<STRUCT<a INT64, b STRING>>[STRUCT(1, 'x'), ...]`.
+
+    Not cached, as the values are part of the compiled string.
+    """
+    inherit_cache = False
+
+    def __init__(self, columns: Sequence[Column], rows: Sequence[Row]):
+        self.columns = tuple(columns)
+        self.rows = rows
+        self.type = ARRAY(_StructType(self.columns))
+
+
+@compiles(_RowsLiteral, "bigquery")
+def compile_rows_literal(element: _RowsLiteral, compiler: SQLCompiler, **kwargs):
+    def render(value: Any, c: Column) -> str:
+        return "NULL" if value is None else compiler.render_literal_value(value, c.type)
+
+    return "ARRAY<{}>[{}]".format(_struct_spec(compiler.dialect, element.columns), ", ".join(
+        "STRUCT({})".format(", ".join(render(row.get(c.name), c) for c in element.columns))
+        for row in element.rows
+    ))
+
+
+def rows_source(
+        columns: Sequence[Column],
+        rows: Sequence[Row],
+        literal_binds: bool = False,
+        name: str = "source",
+) -> Subquery:
+    """
+    `MergeInto` source made of in-memory rows, ie `(SELECT <columns> FROM UNNEST(<rows>)) AS <name>`.
+
+    :param columns: Columns of the source, usually the target's. They give the STRUCT fields' names & types.
+    :param rows: Rows to merge, as mappings keyed by column name. Missing values are NULLs.
+    :param literal_binds: Render the rows inline rather than as a single ARRAY<STRUCT> query parameter
+    :param name: Name of the resulting subquery
+    """
+    assert rows, "Can't build a source out of 0 rows"
+    assert not literal_binds or renders_literals(columns), \
+        "Some of the columns' types can't be rendered as literals, send the rows as a query parameter"
+
+    if literal_binds:
+        array: ColumnElement = _RowsLiteral(columns, rows)
+    else:
+        array = bindparam(
+            "rows",
+            [{c.name: row.get(c.name) for c in columns} for row in rows],
+            type_=ARRAY(_StructType(columns)),
+            unique=True,
+        )
+
+    # not `func.unnest`: sqlalchemy-bigquery registers its own version of it, which doesn't support caching
+    unnest = Function("unnest", array, type_=array.type.item_type)
+
+    return select(*[column(c.name, c.type) for c in columns]).select_from(unnest).subquery(name)
+
+
+def _estimated_size(columns: Sequence[Column], row: Row, literal_binds: bool) -> int:
+    # Rough (and rather pessimistic) estimation of what a row adds to the query or request size.
+    # Literals: `STRUCT(<value>, ...), ` with the values quoted & maybe prefixed by their type (ie `DATE '...'`)
+    # Parameters: JSON payload `{"structValues": {"<name>": {"value": "<value>"}, ...}}, `
+    if literal_binds:
+        return 10 + sum(len(str(row.get(c.name))) + 12 for c in columns)
+    return 20 + sum(len(str(row.get(c.name))) + len(c.name) + 16 for c in columns)
+
+
+def chunk_rows(
+        columns: Sequence[Column],
+        rows: Iterable[Row],
+        literal_binds: bool = False,
+        max_size: Optional[int] = None,
+        max_rows: Optional[int] = None,
+) -> Iterator[List[Row]]:
+    """
+    Split `rows` into chunks small enough to stay under BigQuery's query length (literals)
+    or request size (query parameters) limits once passed to `rows_source`.
+
+    :param max_size: Size budget of a chunk, in characters/bytes. Defaults to 90% of the relevant BigQuery limit.
+    :param max_rows: Maximum number of rows per chunk, if any
+    """
+    if max_size is None:
+        max_size = DEFAULT_MAX_LITERALS_SIZE if literal_binds else DEFAULT_MAX_PARAMETER_SIZE
+
+    chunk: List[Row] = []
+    size = 0
+
+    for row in rows:
+        row_size = _estimated_size(columns, row, literal_binds)
+        assert row_size <= max_size, f"A single row is bigger than the size limit ({row_size} > {max_size})"
+
+        if chunk and (size + row_size > max_size or len(chunk) == max_rows):
+            yield chunk
+            chunk, size = [], 0
+
+        chunk.append(row)
+        size += row_size
+
+    if chunk:
+        yield chunk
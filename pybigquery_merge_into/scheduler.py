@@ -0,0 +1,148 @@
+"""
+Scheduling of DML statements per target table: BigQuery only runs a couple of MERGE/UPDATE/DELETE statements
+against a table at the same time, & fails the ones conflicting with a concurrent one.
+"""
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import Table
+
+from pybigquery_merge_into.aio import execute_async
+from pybigquery_merge_into.client import JobClient, JobStats
+from pybigquery_merge_into.merge_clause import MergeInto
+
+# Bits of the error messages of DML statements worth retrying
+_RETRYABLE_ERRORS = (
+    "Could not serialize access to table",
+    "due to concurrent update",
+    "too many DML statements outstanding against table",
+)
+
+
+def is_conflict(error: Exception) -> bool:
+    """
+    Whether `error` is a serialization conflict (or a full DML queue), ie the statement can simply be run again.
+    """
+    message = str(error)
+    return any(part in message for part in _RETRYABLE_ERRORS)
+
+
+def _table_name(target: Table) -> str:
+    # aliases are scheduled along with their table
+    return getattr(target, "original", target).fullname
+
+
+@dataclass
+class TableMetrics:
+    """
+    What happened to the statements targeting a table. Times are in seconds.
+    """
+    queued: int = 0  # waiting for a slot right now
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    retries: int = 0
+    max_queue_depth: int = 0
+    total_wait: float = 0.0  # spent waiting for a slot, over all the attempts
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        attempts = self.completed + self.failed + self.retries
+        return self.total_wait / attempts if attempts else 0.0
+
+
+class DmlScheduler:
+    """
+    Runs statements with at most `max_per_table` of them running against the same target table.
+    The others are queued, in submission order. Statements failing because of a concurrent one
+    are retried after a jittered exponential backoff, back at the end of their table's queue.
+    """
+
+    def __init__(
+            self,
+            client: JobClient,
+            max_per_table: int = 2,
+            max_attempts: int = 5,
+            backoff: float = 1.0,
+            max_backoff: float = 60.0,
+            poll_interval: float = 1.0,
+            retryable: Callable[[Exception], bool] = is_conflict,
+            seed: Optional[int] = None,
+    ):
+        """
+        :param client: Runs the jobs, see `client.BigQueryJobClient`
+        :param max_per_table: Maximum number of statements running against a table at the same time
+        :param max_attempts: Maximum number of times a statement is run, retries included
+        :param backoff: Base delay before a retry, in seconds. Doubles with each attempt, up to `max_backoff`.
+                        The actual delay is random, between 0 & that value, so the conflicting statements spread out.
+        :param poll_interval: Seconds between two checks of a running job
+        :param retryable: Whether a failed statement should be retried, given its error
+        :param seed: Seed of the backoff's randomness
+        """
+        assert max_per_table > 0, "At least one statement per table has to be able to run"
+        assert max_attempts > 0, "Statements have to be run at least once"
+
+        self.client = client
+        self.max_per_table = max_per_table
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.retryable = retryable
+        self.random = random.Random(seed)
+
+        self.metrics: Dict[str, TableMetrics] = {}
+        # created on first use, they have to belong to the loop they're used in (python < 3.10)
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def _run_once(self, table: str, statement: MergeInto, **options) -> JobStats:
+        metrics = self.metrics.setdefault(table, TableMetrics())
+        slots = self._slots.setdefault(table, asyncio.Semaphore(self.max_per_table))
+
+        metrics.queued += 1
+        metrics.max_queue_depth = max(metrics.max_queue_depth, metrics.queued)
+        queued_at = time.monotonic()
+        try:
+            await slots.acquire()
+        finally:
+            metrics.queued -= 1
+
+        wait = time.monotonic() - queued_at
+        metrics.total_wait += wait
+        metrics.max_wait = max(metrics.max_wait, wait)
+
+        metrics.running += 1
+        try:
+            return await execute_async(self.client, statement, self.poll_interval, **options)
+        finally:
+            metrics.running -= 1
+            slots.release()
+
+    async def execute(self, statement: MergeInto, **options) -> JobStats:
+        """
+        Run `statement` once a slot is available for its target table, retrying it on conflicts.
+
+        :param options: `google.cloud.bigquery.QueryJobConfig` attributes
+        """
+        table = _table_name(statement.target)
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                stats = await self._run_once(table, statement, **options)
+            except Exception as error:
+                if attempt == self.max_attempts or not self.retryable(error):
+                    self.metrics[table].failed += 1
+                    raise
+
+                # the slot is released meanwhile, the other statements don't have to wait for this one
+                self.metrics[table].retries += 1
+                await asyncio.sleep(self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+            else:
+                self.metrics[table].completed += 1
+                return stats
+
+        raise AssertionError("unreachable")
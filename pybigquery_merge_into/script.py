@@ -0,0 +1,144 @@
+from typing import List, Sequence
+
+from sqlalchemy import Column, MetaData, Table, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.selectable import SelectBase
+from sqlalchemy.sql.visitors import InternalTraversal
+
+from pybigquery_merge_into.merge_clause import MergeInto, _source_name, _with_source
+
+
+class CreateTempTable(Executable, ClauseElement):
+    """
+    `CREATE TEMP TABLE <name> AS <query>`, a step of a `MergeScript`.
+    The temp table only lives as long as the script, see `table` to use it in the following statements.
+    """
+    _traverse_internals = [
+        ("name", InternalTraversal.dp_string),
+        ("query", InternalTraversal.dp_clauseelement),
+    ] + Executable._executable_traverse_internals  # type: ignore
+
+    def __init__(self, name: str, query: SelectBase):
+        """
+        :param name: Name of the table, without any dataset (temp tables don't belong to one)
+        :param query: Content of the table
+        """
+        assert "." not in name, "Temp tables can't be created in a dataset"
+
+        super().__init__()
+        self.name = name
+        self.query = query
+
+    @property
+    def table(self) -> Table:
+        return Table(self.name, MetaData(), *(Column(c.name, c.type) for c in self.query.selected_columns))
+
+
+@compiles(CreateTempTable, "bigquery")
+def compile_create_temp_table(element: CreateTempTable, compiler: SQLCompiler, **kwargs):
+    return "CREATE TEMP TABLE {} AS\n{}".format(
+        compiler.preparer.quote(element.name),
+        compiler.process(element.query, **kwargs),
+    )
+
+
+class DropTempTable(Executable, ClauseElement):
+    """
+    `DROP TABLE <name>`, to get rid of a `CreateTempTable`'s table before the end of its script.
+    """
+    _traverse_internals = [
+        ("name", InternalTraversal.dp_string),
+    ] + Executable._executable_traverse_internals  # type: ignore
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+
+
+@compiles(DropTempTable, "bigquery")
+def compile_drop_temp_table(element: DropTempTable, compiler: SQLCompiler, **kwargs):
+    return "DROP TABLE {}".format(compiler.preparer.quote(element.name))
+
+
+class MergeScript(Executable, ClauseElement):
+    """
+    Several statements (`MergeInto`, `CreateTempTable`, `text()`, etc) run as one multi-statement query,
+    ie as a single job.
+
+    The statements are compiled together, so the bind parameters get unique names across the whole script.
+    Parameters explicitly named the same (ie `bindparam("day")` in two statements) are the same parameter.
+    """
+    _traverse_internals = [
+        ("statements", InternalTraversal.dp_clauseelement_list),
+        ("transaction", InternalTraversal.dp_boolean),
+    ] + Executable._executable_traverse_internals  # type: ignore
+
+    def __init__(self, statements: Sequence[ClauseElement], transaction: bool = False):
+        """
+        :param statements: Statements to run, in order
+        :param transaction: Run the statements in a transaction, ie all of them take effect or none does
+        """
+        assert statements, "A script requires at least one statement"
+
+        super().__init__()
+        self.statements: List[ClauseElement] = list(statements)
+        self.transaction = transaction
+
+
+def _reset_ctes(compiler: SQLCompiler) -> None:
+    # The compiler collects the CTEs it meets, to render them in the top-level SELECT's WITH.
+    # The statements of a script are all "top-level" though, & each of them has to render its own CTEs only.
+    if compiler.ctes is not None:
+        compiler.ctes.clear()
+        compiler.ctes_by_level_name.clear()  # type: ignore
+        compiler.level_name_by_cte.clear()  # type: ignore
+        compiler.ctes_recursive = False
+
+
+@compiles(MergeScript, "bigquery")
+def compile_merge_script(element: MergeScript, compiler: SQLCompiler, **kwargs):
+    statements = []
+    for statement in element.statements:
+        _reset_ctes(compiler)
+        statements.append(compiler.process(statement, **kwargs).strip() + ";\n")
+
+    if not element.transaction:
+        return "".join(statements)
+
+    # an error rolls the whole thing back, & is raised again so the job still fails
+    return "BEGIN\nBEGIN TRANSACTION;\n{}COMMIT TRANSACTION;\nEXCEPTION WHEN ERROR THEN\nROLLBACK TRANSACTION;\nRAISE;\nEND;\n".format(
+        "".join(statements)
+    )
+
+
+def materialize_source(
+        merges: Sequence[MergeInto],
+        name: str = "merge_source",
+        transaction: bool = False,
+) -> MergeScript:
+    """
+    A script computing the (shared) source of `merges` once, into a temp table, & running the merges from it.
+
+    A subquery source is evaluated each time the statement references it: once per statement, & once more for
+    the partition pruning. Materializing it makes that a single scan, however many targets it's merged into.
+
+    :param merges: Statements to run, all with the same source
+    :param name: Name of the temp table
+    :param transaction: Run the merges in a transaction, see `MergeScript`
+    """
+    assert merges, "At least one merge is required"
+    source = merges[0].source
+    assert all(merge.source is source for merge in merges), "The merges have to share the same source"
+
+    create = CreateTempTable(name, select(source))
+    source_name = _source_name(source)
+    # under the source's name, so the statements read the same as before
+    table = create.table.alias(source_name) if source_name and source_name != name else create.table
+
+    return MergeScript(
+        [create, *(_with_source(merge, table) for merge in merges), DropTempTable(name)],
+        transaction=transaction,
+    )
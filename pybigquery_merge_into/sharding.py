@@ -0,0 +1,125 @@
+import asyncio
+from typing import Any, Callable, List, Optional, Sequence
+
+from sqlalchemy import and_, func, or_, true
+from sqlalchemy.sql import ColumnElement
+
+from pybigquery_merge_into.client import JobClient, JobStats
+from pybigquery_merge_into.merge_clause import MergeInto, WhenNotMatchedBySource, _filter_source, _restrict
+from pybigquery_merge_into.scheduler import DmlScheduler
+
+# Builds the predicate restricting a key column to a shard
+ShardPredicate = Callable[[ColumnElement], ColumnElement]
+
+
+def hash_shards(shards: int) -> List[ShardPredicate]:
+    """
+    `shards` predicates splitting the keys by hash, ie `ABS(MOD(FARM_FINGERPRINT(TO_JSON_STRING(<key>)), <shards>)) = i`.
+    TO_JSON_STRING makes any type hashable & gives NULLs a hash ('null'), so every key ends up in exactly one shard.
+    """
+    assert shards > 0, "At least one shard is required"
+
+    def shard(i: int) -> ShardPredicate:
+        # MOD before ABS, ABS fails on the smallest INT64
+        return lambda key: func.abs(func.mod(func.farm_fingerprint(func.to_json_string(key)), shards)) == i
+
+    return [shard(i) for i in range(shards)]
+
+
+def range_shards(boundaries: Sequence[Any]) -> List[ShardPredicate]:
+    """
+    `len(boundaries) + 1` predicates splitting the keys by range, ie `< b0`, `>= b0 AND < b1`, ..., `>= bn`.
+    NULL keys belong to the first shard.
+    """
+    assert list(boundaries) == sorted(boundaries), "The boundaries have to be in ascending order"
+    assert None not in boundaries, "NULL can't be a boundary"
+
+    bounds = [None, *boundaries, None]
+
+    def shard(lower: Any, upper: Any) -> ShardPredicate:
+        def predicate(key: ColumnElement) -> ColumnElement:
+            if lower is None:
+                return or_(key < upper, key.is_(None)) if upper is not None else true()
+            return and_(key >= lower, key < upper) if upper is not None else key >= lower
+
+        return predicate
+
+    return [shard(lower, upper) for lower, upper in zip(bounds, bounds[1:])]
+
+
+def _shard(merge: MergeInto, key_column: str, predicate: ShardPredicate) -> MergeInto:
+    shard = _filter_source(merge, lambda source: predicate(source.c[key_column]))
+
+    # the target rows of the other shards aren't in the source, they must not count as "not matched by source"
+    target_predicate = predicate(merge.target.c[key_column])
+
+    shard.onclause = and_(shard.onclause, target_predicate)
+    shard.when_clauses = [
+        _restrict(clause, target_predicate) if isinstance(clause, WhenNotMatchedBySource) else clause
+        for clause in shard.when_clauses
+    ]
+
+    return shard
+
+
+def shard_merge(
+        merge: MergeInto,
+        key_column: str,
+        shards: Optional[int] = None,
+        boundaries: Optional[Sequence[Any]] = None,
+) -> List[MergeInto]:
+    """
+    Split `merge` into several merges, each one only dealing with a disjoint part of the keys.
+    Together, they do the same as `merge`, WHEN NOT MATCHED BY SOURCE clauses included.
+
+    The source of each merge is restricted to the shard's keys, & so is the target (in the ON clause
+    & the WHEN NOT MATCHED BY SOURCE conditions).
+
+    :param merge: Statement to split
+    :param key_column: Name of the column to shard on, in both the target & the source.
+                       The ON clause must match the rows on it, ie `target.<key_column> = source.<key_column> AND ...`
+    :param shards: Number of shards, the keys being split by hash
+    :param boundaries: Split the keys by range instead, see `range_shards`
+    """
+    assert (shards is None) != (boundaries is None), "Shard either by hash (`shards`) or by range (`boundaries`)"
+
+    predicates = hash_shards(shards) if shards is not None else range_shards(boundaries)  # type: ignore
+    return [_shard(merge, key_column, predicate) for predicate in predicates]
+
+
+async def execute_sharded(
+        client: JobClient,
+        merge: MergeInto,
+        key_column: str,
+        shards: Optional[int] = None,
+        boundaries: Optional[Sequence[Any]] = None,
+        max_concurrency: int = 2,
+        poll_interval: float = 1.0,
+        scheduler: Optional[DmlScheduler] = None,
+        **options,
+) -> List[JobStats]:
+    """
+    Run the shards of `merge` (see `shard_merge`) concurrently, through a `scheduler.DmlScheduler`:
+    BigQuery fails concurrent DML statements conflicting on the same table (or partitions), those are retried.
+    The first error is raised once every shard is done. The other shards are merged then, running `merge`
+    again merges the failed one's keys.
+
+    :param max_concurrency: Maximum number of shards running at the same time. BigQuery runs at most
+                            2 MERGE/UPDATE/DELETE statements against a table at the same time, & queues the others.
+    :param scheduler: Runs the shards, a new one by default (`max_per_table=max_concurrency`).
+                      Sharing it with other statements targeting the same table keeps them from conflicting too.
+    :param options: `google.cloud.bigquery.QueryJobConfig` attributes
+    :return: The stats of the shards' jobs
+    """
+    if scheduler is None:
+        scheduler = DmlScheduler(client, max_per_table=max_concurrency, poll_interval=poll_interval)
+
+    results = await asyncio.gather(
+        *(scheduler.execute(shard, **options) for shard in shard_merge(merge, key_column, shards, boundaries)),
+        return_exceptions=True,
+    )
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results  # type: ignore
@@ -0,0 +1,84 @@
+from collections import deque
+from typing import Callable, Deque, Iterable, List, Optional, Sequence, Tuple, Union
+from uuid import uuid4
+
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.sql import Subquery
+
+from pybigquery_merge_into.client import Batch, Job, JobClient, execute
+from pybigquery_merge_into.merge_clause import MergeInto, _WhenClause
+
+
+def staging_table(target: Table, dataset: str, columns: Sequence[Column]) -> Table:
+    """
+    Uniquely named table, in `dataset`, with the given columns of `target`.
+    """
+    # the target's name might already be prefixed with its dataset
+    name = "{}.{}_staging_{}".format(dataset, target.name.split(".")[-1], uuid4().hex)
+    return Table(name, MetaData(), *(Column(column.name, column.type) for column in columns))
+
+
+def staged_merge(
+        client: JobClient,
+        target: Table,
+        batches: Iterable[Batch],
+        key_columns: Sequence[str],
+        staging_dataset: str,
+        columns: Optional[Sequence[str]] = None,
+        when_clauses: Optional[Callable[[Union[Table, Subquery]], List[_WhenClause]]] = None,
+        loads_ahead: int = 1,
+        **options,
+) -> List[Job]:
+    """
+    Merge batches too big for `MergeInto.from_rows`: each batch is loaded into its own staging table,
+    which is then used as the source of a `MergeInto.upsert`, & dropped once the merge is done.
+
+    The loads & merges are pipelined, ie the next batches get loaded while the current one is merged.
+    Merges into the same table can't run concurrently anyway, so those are run one at a time, in order.
+    The staging tables are dropped even if something fails along the way.
+
+    :param client: Runs the jobs, see `client.BigQueryJobClient`
+    :param batches: Lists of rows (mappings keyed by column name), pandas DataFrames or pyarrow RecordBatches/Tables
+    :param staging_dataset: Dataset in which to create the staging tables
+    :param loads_ahead: How many batches to load while a merge is running
+    :param options: `google.cloud.bigquery.QueryJobConfig` attributes of the merges
+    :return: The merge jobs, one per batch
+
+    See `MergeInto.upsert` for the other parameters.
+    """
+    assert loads_ahead >= 0, "Can't load a negative number of batches ahead"
+    merged_columns = [target.c[name] for name in (columns or target.c.keys())]
+
+    loading: Deque[Tuple[Table, Job]] = deque()
+    merges: List[Job] = []
+
+    def merge_next():
+        staging, load = loading.popleft()
+        try:
+            load.result()
+            merge = MergeInto.upsert(target, staging, key_columns, columns, when_clauses)
+            merges.append(execute(client, merge, **options))
+        finally:
+            client.delete_table(staging.name)
+
+    try:
+        for batch in batches:
+            staging = staging_table(target, staging_dataset, merged_columns)
+            loading.append((staging, client.load(staging.name, merged_columns, batch)))
+
+            if len(loading) > loads_ahead:
+                merge_next()
+
+        while loading:
+            merge_next()
+
+    finally:
+        # something failed, the loads in flight have to finish before their tables can be dropped
+        for staging, load in loading:
+            try:
+                load.result()
+            except Exception:
+                pass
+            client.delete_table(staging.name)
+
+    return merges
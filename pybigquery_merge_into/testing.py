@@ -0,0 +1,153 @@
+"""
+Local stand-ins for BigQuery's jobs & client, to test (or benchmark) merge pipelines without any network.
+"""
+import random
+import re
+import threading
+import time
+from itertools import count
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import Column
+
+from pybigquery_merge_into.client import Batch
+
+_job_ids = count()
+
+
+class FakeJob:
+    """
+    `client.Job` that finishes `duration` seconds after its creation, failing with `error` if given.
+    Its result is `rows` (tuples, for queries selecting something).
+    Extra keyword arguments are set as attributes, ie the job's statistics (`total_bytes_processed`, etc).
+    """
+
+    def __init__(
+            self,
+            duration: float = 0.0,
+            error: Optional[Exception] = None,
+            rows: Sequence[Tuple[Any, ...]] = (),
+            **statistics: Any,
+    ):
+        self.job_id = f"fake_job_{next(_job_ids)}"
+        self.error = error
+        self.rows = list(rows)
+        self.created = time.monotonic()
+        self.finishes_at = self.created + duration
+
+        for name, value in statistics.items():
+            setattr(self, name, value)
+
+    def done(self) -> bool:
+        return time.monotonic() >= self.finishes_at
+
+    def result(self) -> List[Any]:
+        remaining = self.finishes_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        if self.error is not None:
+            raise self.error
+        return self.rows
+
+
+# Called with the submitted (sql, parameters, options), returns the FakeJob's keyword arguments.
+# Raising makes the submission itself fail.
+OnQuery = Callable[[str, Mapping[str, Any], Dict[str, Any]], Dict[str, Any]]
+
+
+class SerializationConflict(Exception):
+    """
+    What BigQuery fails a DML statement with when a concurrent one modified the same table (partitions).
+    """
+
+    def __init__(self, table: str):
+        super().__init__(f"Could not serialize access to table {table} due to concurrent update")
+
+
+class ConflictingDml:
+    """
+    `OnQuery` simulating concurrent DML conflicts: a MERGE/UPDATE/DELETE submitted while another one
+    is running against the same table fails with a `SerializationConflict`, with a probability of `rate`.
+    """
+
+    def __init__(self, duration: float = 0.0, rate: float = 1.0, seed: Optional[int] = None):
+        """
+        :param duration: Duration of the jobs, in seconds
+        :param rate: Probability of a conflict, when there is a concurrent job
+        """
+        self.duration = duration
+        self.rate = rate
+        self.random = random.Random(seed)
+
+        self.running: Dict[str, List[float]] = {}  # table -> end times of its jobs
+        self.conflicts = 0
+
+    def __call__(self, sql: str, parameters: Mapping[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+        match = re.match(r"\s*(?:MERGE INTO|UPDATE|DELETE FROM)\s+`?([^`\s]+)`?", sql)
+        if match is None:
+            return {"duration": self.duration}
+
+        table, now = match.group(1), time.monotonic()
+        running = self.running[table] = [end for end in self.running.get(table, []) if end > now]
+        running.append(now + self.duration)
+
+        if running[:-1] and self.random.random() < self.rate:
+            self.conflicts += 1
+            # like the actual thing, the conflict is only found once the job is done
+            return {"duration": self.duration, "error": SerializationConflict(table)}
+        return {"duration": self.duration}
+
+
+class FakeJobClient:
+    """
+    `client.JobClient` that records what it's asked to do.
+    Loaded data is kept in `tables`, & every call is appended to `events` (in order) as `(kind, table or sql)`.
+    """
+
+    def __init__(self, on_query: Optional[OnQuery] = None, latency: float = 0.0):
+        """
+        :param on_query: Decides how the query jobs behave (duration, errors, statistics)
+        :param latency: Default duration of the jobs, in seconds
+        """
+        self.on_query = on_query
+        self.latency = latency
+
+        self.queries: List[Tuple[str, Mapping[str, Any], Dict[str, Any]]] = []
+        self.jobs: List[FakeJob] = []  # query jobs, in submission order
+        self.tables: Dict[str, List[Tuple[Sequence[Column], Batch]]] = {}
+        self.events: List[Tuple[str, str]] = []
+        self._submitted = threading.Condition()
+
+    def query(self, sql: str, parameters: Mapping[str, Any], **options) -> FakeJob:
+        with self._submitted:
+            self.queries.append((sql, parameters, options))
+            self.events.append(("query", sql))
+            self._submitted.notify_all()
+
+        # dry runs are done as soon as they're submitted
+        job_kwargs: Dict[str, Any] = {"duration": 0.0 if options.get("dry_run") else self.latency}
+        if self.on_query is not None:
+            job_kwargs.update(self.on_query(sql, parameters, options))
+
+        job = FakeJob(**job_kwargs)
+        self.jobs.append(job)
+        return job
+
+    def wait_for_queries(self, count: int, timeout: float) -> None:
+        """
+        Wait for `count` queries to have been submitted (ie by another thread), raising a `TimeoutError` otherwise.
+        """
+        with self._submitted:
+            if not self._submitted.wait_for(lambda: len(self.queries) >= count, timeout):
+                raise TimeoutError(f"{len(self.queries)} queries submitted after {timeout}s, expected {count}")
+
+    def load(self, table: str, columns: Sequence[Column], data: Batch) -> FakeJob:
+        self.tables.setdefault(table, []).append((columns, data))
+        self.events.append(("load", table))
+
+        return FakeJob(duration=self.latency)
+
+    def delete_table(self, table: str) -> None:
+        self.tables.pop(table, None)
+        self.events.append(("delete", table))
@@ -1,6 +1,10 @@
 import logging
 
-from sqlalchemy import ARRAY, Boolean, Column, Date, Integer, JSON, MetaData, String, Table
+from sqlalchemy import ARRAY, Boolean, Column, Date, Integer, JSON, MetaData, String, Table, update
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -54,3 +58,28 @@ detailed_inventory = Table(
     Column("comments", ARRAY(JSON)),
     Column("specifications", JSON),
 )
+
+
+def update_merge(**values) -> MergeInto:
+    # MERGE INTO `target` USING `source`, setting `values` on the matched rows
+    return MergeInto(target, source, target.c.t1 == source.c.s1, [WhenMatched(update(target).values(**values))])
+
+
+class CachingBigQueryDialect(BigQueryDialect):
+    # sqlalchemy-bigquery opts out of the statement cache, opt back in to check our side of things
+    supports_statement_cache = True
+
+
+def compile_w_cache(statement: ClauseElement, dialect: CachingBigQueryDialect, cache: dict):
+    # same entry point `Connection.execute` uses
+    return statement._compile_w_cache(dialect, compiled_cache=cache, column_keys=[])
+
+
+def max_overlap(jobs) -> int:
+    # highest number of (fake) jobs running at the same time
+    events = sorted([(job.created, 1) for job in jobs] + [(job.finishes_at, -1) for job in jobs])
+    running = highest = 0
+    for _, delta in events:
+        running += delta
+        highest = max(highest, running)
+    return highest
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from datetime import date
+
+import pytest
+
+from pybigquery_merge_into.aio import AsyncMergeRunner, execute_async
+from pybigquery_merge_into.testing import FakeJob, FakeJobClient
+from tests.conftest import max_overlap, update_merge
+
+
+def test_execute_async():
+    client = FakeJobClient(
+        on_query=lambda sql, parameters, options: {"total_bytes_processed": 10, "num_dml_affected_rows": 2},
+        latency=0.05,
+    )
+
+    stats = asyncio.run(execute_async(client, update_merge(t2=date(2020, 1, 1)), poll_interval=0.01, priority="BATCH"))
+
+    assert stats.job_id == client.jobs[0].job_id
+    assert (stats.total_bytes_processed, stats.num_dml_affected_rows, stats.slot_millis) == (10, 2, None)
+    assert stats.elapsed >= 0.05
+    assert client.queries[0][1] == {"t2": date(2020, 1, 1)}
+    assert client.queries[0][2] == {"priority": "BATCH"}
+
+
+def test_event_loop_is_not_blocked():
+    client = FakeJobClient(latency=0.2)
+
+    async def main():
+        merge = asyncio.ensure_future(execute_async(client, update_merge(t2=date(2020, 1, 1)), poll_interval=0.01))
+        ticks = 0
+        while not merge.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks
+
+    assert asyncio.run(main()) > 5
+
+
+def test_bounded_concurrency():
+    client = FakeJobClient(latency=0.1)
+    runner = AsyncMergeRunner(client, max_concurrency=3, poll_interval=0.01)
+
+    started = time.monotonic()
+    stats = asyncio.run(runner.execute_all([update_merge(t2=date(2020, 1, day)) for day in range(1, 10)]))
+
+    # the jobs are submitted in whatever order they get a slot, the stats are in the statements' order
+    submitted = {job.job_id: parameters["t2"] for job, (_, parameters, _) in zip(client.jobs, client.queries)}
+    assert [submitted[s.job_id] for s in stats] == [date(2020, 1, day) for day in range(1, 10)]
+    assert max_overlap(client.jobs) <= 3
+    # 9 jobs, 3 at a time
+    assert time.monotonic() - started >= 0.3
+
+
+def test_errors_are_raised_once_every_job_is_done():
+    def on_query(sql, parameters, options):
+        return {"error": ValueError("boom")} if parameters["t2"] == date(2020, 1, 1) else {"duration": 0.05}
+
+    client = FakeJobClient(on_query=on_query)
+    runner = AsyncMergeRunner(client, max_concurrency=2, poll_interval=0.01)
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(runner.execute_all([update_merge(t2=date(2020, 1, day)) for day in range(1, 4)]))
+
+    assert len(client.jobs) == 3
+    assert all(isinstance(job, FakeJob) and job.done() for job in client.jobs)
@@ -0,0 +1,129 @@
+from datetime import date
+
+import pytest
+
+from pybigquery_merge_into.buffer import UpsertBuffer
+from pybigquery_merge_into.testing import FakeJobClient
+from tests.conftest import inventory, target
+
+
+def _merged_rows(client: FakeJobClient):
+    return [parameters["rows_1"] for _, parameters, _ in client.queries]
+
+
+def test_last_write_wins_and_flush_on_close():
+    client = FakeJobClient()
+
+    with UpsertBuffer(client, max_delay=60) as buffer:
+        buffer.add(target, {"t1": "a", "t2": date(2020, 1, 1)}, ["t1"])
+        buffer.add(target, {"t1": "b", "t2": date(2020, 1, 1)}, ["t1"])
+        buffer.add(target, {"t1": "a", "t2": date(2020, 1, 2)}, ["t1"])
+
+        assert client.queries == []
+
+    assert _merged_rows(client) == [[{"t1": "a", "t2": date(2020, 1, 2)}, {"t1": "b", "t2": date(2020, 1, 1)}]]
+
+
+def test_one_merge_per_shape():
+    client = FakeJobClient()
+
+    with UpsertBuffer(client, max_delay=60) as buffer:
+        buffer.add(target, {"t1": "a"}, ["t1"])
+        buffer.add(target, {"t1": "a", "t2": date(2020, 1, 1)}, ["t1", "t2"])
+        buffer.add(inventory, {"product": "oven", "quantity": 1}, ["product"], ["product", "quantity"])
+        buffer.add(target, {"t1": "b"}, ["t1"])
+
+    assert len(client.queries) == 3
+    assert _merged_rows(client)[0] == [{"t1": "a", "t2": None}, {"t1": "b", "t2": None}]
+    assert client.queries[2][0].startswith("MERGE INTO `dataset.Inventory`")
+
+
+def test_size_threshold():
+    client = FakeJobClient()
+    buffer = UpsertBuffer(client, max_rows=3, max_delay=60)
+
+    for i in range(7):
+        buffer.add(target, {"t1": str(i)}, ["t1"])
+    client.wait_for_queries(2, timeout=5)
+
+    assert len(client.queries) >= 2
+    assert all(len(rows) <= 3 for rows in _merged_rows(client))
+
+    buffer.close()
+    assert sorted(row["t1"] for rows in _merged_rows(client) for row in rows) == [str(i) for i in range(7)]
+
+
+def test_time_threshold():
+    client = FakeJobClient()
+    buffer = UpsertBuffer(client, max_delay=0.05)
+
+    buffer.add(target, {"t1": "a"}, ["t1"])
+    client.wait_for_queries(1, timeout=5)
+
+    assert len(client.queries) == 1
+    buffer.close()
+    assert len(client.queries) == 1
+
+
+def test_backpressure():
+    client = FakeJobClient(latency=0.2)
+    buffer = UpsertBuffer(client, max_rows=2, max_pending_rows=2, max_delay=60)
+
+    buffer.add(target, {"t1": "a"}, ["t1"])
+    buffer.add(target, {"t1": "b"}, ["t1"])
+
+    # both rows are being merged
+    with pytest.raises(TimeoutError):
+        buffer.add(target, {"t1": "c"}, ["t1"], timeout=0.05)
+
+    # waits for the merge to be done
+    buffer.add(target, {"t1": "c"}, ["t1"])
+    assert client.jobs[0].done()
+
+    buffer.close()
+    assert _merged_rows(client) == [[{"t1": "a", "t2": None}, {"t1": "b", "t2": None}], [{"t1": "c", "t2": None}]]
+
+
+def test_errors_are_raised_by_the_next_call():
+    client = FakeJobClient(on_query=lambda sql, parameters, options: {"error": ValueError("boom")})
+    buffer = UpsertBuffer(client, max_delay=60)
+
+    buffer.add(target, {"t1": "a"}, ["t1"])
+    with pytest.raises(ValueError, match="boom"):
+        buffer.flush()
+
+    buffer.add(target, {"t1": "b"}, ["t1"])
+    with pytest.raises(ValueError, match="boom"):
+        buffer.close()
+
+    with pytest.raises(AssertionError):
+        buffer.add(target, {"t1": "c"}, ["t1"])
+
+
+def test_merge_options():
+    client = FakeJobClient()
+
+    with UpsertBuffer(client, max_delay=60, literal_binds=True, partition_column="t2") as buffer:
+        buffer.add(target, {"t1": "a", "t2": date(2020, 1, 1)}, ["t1"])
+
+    sql, parameters, _ = client.queries[0]
+    assert parameters == {"t2_1": date(2020, 1, 1), "t2_2": date(2020, 1, 1)}
+    assert "STRUCT('a', DATE '2020-01-01')" in sql
+
+
+def test_full_buffer_is_merged():
+    client = FakeJobClient()
+    buffer = UpsertBuffer(client, max_rows=10, max_pending_rows=3, max_delay=60)
+
+    # neither batch reaches `max_rows`, nor waits for `max_delay`
+    buffer.add(target, {"t1": "a"}, ["t1"])
+    buffer.add(inventory, {"product": "oven", "quantity": 1}, ["product"], ["product", "quantity"])
+    buffer.add(target, {"t1": "b"}, ["t1"])
+
+    buffer.add(target, {"t1": "c"}, ["t1"], timeout=5)
+
+    # the biggest batch made room
+    assert _merged_rows(client) == [[{"t1": "a", "t2": None}, {"t1": "b", "t2": None}]]
+
+    buffer.close()
+    assert len(client.queries) == 3
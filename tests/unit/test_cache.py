@@ -0,0 +1,82 @@
+import warnings
+from datetime import date
+
+from sqlalchemy import delete, insert, update
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatched, WhenNotMatchedBySource
+from tests.conftest import CachingBigQueryDialect, compile_w_cache, source, target
+
+
+def _merge(value: str, day: date, reverse: bool = False) -> MergeInto:
+    when_clauses = [
+        WhenMatched(update(target).values({target.c.t1: value})),
+        WhenNotMatched(insert(target)),
+        WhenNotMatchedBySource(delete(target), condition=target.c.t2 > day),
+    ]
+
+    return MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.t1 == source.c.s1,
+        when_clauses=when_clauses[::-1] if reverse else when_clauses,
+    )
+
+
+def test_no_caching_warning():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert _merge("a", date.today())._generate_cache_key() is not None
+
+
+def test_same_shape_same_cache_key():
+    first = _merge("a", date(2020, 1, 1))._generate_cache_key()
+    second = _merge("b", date(2021, 1, 1))._generate_cache_key()
+
+    assert first == second
+    assert [b.value for b in first.bindparams] == ["a", date(2020, 1, 1)]
+    assert [b.value for b in second.bindparams] == ["b", date(2021, 1, 1)]
+
+
+def test_clause_order_is_part_of_the_key():
+    assert _merge("a", date.today())._generate_cache_key() != _merge("a", date.today(), reverse=True)._generate_cache_key()
+
+
+def test_condition_is_part_of_the_key():
+    without_condition = MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.t1 == source.c.s1,
+        when_clauses=[WhenNotMatchedBySource(delete(target))],
+    )
+    with_condition = MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.t1 == source.c.s1,
+        when_clauses=[WhenNotMatchedBySource(delete(target), condition=target.c.t2 > date.today())],
+    )
+
+    assert without_condition._generate_cache_key() != with_condition._generate_cache_key()
+
+
+def test_when_clause_type_is_part_of_the_key():
+    matched = MergeInto(target, source, target.c.t1 == source.c.s1, [WhenMatched(delete(target))])
+    not_matched = MergeInto(target, source, target.c.t1 == source.c.s1, [WhenNotMatchedBySource(delete(target))])
+
+    assert matched._generate_cache_key() != not_matched._generate_cache_key()
+
+
+def test_identical_merges_share_one_cache_entry():
+    dialect = CachingBigQueryDialect()
+    cache: dict = {}
+
+    first, first_params, first_hit = compile_w_cache(_merge("a", date(2020, 1, 1)), dialect, cache)
+    second, second_params, second_hit = compile_w_cache(_merge("b", date(2021, 1, 1)), dialect, cache)
+
+    assert first_hit == dialect.CACHE_MISS
+    assert second_hit == dialect.CACHE_HIT
+    assert len(cache) == 1
+    assert second is first
+
+    # the compiled string is reused, but the parameters are the new ones
+    assert first.construct_params(extracted_parameters=second_params) == {"t1": "b", "t2_1": date(2021, 1, 1)}
+
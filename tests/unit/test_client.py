@@ -0,0 +1,162 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from google.cloud.bigquery.job.query import DmlStats
+from sqlalchemy import ARRAY, Column, Integer, MetaData, String, Table
+
+from pybigquery_merge_into.aio import execute_async
+from pybigquery_merge_into.client import (
+    BigQueryJobClient, BytesBudgetExceeded, JobStats, compile_statement, dry_run, execute, execute_with_stats,
+    with_job_options,
+)
+from pybigquery_merge_into.prepared import PreparedMerge
+from pybigquery_merge_into.testing import FakeJob, FakeJobClient
+from tests.conftest import target, update_merge
+
+
+class RecordingClient:
+    """Stands in for `google.cloud.bigquery.Client`"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, method):
+        return lambda *args, **kwargs: self.calls.append((method, args, kwargs))
+
+
+def test_compile_statement():
+    sql, parameters = compile_statement(update_merge(t2=date(2020, 1, 1)))
+
+    assert "UPDATE SET `t2`=%(t2:DATE)s" in sql
+    assert parameters == {"t2": date(2020, 1, 1)}
+
+
+def test_execute():
+    client = FakeJobClient()
+
+    job = execute(client, update_merge(t2=date(2020, 1, 1)), maximum_bytes_billed=1000)
+
+    assert job.done()
+    sql, parameters, options = client.queries[0]
+    assert sql.startswith("MERGE INTO `target`")
+    assert options == {"maximum_bytes_billed": 1000}
+
+
+def test_execute_with_stats():
+    def on_query(sql, parameters, options):
+        return {
+            "total_bytes_processed": 2048, "total_bytes_billed": 10485760, "slot_millis": 120,
+            "num_dml_affected_rows": 5, "dml_stats": DmlStats(inserted_row_count=3, updated_row_count=2),
+        }
+
+    client = FakeJobClient(on_query, latency=0.01)
+
+    stats = execute_with_stats(client, update_merge(t2=date(2020, 1, 1)))
+
+    assert stats.job_id == client.jobs[0].job_id
+    assert stats.elapsed >= 0.01
+    assert stats[2:] == (2048, 10485760, 120, 5, 3, 2, 0)
+    # the only query is the merge
+    assert len(client.queries) == 1
+
+
+def test_stats_total():
+    stats = [
+        JobStats("a", 1.0, 100, 200, 10, 5, 3, 2, 0),
+        JobStats("b", 2.0, 100, 200, None, 4, 4, 0, 0),
+    ]
+
+    assert JobStats.total(stats) == JobStats("a,b", 3.0, 200, 400, None, 9, 7, 2, 0)
+
+    # a job that doesn't know any of its stats
+    job = FakeJobClient().query("SELECT 1", {})
+    assert JobStats.from_job(job, 0.5) == JobStats(job.job_id, 0.5)
+
+
+def test_elapsed_time_from_the_job():
+    created = datetime(2021, 1, 1, 12, tzinfo=timezone.utc)
+
+    # from the job's start rather than its submission, when it has started
+    job = FakeJob(created=created, started=created + timedelta(seconds=2), ended=created + timedelta(seconds=5))
+    assert JobStats.from_job(job, 10.0).elapsed == 3.0
+
+    job = FakeJob(created=created, started=None, ended=created + timedelta(seconds=5))
+    assert JobStats.from_job(job, 10.0).elapsed == 5.0
+
+
+def test_job_options():
+    client = FakeJobClient()
+    merge = update_merge(t2=date(2020, 1, 1)).with_job_options(maximum_bytes_billed=1000, labels={"team": "data"})
+    merge = with_job_options(merge, priority="BATCH", maximum_bytes_billed=2000)
+
+    execute(client, merge)
+    execute(client, merge, priority="INTERACTIVE")
+    asyncio.run(execute_async(client, merge, poll_interval=0))
+    PreparedMerge(merge).execute(client)
+    execute(client, update_merge(t2=date(2020, 1, 1)))
+
+    options = [options for _, _, options in client.queries]
+    expected = {"maximum_bytes_billed": 2000, "labels": {"team": "data"}, "priority": "BATCH"}
+    assert options == [expected, {**expected, "priority": "INTERACTIVE"}, expected, expected, {}]
+    # the same statement, as far as caching goes
+    assert merge._generate_cache_key() == update_merge(t2=date(2020, 1, 1))._generate_cache_key()
+
+
+def test_estimate():
+    def on_query(sql, parameters, options):
+        return {"total_bytes_processed": 1500 if options.get("dry_run") else 0}
+
+    client = FakeJobClient(on_query, latency=10)
+
+    assert update_merge(t2=date(2020, 1, 1)).estimate(client, labels={"team": "data"}) == 1500
+    assert dry_run(client, update_merge(t2=date(2020, 1, 1)).with_job_options(maximum_bytes_billed=1500)) == 1500
+
+    with pytest.raises(BytesBudgetExceeded) as error:
+        update_merge(t2=date(2020, 1, 1)).with_job_options(maximum_bytes_billed=1000).estimate(client)
+    assert (error.value.estimated, error.value.maximum) == (1500, 1000)
+
+    assert client.queries[0][2] == {"labels": {"team": "data"}, "dry_run": True, "use_query_cache": False}
+    # nothing was actually run, dry runs don't wait
+    assert all(job.done() for job in client.jobs)
+
+
+def test_bigquery_query():
+    client = RecordingClient()
+
+    BigQueryJobClient(client).query(*compile_statement(update_merge(t2=date(2020, 1, 1))), priority="BATCH")
+
+    (method, (sql,), kwargs), = client.calls
+    assert method == "query"
+    assert "UPDATE SET `t2`=@`t2`" in sql
+
+    job_config = kwargs["job_config"]
+    assert job_config.priority == "BATCH"
+    assert [p.to_api_repr() for p in job_config.query_parameters] == [
+        {"name": "t2", "parameterType": {"type": "DATE"}, "parameterValue": {"value": "2020-01-01"}},
+    ]
+
+
+def test_bigquery_json_load():
+    client = RecordingClient()
+    table = Table("t", MetaData(), Column("a", String(10)), Column("b", ARRAY(Integer)), Column("c", target.c.t2.type))
+
+    BigQueryJobClient(client).load("dataset.t", list(table.c), [{"a": "x", "b": [1], "c": date(2020, 1, 1)}])
+
+    (method, (rows, destination), kwargs), = client.calls
+    assert method == "load_table_from_json"
+    assert destination == "dataset.t"
+    assert rows == [{"a": "x", "b": [1], "c": "2020-01-01"}]
+    assert [(f.name, f.field_type, f.mode) for f in kwargs["job_config"].schema] == [
+        ("a", "STRING", "NULLABLE"),
+        ("b", "INT64", "REPEATED"),
+        ("c", "DATE", "NULLABLE"),
+    ]
+
+
+def test_bigquery_delete_table():
+    client = RecordingClient()
+
+    BigQueryJobClient(client).delete_table("dataset.t")
+
+    assert client.calls == [("delete_table", ("dataset.t",), {"not_found_ok": True})]
@@ -0,0 +1,94 @@
+from datetime import date
+
+import pytest
+from google.cloud.bigquery.dbapi import _helpers, cursor
+from sqlalchemy import ARRAY, Column, Date, Integer, MetaData, String, Table, select
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into.client import compile_statement
+from pybigquery_merge_into.columnar import batch_source, chunk_batch
+from pybigquery_merge_into.emulator import MergeEmulator
+from pybigquery_merge_into.merge_clause import MergeInto
+from tests.conftest import target
+
+pyarrow = pytest.importorskip("pyarrow")
+
+events = Table(
+    "events",
+    MetaData(),
+    Column("id", Integer),
+    Column("value", String),
+    Column("day", Date),
+)
+
+batch = pyarrow.record_batch({
+    "id": pyarrow.array([1, 2, 3], pyarrow.int32()),
+    "value": ["a", None, "c"],
+})
+
+
+def test_columns_as_parameters():
+    compiled = select(batch_source(list(events.c), batch)).compile(dialect=BigQueryDialect(paramstyle="pyformat"))
+
+    assert str(compiled) == \
+        "SELECT `source`.`id`, `source`.`value`, `source`.`day` \n" \
+        "FROM (SELECT %(id_values_1:ARRAY<INT64>)s[OFFSET(`_row`)] AS `id`, " \
+        "IF(`_row` IN UNNEST(%(value_nulls_1:INT64)s), CAST(NULL AS STRING), " \
+        "%(value_values_1:ARRAY<STRING>)s[OFFSET(`_row`)]) AS `value`, CAST(NULL AS DATE) AS `day` \n" \
+        "FROM unnest(GENERATE_ARRAY(0, %(row_count_1:INT64)s - 1)) AS `_row`) AS `source`"
+    # NULLs are replaced by another value of the column, BigQuery arrays can't hold them
+    assert compiled.params == {
+        "id_values_1": [1, 2, 3], "value_values_1": ["a", "a", "c"], "value_nulls_1": [1], "row_count_1": 3,
+    }
+
+
+def test_parameters_are_understood_by_the_dbapi():
+    sql, parameters = compile_statement(select(batch_source(list(events.c), batch)))
+
+    _, types = cursor._format_operation(sql, parameters)
+    api = {p.name: p.to_api_repr()["parameterType"] for p in _helpers.to_query_parameters(parameters, types)}
+
+    assert api["id_values_1"] == {"type": "ARRAY", "arrayType": {"type": "INT64"}}
+    assert api["value_nulls_1"] == {"type": "ARRAY", "arrayType": {"type": "INT64"}}
+    assert api["row_count_1"] == {"type": "INT64"}
+
+
+def test_columns_are_cast_to_the_target_types():
+    with pytest.raises(pyarrow.ArrowInvalid):
+        batch_source(list(events.c), pyarrow.table({"id": [1.5]}))
+
+    with pytest.raises(TypeError):
+        batch_source([Column("tags", ARRAY(String))], pyarrow.table({"tags": [["a"]]}))
+
+
+def test_dataframe():
+    pandas = pytest.importorskip("pandas")
+    frame = pandas.DataFrame({"t1": ["a", "b"], "t2": pandas.to_datetime(["2021-01-01", "2021-01-02"]).date})
+
+    merge, = MergeInto.from_batch(target, frame, ["t1"], partition_column="t2")
+
+    assert merge.partition_predicate is not None
+    assert compile_statement(merge)[1]["t2_values_1"] == [date(2021, 1, 1), date(2021, 1, 2)]
+
+
+def test_chunks():
+    table = pyarrow.table({"id": list(range(10)), "value": ["x" * 10] * 10})
+
+    assert [c.num_rows for c in chunk_batch(list(events.c), table, max_rows=4)] == [4, 4, 2]
+    # ~130 bytes per row
+    assert [c.num_rows for c in chunk_batch(list(events.c), table, max_size=400)] == [3, 3, 3, 1]
+    assert len(list(MergeInto.from_batch(events, table, ["id"], max_rows=4))) == 3
+
+
+def test_same_result_as_rows():
+    new_rows = [{"id": i, "value": None if i % 3 else str(i), "day": date(2021, 1, 1 + i % 5)} for i in range(5, 15)]
+
+    def merged(merges):
+        emulator = MergeEmulator()
+        emulator.create_table(events, [{"id": i, "value": "old", "day": date(2021, 1, 1)} for i in range(10)])
+        for merge in merges:
+            emulator.execute(merge)
+        return emulator.rows(events)
+
+    assert merged(MergeInto.from_batch(events, pyarrow.Table.from_pylist(new_rows), ["id"], max_rows=4)) == \
+        merged(MergeInto.from_rows(events, new_rows, ["id"], max_rows=4))
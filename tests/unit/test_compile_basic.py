@@ -1,7 +1,7 @@
 from datetime import timedelta
 from textwrap import dedent
 
-from sqlalchemy import insert, select, update
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, select, update
 from sqlalchemy_bigquery import BigQueryDialect
 
 from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatched
@@ -20,14 +20,12 @@ def test_when_matched():
         ]
     )
 
-    # sneaky double space in the last line (between UPDATE & SET)
-    # due to how the UPDATE clause is transformed (direct string manipulation)
     expected = """\
         MERGE INTO `target`
         USING `source`
         ON `target`.`t1` = `source`.`s1`
         WHEN MATCHED THEN 
-        \tUPDATE  SET `t2`=(`source`.`s2` + :s2_1)
+        \tUPDATE SET `t2`=(`source`.`s2` + :s2_1)
         """
 
     assert str(query.compile(dialect=BigQueryDialect())) == dedent(expected)
@@ -80,7 +78,7 @@ def test_cte_in_source():
         FROM `cte`) AS `anon_1`
         ON `target`.`t1` = `anon_1`.`s1`
         WHEN MATCHED THEN 
-        \tUPDATE  SET `t1`=`anon_1`.`s1`
+        \tUPDATE SET `t1`=`anon_1`.`s1`
         """
 
     assert str(query.compile(dialect=BigQueryDialect())) == dedent(expected)
@@ -103,7 +101,83 @@ def test_brackets_in_actions():
         USING `source`
         ON `target`.`t1` = `source`.`s1`
         WHEN MATCHED THEN 
-        \tUPDATE  SET `t1`='{}'
+        \tUPDATE SET `t1`='{}'
         """
 
     assert str(query.compile(dialect=BigQueryDialect(),  compile_kwargs={'literal_binds': True})) == dedent(expected)
+
+
+def test_actions_on_aliased_target():
+    alias = target.alias("alias_t")
+
+    query = MergeInto(
+        target=alias,
+        source=source,
+        onclause=alias.c.t1 == source.c.s1,
+        when_clauses=[
+            WhenNotMatched(insert(alias).values(t2=source.c.s2, t1="dummy")),
+            WhenMatched(update(alias).ordered_values((alias.c.t2, source.c.s2), ("t1", "other"))),
+        ]
+    )
+
+    expected = """\
+        MERGE INTO `target` AS `alias_t`
+        USING `source`
+        ON `alias_t`.`t1` = `source`.`s1`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (:t1, `source`.`s2`)
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`source`.`s2`, `t1`=:param_1
+        """
+
+    compiled = query.compile(dialect=BigQueryDialect())
+
+    assert str(compiled) == dedent(expected)
+    assert compiled.params == {"t1": "dummy", "param_1": "other"}
+
+
+def test_actions_parameters_are_typed_after_the_target_columns():
+    query = MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.t1 == source.c.s1,
+        when_clauses=[
+            WhenMatched(update(target).values(t1="dummy")),
+        ]
+    )
+
+    compiled = query.compile(dialect=BigQueryDialect(paramstyle="pyformat"))
+
+    assert "UPDATE SET `t1`=%(t1:STRING)s" in str(compiled)
+
+
+def test_actions_add_the_columns_defaults():
+    stamped = Table(
+        "stamped",
+        MetaData(),
+        Column("id", Integer),
+        Column("status", String, default="new"),
+        Column("version", Integer, default=lambda: 1, onupdate=2),
+        Column("updated_at", DateTime, default=func.current_timestamp(), onupdate=func.current_timestamp()),
+    )
+    update_ = update(stamped).values(status=source.c.s1)
+    insert_ = insert(stamped).values(id=source.c.s2)
+    dialect = BigQueryDialect(paramstyle="pyformat")
+
+    def compiled(clause):
+        return MergeInto(stamped, source, stamped.c.id == source.c.s2, [clause]).compile(dialect=dialect)
+
+    # same as SQLAlchemy's own UPDATE/INSERT, minus the table
+    expected_update = str(update_.compile(dialect=dialect)).replace("UPDATE `stamped` SET", "UPDATE SET")
+    expected_insert = str(insert_.compile(dialect=dialect)).replace("INSERT INTO `stamped` ", "INSERT ")
+    assert expected_update == \
+        "UPDATE SET `status`=`source`.`s1`, `version`=%(version:INT64)s, `updated_at`=CURRENT_TIMESTAMP"
+    assert f"\n\t{expected_update}\n" in str(compiled(WhenMatched(update_)))
+    assert f"\n\t{expected_insert}\n" in str(compiled(WhenNotMatched(insert_)))
+
+    # the parameters hold the defaults, callables are called
+    assert compiled(WhenMatched(update_)).params == {"version": 2}
+    assert compiled(WhenNotMatched(insert_)).params == {"status": "new", "version": 1}
+    # on update defaults aren't changes
+    assert "WHEN MATCHED AND `stamped`.`status` IS DISTINCT FROM `source`.`s1` THEN" \
+        in str(compiled(WhenMatched(update_, skip_unchanged=True)))
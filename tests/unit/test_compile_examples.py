@@ -85,7 +85,7 @@ def test_example_2():
         USING dataset.NewArrivals AS S
         ON T.product = S.product
         WHEN MATCHED THEN 
-            UPDATE  SET quantity=(T.quantity + S.quantity)
+            UPDATE SET quantity=(T.quantity + S.quantity)
         WHEN NOT MATCHED BY TARGET THEN 
             INSERT (product, quantity) VALUES (S.product, S.quantity)
         """
@@ -122,7 +122,7 @@ def test_example_3():
         USING (SELECT dataset.NewArrivals.product AS product FROM dataset.NewArrivals WHERE dataset.NewArrivals.warehouse != 'warehouse #2') AS S
         ON T.product = S.product
         WHEN MATCHED AND T.warehouse = 'warehouse #1' THEN 
-            UPDATE  SET quantity=(T.quantity + 20)
+            UPDATE SET quantity=(T.quantity + 20)
         WHEN MATCHED THEN 
             DELETE
         """
@@ -0,0 +1,112 @@
+from textwrap import dedent
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched
+from pybigquery_merge_into.sharding import shard_merge
+from tests.conftest import CachingBigQueryDialect, source, target
+
+
+def _compile(query: MergeInto) -> str:
+    return str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_latest_row_is_kept():
+    s = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("s")
+
+    expected = """\
+        MERGE INTO `target`
+        USING (SELECT `s`.`t1` AS `t1`, `s`.`t2` AS `t2` 
+        FROM (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `s` 
+        WHERE true QUALIFY row_number() OVER (PARTITION BY `s`.`t1` ORDER BY `s`.`t2` DESC) = 1 ) AS `s`
+        ON `target`.`t1` = `s`.`t1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`s`.`t2`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (`s`.`t1`, `s`.`t2`)
+        """
+
+    query = MergeInto.upsert(target, s, ["t1"], deduplicate_on=["t1"], deduplicate_order_by="t2")
+
+    assert _compile(query) == dedent(expected)
+
+
+def test_order_by_expression():
+    query = MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.t1 == source.c.s1,
+        when_clauses=[WhenMatched(update(target).values(t2=source.c.s2))],
+        deduplicate_on=["s1"],
+        deduplicate_order_by=source.c.s2.asc(),
+    )
+
+    compiled = _compile(query)
+
+    assert "USING (SELECT `source`.`s1` AS `s1`, `source`.`s2` AS `s2` \nFROM `source` \n" \
+           "WHERE true QUALIFY row_number() OVER (PARTITION BY `source`.`s1` ORDER BY `source`.`s2` ASC) = 1 ) AS `source`\n" \
+           "ON `target`.`t1` = `source`.`s1`" in compiled
+    assert "UPDATE SET `t2`=`source`.`s2`" in compiled
+
+
+def test_without_order():
+    s = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("s")
+
+    compiled = _compile(MergeInto.upsert(target, s, ["t1"], deduplicate_on=["t1"]))
+
+    assert "QUALIFY row_number() OVER (PARTITION BY `s`.`t1`) = 1 ) AS `s`" in compiled
+
+
+def test_order_requires_keys():
+    with pytest.raises(AssertionError):
+        MergeInto.upsert(target, target.alias("S"), ["t1"], deduplicate_order_by="t2")
+
+
+def test_cache_key_covers_the_deduplication():
+    s = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("s")
+    dialect = CachingBigQueryDialect()
+
+    keys = [
+        query._generate_cache_key()
+        for query in [
+            MergeInto.upsert(target, s, ["t1"]),
+            MergeInto.upsert(target, s, ["t1"], deduplicate_on=["t1"]),
+            MergeInto.upsert(target, s, ["t1"], deduplicate_on=["t1"], deduplicate_order_by="t2"),
+            MergeInto.upsert(target, s, ["t1"], deduplicate_on=["t2"], deduplicate_order_by="t2"),
+        ]
+    ]
+
+    assert all(keys[i] != keys[j] for i in range(len(keys)) for j in range(i))
+    again = MergeInto.upsert(target, s, ["t1"], deduplicate_on=["t1"], deduplicate_order_by="t2")
+    assert again._generate_cache_key() == keys[2]
+    assert str(again.compile(dialect=dialect)).count("QUALIFY") == 1
+
+
+def test_with_pruning_and_partitions():
+    s = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("s")
+    query = MergeInto.upsert(
+        target, s, ["t1"], ["t1"],
+        deduplicate_on=["t1"], deduplicate_order_by="t2", prune_source_columns=True, partition_column="t2",
+    )
+
+    compiled = _compile(query)
+
+    # pruned after the deduplication, which still orders by the pruned column
+    assert compiled.startswith("MERGE INTO `target`\nUSING (SELECT `s`.`t1` AS `t1`, `s`.`t2` AS `t2` \n"
+                               "FROM (SELECT `s`.`t1` AS `t1`, `s`.`t2` AS `t2` \n")
+    # the partitions are the deduplicated source's
+    assert compiled.count("QUALIFY row_number() OVER (PARTITION BY `s`.`t1` ORDER BY `s`.`t2` DESC) = 1") == 2
+
+
+def test_shards_are_deduplicated():
+    s = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("s")
+    query = MergeInto.upsert(target, s, ["t1"], deduplicate_on=["t1"], deduplicate_order_by="t2")
+
+    for shard in shard_merge(query, "t1", shards=2):
+        compiled = _compile(shard)
+        assert "FROM `source`) AS `s` \nWHERE abs(mod(" in compiled
+        assert "WHERE true QUALIFY row_number() OVER (PARTITION BY `s`.`t1` ORDER BY `s`.`t2` DESC) = 1 ) AS `s`\n" in compiled
+        assert compiled.count("FROM `source`") == 1
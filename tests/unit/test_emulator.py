@@ -0,0 +1,201 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import Column, Date, Integer, MetaData, String, Table, delete, insert, update
+
+from pybigquery_merge_into.emulator import MergeEmulator, MergeError
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatched, WhenNotMatchedBySource
+from pybigquery_merge_into.planner import Strategy, plan_merge
+from tests.conftest import inventory, new_arrivals
+
+metadata = MetaData()
+
+events = Table(
+    "events",
+    metadata,
+    Column("id", Integer),
+    Column("value", String),
+    Column("day", Date),
+)
+
+new_events = Table(
+    "new_events",
+    metadata,
+    Column("id", Integer),
+    Column("value", String),
+    Column("day", Date),
+)
+
+
+@pytest.fixture
+def emulator():
+    return MergeEmulator()
+
+
+def _stock(emulator):
+    emulator.create_table(inventory, [
+        {"product": "dishwasher", "quantity": 30},
+        {"product": "dryer", "quantity": 30},
+        {"product": "front load washer", "quantity": 20},
+        {"product": "microwave", "quantity": 9},
+        {"product": "oven", "quantity": 5},
+        {"product": "top load washer", "quantity": 10},
+    ])
+    emulator.create_table(new_arrivals, [
+        {"product": "dryer", "quantity": 20, "warehouse": "warehouse #2"},
+        {"product": "oven", "quantity": 30, "warehouse": "warehouse #3"},
+        {"product": "refrigerator", "quantity": 25, "warehouse": "warehouse #2"},
+        {"product": "top load washer", "quantity": 10, "warehouse": "warehouse #1"},
+    ])
+
+
+def _quantities(emulator):
+    return {row["product"]: row["quantity"] for row in emulator.rows(inventory)}
+
+
+def test_documentation_example(emulator):
+    # https://cloud.google.com/bigquery/docs/reference/standard-sql/dml-syntax#merge_examples (example 2)
+    _stock(emulator)
+    T, S = inventory.alias("T"), new_arrivals.alias("S")
+    merge = MergeInto(T, S, T.c.product == S.c.product, [
+        WhenMatched(update(T).values(quantity=T.c.quantity + S.c.quantity)),
+        WhenNotMatched(insert(T).values(product=S.c.product, quantity=S.c.quantity)),
+        WhenNotMatchedBySource(delete(T), condition=T.c.quantity < 10),
+    ])
+
+    stats = emulator.execute(merge)
+
+    assert _quantities(emulator) == {
+        "dishwasher": 30, "dryer": 50, "front load washer": 20, "oven": 35, "refrigerator": 25, "top load washer": 20,
+    }
+    assert (stats.inserted_row_count, stats.updated_row_count, stats.deleted_row_count) == (1, 3, 1)
+    assert stats.num_dml_affected_rows == 5
+
+
+def test_first_applying_clause_wins(emulator):
+    _stock(emulator)
+    merge = MergeInto(inventory, new_arrivals, inventory.c.product == new_arrivals.c.product, [
+        WhenMatched(delete(inventory), condition=new_arrivals.c.warehouse == "warehouse #3"),
+        WhenMatched(update(inventory).values(quantity=0), condition=new_arrivals.c.quantity > 15),
+        WhenMatched(update(inventory).values(quantity=-1)),
+        WhenNotMatched(insert(inventory), condition=new_arrivals.c.quantity > 100),
+        WhenNotMatchedBySource(update(inventory).values(quantity=inventory.c.quantity * 2),
+                               condition=inventory.c.quantity >= 20),
+    ])
+
+    emulator.execute(merge)
+
+    assert _quantities(emulator) == {
+        "dishwasher": 60, "dryer": 0, "front load washer": 40, "microwave": 9, "top load washer": -1,
+    }
+
+
+def test_insert_row(emulator):
+    emulator.create_table(events, [{"id": 1, "value": "a", "day": date(2021, 1, 1)}])
+    emulator.create_table(new_events, [
+        {"id": 1, "value": "A", "day": date(2021, 1, 1)},
+        {"id": 2, "value": "b", "day": date(2021, 1, 2)},
+    ])
+    merge = MergeInto(events, new_events, events.c.id == new_events.c.id, [WhenNotMatched(insert(events))])
+
+    emulator.execute(merge)
+
+    assert emulator.rows(events) == [
+        {"id": 1, "value": "a", "day": date(2021, 1, 1)},
+        {"id": 2, "value": "b", "day": date(2021, 1, 2)},
+    ]
+
+
+def test_several_source_rows_matching_a_target_row_fail(emulator):
+    _stock(emulator)
+    emulator.execute(insert(new_arrivals).values(product="dryer", quantity=1, warehouse="warehouse #1"))
+    merge = MergeInto.upsert(inventory, new_arrivals, ["product"], ["product", "quantity"])
+
+    with pytest.raises(MergeError):
+        emulator.execute(merge)
+
+    # rolled back
+    assert _quantities(emulator)["dryer"] == 30
+    # fine when only inserting
+    merge = MergeInto(inventory, new_arrivals, inventory.c.product == new_arrivals.c.product, [
+        WhenNotMatched(insert(inventory).values(product=new_arrivals.c.product)),
+    ])
+    assert emulator.execute(merge).inserted_row_count == 1
+
+
+def test_partitions(emulator):
+    emulator.create_table(events, [
+        {"id": 1, "value": "a", "day": date(2021, 1, 1)},
+        {"id": 2, "value": "b", "day": date(2021, 1, 2)},
+        {"id": 3, "value": "c", "day": date(2021, 1, 2)},
+    ])
+    emulator.create_table(new_events, [{"id": 2, "value": "B", "day": date(2021, 1, 2)}])
+    merge = MergeInto.upsert(
+        events, new_events, ["id"], when_clauses=lambda source: [
+            WhenMatched(update(events).values(value=source.c.value)),
+            WhenNotMatchedBySource(delete(events)),
+        ],
+        partition_column="day",
+    )
+
+    emulator.execute(merge)
+
+    # only the partitions of the source are merged
+    assert emulator.rows(events) == [
+        {"id": 1, "value": "a", "day": date(2021, 1, 1)},
+        {"id": 2, "value": "B", "day": date(2021, 1, 2)},
+    ]
+
+
+@pytest.mark.parametrize("literal_binds", [False, True])
+def test_from_rows(emulator, literal_binds):
+    emulator.create_table(events, [{"id": i, "value": "old", "day": date(2021, 1, 1)} for i in range(10)])
+    rows = [{"id": i, "value": "new" if i % 2 else "old", "day": date(2021, 1, 1)} for i in range(5, 15)]
+
+    stats = [
+        emulator.execute(merge) for merge in MergeInto.from_rows(
+            events, rows, ["id"], max_rows=4, literal_binds=literal_binds, skip_unchanged=True,
+        )
+    ]
+
+    assert [row["id"] for row in emulator.rows(events) if row["value"] == "new"] == [5, 7, 9, 11, 13]
+    assert sum(s.inserted_row_count for s in stats) == 5
+    assert sum(s.updated_row_count for s in stats) == 3
+
+
+def test_deduplication(emulator):
+    emulator.create_table(events, [])
+    emulator.create_table(new_events, [
+        {"id": 1, "value": "first", "day": date(2021, 1, 1)},
+        {"id": 1, "value": "last", "day": date(2021, 1, 2)},
+    ])
+    merge = MergeInto.upsert(events, new_events, ["id"], deduplicate_on=["id"], deduplicate_order_by="day")
+
+    emulator.execute(merge)
+
+    assert emulator.rows(events) == [{"id": 1, "value": "last", "day": date(2021, 1, 2)}]
+
+
+@pytest.mark.parametrize("kwargs, strategy", [
+    ({}, Strategy.MERGE),
+    ({"covers_partitions": True}, Strategy.PARTITION_OVERWRITE),
+])
+def test_planned_statements_give_the_same_table(kwargs, strategy):
+    def merged(statement):
+        emulator = MergeEmulator()
+        emulator.create_table(events, [
+            {"id": 1, "value": "a", "day": date(2021, 1, 1)},
+            {"id": 2, "value": "b", "day": date(2021, 1, 2)},
+        ])
+        emulator.create_table(new_events, [
+            {"id": 2, "value": "B", "day": date(2021, 1, 2)},
+            {"id": 3, "value": "C", "day": date(2021, 1, 2)},
+        ])
+        emulator.execute(statement)
+        return sorted(emulator.rows(events), key=lambda row: row["id"])
+
+    merge = MergeInto.upsert(events, new_events, ["id"], partition_column="day")
+    plan = plan_merge(merge, **kwargs)
+
+    assert plan.strategy is strategy
+    assert merged(plan.statement) == merged(merge)
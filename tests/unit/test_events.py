@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import bindparam, delete, update
+
+from pybigquery_merge_into import client as client_module, events, merge_clause
+from pybigquery_merge_into._dialect import bigquery_dialect
+from pybigquery_merge_into.aio import execute_async
+from pybigquery_merge_into.client import execute
+from pybigquery_merge_into.events import LoggingObserver, MergeCompiled, StatementExecuted
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatchedBySource
+from pybigquery_merge_into.testing import FakeJobClient
+from tests.conftest import source, target
+
+
+def _merge() -> MergeInto:
+    return MergeInto(target, source, target.c.t1 == source.c.s1, [
+        WhenMatched(update(target).values(t1=bindparam("value", "a"), t2=source.c.s2)),
+        WhenNotMatchedBySource(delete(target), condition=target.c.t2 < bindparam("day", date(2021, 1, 1))),
+    ])
+
+
+@pytest.fixture
+def received():
+    received = []
+    events.add_observer(received.append)
+    yield received
+    events.remove_observer(received.append)
+
+
+def test_compile_event(received):
+    merge = _merge()
+    sql = str(merge.compile(dialect=bigquery_dialect()))
+
+    event, = received
+    assert isinstance(event, MergeCompiled)
+    assert event.statement is merge
+    assert len(event.when_clause_times) == 2 and event.elapsed >= sum(event.when_clause_times)
+    assert event.sql_length == len(sql)
+    assert event.bind_count == 2
+
+
+def test_execute_events(received):
+    client = FakeJobClient(lambda sql, parameters, options: {"total_bytes_processed": 100}, latency=0.01)
+
+    execute(client, _merge())
+
+    compiled, executed = received
+    assert isinstance(compiled, MergeCompiled) and isinstance(executed, StatementExecuted)
+    assert executed.compile_time >= compiled.elapsed
+    assert executed.stats.job_id == client.jobs[0].job_id
+    assert executed.stats.elapsed >= 0.01 and executed.stats.total_bytes_processed == 100
+    assert executed.wait_time >= 0.01
+    assert executed.error is None
+
+
+def test_wait_time_is_measured_by_the_client(received):
+    started = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    client = FakeJobClient(
+        lambda sql, parameters, options: {"started": started, "ended": started + timedelta(milliseconds=1)},
+        latency=0.05,
+    )
+
+    execute(client, _merge())
+
+    _, executed = received
+    # BigQuery's run time, the client's wait (polling included)
+    assert executed.stats.elapsed == 0.001
+    assert executed.wait_time >= 0.05
+
+
+def test_failures_are_reported(received):
+    error = RuntimeError("boom")
+    client = FakeJobClient(lambda sql, parameters, options: {"error": error})
+
+    with pytest.raises(RuntimeError):
+        execute(client, _merge())
+    with pytest.raises(RuntimeError):
+        asyncio.run(execute_async(client, _merge(), poll_interval=0))
+
+    failures = [event for event in received if isinstance(event, StatementExecuted)]
+    assert [event.error for event in failures] == [error, error]
+    assert [event.stats.job_id for event in failures] == [job.job_id for job in client.jobs]
+
+
+def test_failing_observers_are_ignored(caplog):
+    def observer(event):
+        raise ValueError("oops")
+
+    events.add_observer(observer)
+    try:
+        execute(FakeJobClient(), _merge())
+    finally:
+        events.remove_observer(observer)
+
+    assert "Observer" in caplog.text and "oops" in caplog.text
+
+
+def test_logging_observer(caplog):
+    observer = LoggingObserver(logging.getLogger("merges"), logging.INFO)
+    events.add_observer(observer)
+    try:
+        with caplog.at_level(logging.INFO, "merges"):
+            asyncio.run(execute_async(FakeJobClient(), _merge(), poll_interval=0))
+    finally:
+        events.remove_observer(observer)
+
+    compiled, executed = caplog.messages
+    assert compiled.startswith("Compiled a MERGE in ") and compiled.endswith(" parameters")
+    assert executed.startswith("Statement compiled in ") and "JobStats(job_id='fake_job_" in executed
+
+
+def test_nothing_is_measured_without_observers(monkeypatch):
+    def clock():
+        raise AssertionError("measured")
+
+    monkeypatch.setattr(merge_clause, "perf_counter", clock)
+    monkeypatch.setattr(client_module, "monotonic", clock)
+
+    assert events.observers == []
+    execute(FakeJobClient(), _merge())
@@ -0,0 +1,126 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into import events
+from pybigquery_merge_into.client import with_job_options
+from pybigquery_merge_into.incremental import (
+    FileWatermarkStore, SQLiteWatermarkStore, execute_incremental, incremental_merge,
+)
+from pybigquery_merge_into.merge_clause import MergeInto, WhenNotMatchedBySource
+from pybigquery_merge_into.testing import FakeJobClient
+from tests.conftest import source, target
+
+s = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("s")
+
+
+def _merge() -> MergeInto:
+    return MergeInto.upsert(target, s, ["t1"])
+
+
+def _client(latest, error=None) -> FakeJobClient:
+    def on_query(sql, parameters, options):
+        if sql.startswith("SELECT max("):
+            return {"rows": [(latest,)]}
+        return {"error": error}
+
+    return FakeJobClient(on_query)
+
+
+def test_incremental_merge_filters_the_source():
+    query = incremental_merge(_merge(), "t2", date(2021, 1, 1), date(2021, 1, 31))
+
+    compiled = str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True}))
+
+    assert "FROM `source`) AS `s` \nWHERE `s`.`t2` > DATE '2021-01-01' AND `s`.`t2` <= DATE '2021-01-31') AS `s`\n" \
+           "ON `target`.`t1` = `s`.`t1`" in compiled
+    assert "UPDATE SET `t2`=`s`.`t2`" in compiled
+
+
+def test_not_matched_by_source_is_refused():
+    query = MergeInto.upsert(target, s, ["t1"], when_clauses=lambda source: [WhenNotMatchedBySource(delete(target))])
+
+    with pytest.raises(AssertionError):
+        incremental_merge(query, "t2", None, date(2021, 1, 31))
+
+
+def test_watermark_advances():
+    store = SQLiteWatermarkStore()
+
+    client = _client(date(2021, 1, 31))
+    assert execute_incremental(client, _merge(), "t2", store) is not None
+    assert store.get("target") == date(2021, 1, 31)
+    # first run: everything up to the latest row
+    (select_max, parameters, _), (merge, _, _) = client.queries
+    assert "WHERE" not in select_max
+    assert "WHERE `s`.`t2` <= %(t2_1:DATE)s" in merge
+
+    client = _client(date(2021, 2, 28))
+    execute_incremental(client, _merge(), "t2", store)
+    assert store.get("target") == date(2021, 2, 28)
+    (select_max, parameters, _), (merge, merge_parameters, _) = client.queries
+    assert parameters == {"t2_1": date(2021, 1, 31)}
+    assert "WHERE `s`.`t2` > %(t2_1:DATE)s AND `s`.`t2` <= %(t2_2:DATE)s" in merge
+    assert [merge_parameters["t2_1"], merge_parameters["t2_2"]] == [date(2021, 1, 31), date(2021, 2, 28)]
+
+
+def test_watermark_lookup_uses_the_job_options():
+    client = _client(date(2021, 1, 31))
+    merge = with_job_options(_merge(), location="EU", labels={"job": "daily"})
+
+    execute_incremental(client, merge, "t2", SQLiteWatermarkStore(), priority="BATCH")
+
+    (_, _, select_options), (_, _, merge_options) = client.queries
+    assert select_options == merge_options == {"location": "EU", "labels": {"job": "daily"}, "priority": "BATCH"}
+
+
+def test_watermark_lookup_is_observed():
+    received = []
+    events.add_observer(received.append)
+    try:
+        execute_incremental(_client(date(2021, 1, 31)), _merge(), "t2", SQLiteWatermarkStore())
+    finally:
+        events.remove_observer(received.append)
+
+    lookup, merge = [event.statement for event in received if isinstance(event, events.StatementExecuted)]
+    assert not isinstance(lookup, MergeInto) and isinstance(merge, MergeInto)
+
+
+def test_nothing_new():
+    store = SQLiteWatermarkStore()
+    store.set("target", date(2021, 1, 31))
+    client = _client(None)
+
+    assert execute_incremental(client, _merge(), "t2", store) is None
+    assert len(client.queries) == 1
+    assert store.get("target") == date(2021, 1, 31)
+
+
+def test_failed_merge_keeps_the_watermark():
+    store = SQLiteWatermarkStore()
+    store.set("daily", date(2021, 1, 31))
+
+    with pytest.raises(RuntimeError):
+        execute_incremental(_client(date(2021, 2, 28), RuntimeError("boom")), _merge(), "t2", store, key="daily")
+
+    assert store.get("daily") == date(2021, 1, 31)
+
+
+@pytest.mark.parametrize("value", [
+    datetime(2021, 1, 31, 12, 30, tzinfo=timezone.utc), date(2021, 1, 31), Decimal("1.5"), 42, "v2",
+])
+def test_stores_round_trip(tmp_path, value):
+    path = tmp_path / "watermarks.json"
+
+    for store in [FileWatermarkStore(str(path)), SQLiteWatermarkStore(str(tmp_path / "watermarks.db"))]:
+        assert store.get("k") is None
+        store.set("k", value)
+        store.set("other", 0)
+        assert store.get("k") == value and type(store.get("k")) is type(value)
+
+    # written through a temp file, nothing left behind
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+    assert FileWatermarkStore(str(path)).get("other") == 0
@@ -0,0 +1,110 @@
+from datetime import date
+from textwrap import dedent
+
+import pytest
+from sqlalchemy import delete, select, update
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into.emulator import MergeEmulator
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatchedBySource
+from tests.conftest import source, target
+
+# same columns as the target, so the partition column (t2) can be found in the source
+sub = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("sub")
+
+
+def _merge(**kwargs) -> MergeInto:
+    return MergeInto(
+        target=target,
+        source=sub,
+        onclause=target.c.t1 == sub.c.t1,
+        when_clauses=[
+            WhenMatched(update(target).values(t2=sub.c.t2)),
+            WhenNotMatchedBySource(delete(target), condition=target.c.t1 != "keep"),
+        ],
+        **kwargs
+    )
+
+
+def test_semi_join_on_source_partitions():
+    expected = """\
+        MERGE INTO `target`
+        USING (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `sub`
+        ON `target`.`t1` = `sub`.`t1` AND `target`.`t2` IN (SELECT DISTINCT `sub`.`t2` 
+        FROM (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `sub`)
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`sub`.`t2`
+        WHEN NOT MATCHED BY SOURCE AND `target`.`t1` != 'keep' AND `target`.`t2` IN (SELECT DISTINCT `sub`.`t2` 
+        FROM (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `sub`) THEN 
+        \tDELETE
+        """
+
+    query = _merge(partition_column="t2")
+
+    assert str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True})) == dedent(expected)
+
+
+def test_literal_partition_range():
+    expected = """\
+        MERGE INTO `target`
+        USING (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `sub`
+        ON `target`.`t1` = `sub`.`t1` AND `target`.`t2` BETWEEN DATE '2020-01-01' AND DATE '2020-01-31'
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`sub`.`t2`
+        WHEN NOT MATCHED BY SOURCE AND `target`.`t1` != 'keep' AND `target`.`t2` BETWEEN DATE '2020-01-01' AND DATE '2020-01-31' THEN 
+        \tDELETE
+        """
+
+    query = _merge(partition_column="t2", partition_range=(date(2020, 1, 1), date(2020, 1, 31)))
+
+    assert str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True})) == dedent(expected)
+
+
+def test_when_clauses_are_left_untouched():
+    query = _merge(partition_column="t2")
+    str(query.compile(dialect=BigQueryDialect()))
+
+    assert str(query.when_clauses[1].condition.compile()) == "target.t1 != :t1_1"
+
+
+def test_partition_range_is_cached_as_parameters():
+    january = _merge(partition_column="t2", partition_range=(date(2020, 1, 1), date(2020, 1, 31)))
+    february = _merge(partition_column="t2", partition_range=(date(2020, 2, 1), date(2020, 2, 29)))
+
+    assert january._generate_cache_key() == february._generate_cache_key()
+    assert january._generate_cache_key() != _merge(partition_column="t2")._generate_cache_key()
+    assert january._generate_cache_key() != _merge()._generate_cache_key()
+
+
+def test_partition_range_requires_a_column():
+    with pytest.raises(AssertionError):
+        _merge(partition_range=(date(2020, 1, 1), date(2020, 1, 31)))
+
+
+@pytest.mark.parametrize(["rows", "pruning"], [
+    ([{"t1": "a", "t2": date(2020, 1, 2)}, {"t1": "b", "t2": date(2020, 1, 1)}],
+     "`target`.`t2` BETWEEN DATE '2020-01-01' AND DATE '2020-01-02'"),
+    ([{"t1": "a", "t2": date(2020, 1, 2)}, {"t1": "b", "t2": None}],
+     "`target`.`t2` IN (SELECT DISTINCT `source`.`t2`"),
+])
+def test_from_rows_partition_range(rows, pruning):
+    query, = MergeInto.from_rows(target, rows, key_columns=["t1"], partition_column="t2", literal_binds=True)
+
+    compiled = str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True}))
+
+    assert f"ON `target`.`t1` = `source`.`t1` AND {pruning}" in compiled
+
+
+def test_rows_moving_to_another_partition_are_not_matched():
+    emulator = MergeEmulator()
+    emulator.create_table(target, [{"t1": "a", "t2": date(2020, 1, 1)}])
+    emulator.create_table(source, [{"s1": "a", "s2": date(2020, 1, 2)}])
+
+    emulator.execute(MergeInto.upsert(target, sub, ["t1"], partition_column="t2"))
+
+    # the old row is outside of the source's partitions, the new one is inserted next to it
+    assert sorted(row["t2"] for row in emulator.rows(target)) == [date(2020, 1, 1), date(2020, 1, 2)]
@@ -0,0 +1,126 @@
+from textwrap import dedent
+
+from sqlalchemy import delete, insert, literal, select, update
+
+from pybigquery_merge_into._dialect import bigquery_dialect
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatched, WhenNotMatchedBySource
+from pybigquery_merge_into.planner import Strategy, plan_merge
+from tests.conftest import inventory, new_arrivals, source, target
+
+s = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("s")
+
+
+def _compile(statement) -> str:
+    return str(statement.compile(dialect=bigquery_dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_insert_only_merge_is_an_insert():
+    I = inventory.alias("I")
+    merge = MergeInto(I, new_arrivals, I.c.product == new_arrivals.c.product, [
+        WhenNotMatched(insert(I).values(product=new_arrivals.c.product, quantity=new_arrivals.c.quantity),
+                       condition=new_arrivals.c.quantity > 0),
+    ])
+
+    expected = """\
+        INSERT INTO `dataset.Inventory` (`product`, `quantity`) SELECT `dataset.NewArrivals`.`product`, `dataset.NewArrivals`.`quantity` 
+        FROM `dataset.NewArrivals` 
+        WHERE `dataset.NewArrivals`.`quantity` > 0 AND NOT (EXISTS (SELECT * 
+        FROM `dataset.Inventory` AS `I` 
+        WHERE `I`.`product` = `dataset.NewArrivals`.`product`))"""
+
+    plan = plan_merge(merge)
+
+    assert plan.strategy is Strategy.INSERT_MISSING
+    assert _compile(plan.statement) == dedent(expected)
+
+
+def test_new_keys_are_appended():
+    merge = MergeInto(inventory, new_arrivals, inventory.c.product == new_arrivals.c.product, [
+        WhenNotMatched(insert(inventory)),
+    ])
+
+    plan = plan_merge(merge, new_keys_only=True)
+
+    assert plan.strategy is Strategy.APPEND
+    assert _compile(plan.statement) == \
+        "INSERT INTO `dataset.Inventory` (`product`, `quantity`, `supply_constrained`) " \
+        "SELECT `dataset.NewArrivals`.`product`, `dataset.NewArrivals`.`quantity`, `dataset.NewArrivals`.`warehouse` \n" \
+        "FROM `dataset.NewArrivals`"
+
+
+def test_insert_keeps_the_partitions_and_deduplication():
+    merge = MergeInto.upsert(target, s, ["t1"], ["t1"], partition_column="t2", deduplicate_on=["t1"])
+
+    compiled = _compile(plan_merge(merge).statement)
+
+    assert compiled.startswith("INSERT INTO `target` (`t1`) SELECT `s`.`t1` \nFROM (SELECT `s`.`t1` AS `t1`")
+    assert "WHERE true QUALIFY row_number() OVER (PARTITION BY `s`.`t1`) = 1 ) AS `s` \nWHERE NOT (EXISTS" in compiled
+    assert "WHERE `target`.`t1` = `s`.`t1` AND `target`.`t2` IN (SELECT DISTINCT `s`.`t2`" in compiled
+
+
+def test_covered_partitions_are_replaced():
+    merge = MergeInto.upsert(target, s, ["t1"], partition_column="t2")
+
+    expected = """\
+        Strategy: partition_overwrite
+        - upserts partitions the source covers
+        - replacing them doesn't join the source with the target
+
+        MERGE INTO `target`
+        USING (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `s`
+        ON false
+        WHEN NOT MATCHED BY SOURCE AND `target`.`t2` IN (SELECT DISTINCT `s`.`t2` 
+        FROM (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `s`) THEN 
+        \tDELETE
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (`s`.`t1`, `s`.`t2`)"""
+
+    plan = plan_merge(merge, covers_partitions=True)
+
+    assert plan.strategy is Strategy.PARTITION_OVERWRITE
+    assert plan.explain() == dedent(expected)
+
+
+def test_partitions_are_replaced_only_when_equivalent():
+    cases = {
+        "no `partition_column`": MergeInto.upsert(target, s, ["t1"]),
+        "not an upsert": MergeInto.upsert(target, s, ["t1"], partition_column="t2", when_clauses=lambda source: [
+            WhenMatched(delete(target)), WhenNotMatched(insert(target).values(t1=source.c.t1, t2=source.c.t2)),
+        ]),
+        "conditional WHEN clauses": MergeInto.upsert(target, s, ["t1"], partition_column="t2", when_clauses=lambda source: [
+            WhenMatched(update(target).values(t2=source.c.t2), condition=source.c.t2 > target.c.t2),
+            WhenNotMatched(insert(target).values(t1=source.c.t1, t2=source.c.t2)),
+        ]),
+        "`t2` is updated & inserted with different values": MergeInto.upsert(
+            target, s, ["t1"], partition_column="t2", when_clauses=lambda source: [
+                WhenMatched(update(target).values(t2=literal("2021-01-01"))),
+                WhenNotMatched(insert(target).values(t1=source.c.t1, t2=source.c.t2)),
+            ],
+        ),
+        "the INSERT doesn't set t2": MergeInto.upsert(target, s, ["t1"], partition_column="t2", when_clauses=lambda source: [
+            WhenMatched(update(target).values(t1=source.c.t1)),
+            WhenNotMatched(insert(target).values(t1=source.c.t1)),
+        ]),
+    }
+
+    for reason, merge in cases.items():
+        plan = plan_merge(merge, covers_partitions=True)
+
+        assert plan.strategy is Strategy.MERGE
+        assert plan.statement is merge
+        assert plan.reasons[0].startswith(f"can't replace the partitions: {reason}")
+
+
+def test_merges_stay_merges():
+    merge = MergeInto.upsert(target, s, ["t1"], when_clauses=lambda source: [
+        WhenMatched(update(target).values(t2=source.c.t2)),
+        WhenNotMatchedBySource(delete(target)),
+    ])
+
+    plan = plan_merge(merge)
+
+    assert plan.strategy is Strategy.MERGE
+    assert plan.reasons == ["updates or deletes existing rows"]
+    assert plan.explain().startswith("Strategy: merge\n- updates or deletes existing rows\n\nMERGE INTO `target`")
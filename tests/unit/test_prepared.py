@@ -0,0 +1,92 @@
+import pickle
+from datetime import date
+from itertools import count
+
+import pytest
+from sqlalchemy import Column, Date, Integer, MetaData, String, Table, bindparam, update
+
+from pybigquery_merge_into.client import compile_statement
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched
+from pybigquery_merge_into.prepared import PreparedMerge
+from pybigquery_merge_into.testing import FakeJobClient
+from tests.conftest import source, target
+
+
+def _merge(day=None) -> MergeInto:
+    value = bindparam("day", type_=target.c.t2.type) if day is None else day
+    return MergeInto(
+        target=target,
+        source=source,
+        onclause=(target.c.t1 == source.c.s1) & (source.c.s1 != "skip"),
+        when_clauses=[WhenMatched(update(target).values(t2=value))],
+    )
+
+
+def test_same_sql_as_a_regular_compile():
+    prepared = PreparedMerge(_merge(date(2020, 1, 1)))
+
+    assert (prepared.sql, prepared.parameters()) == compile_statement(_merge(date(2020, 1, 1)))
+    assert prepared.parameter_names == {"s1_1", "t2"}
+
+
+def test_bind_new_values():
+    client = FakeJobClient()
+    prepared = PreparedMerge(_merge())
+
+    prepared.execute(client, {"day": date(2020, 1, 1)})
+    prepared.submit(client, {"day": date(2020, 1, 2), "s1_1": "other"}, priority="BATCH")
+
+    assert client.queries == [
+        (prepared.sql, {"day": date(2020, 1, 1), "s1_1": "skip"}, {}),
+        (prepared.sql, {"day": date(2020, 1, 2), "s1_1": "other"}, {"priority": "BATCH"}),
+    ]
+
+
+def test_required_and_unknown_parameters():
+    prepared = PreparedMerge(_merge())
+
+    with pytest.raises(AssertionError, match="Missing"):
+        prepared.parameters({"s1_1": "other"})
+    with pytest.raises(AssertionError, match="Unknown"):
+        prepared.parameters({"day": date(2020, 1, 1), "typo": 1})
+
+
+def test_rows_parameter():
+    prepared = PreparedMerge(next(MergeInto.from_rows(target, [{"t1": "a", "t2": date(2020, 1, 1)}], ["t1"])))
+
+    rows = [{"t1": "b", "t2": None}, {"t1": "c", "t2": date(2020, 1, 2)}]
+
+    assert prepared.parameters({"rows_1": rows}) == {"rows_1": rows}
+
+
+def test_picklable():
+    prepared = PreparedMerge(_merge())
+
+    unpickled = pickle.loads(pickle.dumps(prepared))
+
+    assert unpickled.sql == prepared.sql
+    assert unpickled.parameters({"day": date(2020, 1, 1)}) == prepared.parameters({"day": date(2020, 1, 1)})
+
+
+def test_callable_values_are_called_on_each_run():
+    versions = count(1)
+    versioned = Table(
+        "versioned",
+        MetaData(),
+        Column("t1", String),
+        Column("t2", Date),
+        Column("version", Integer, onupdate=lambda: next(versions)),
+    )
+    prepared = PreparedMerge(MergeInto(
+        target=versioned,
+        source=source,
+        onclause=versioned.c.t1 == source.c.s1,
+        when_clauses=[WhenMatched(update(versioned).values(t2=bindparam("day", type_=Date)))],
+    ))
+    day = {"day": date(2020, 1, 1)}
+
+    called = [prepared.parameters(day)["version"] for _ in range(3)]
+    assert called == list(range(called[0], called[0] + 3))
+    assert prepared.parameters({**day, "version": 10})["version"] == 10
+    with pytest.raises(AssertionError):
+        pickle.dumps(prepared)
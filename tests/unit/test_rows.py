@@ -0,0 +1,228 @@
+from datetime import date
+from textwrap import dedent
+
+import pytest
+from google.cloud.bigquery.dbapi import _helpers, cursor
+from sqlalchemy import delete
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into import client, events
+from pybigquery_merge_into.client import StatementTooLarge, check_limits, compile_statement, execute
+from pybigquery_merge_into.merge_clause import MergeInto, WhenNotMatchedBySource
+from pybigquery_merge_into.rows import chunk_rows, rows_source
+from pybigquery_merge_into.testing import FakeJobClient
+from tests.conftest import detailed_inventory, inventory, target
+
+rows = [
+    {"t1": "a", "t2": date(2020, 1, 1)},
+    {"t1": "it's"},
+]
+
+
+def test_rows_as_parameter():
+    query = list(MergeInto.from_rows(target, rows, key_columns=["t1"]))
+
+    expected = """\
+        MERGE INTO `target`
+        USING (SELECT `t1`, `t2` 
+        FROM unnest(%(rows_1:ARRAY<STRUCT<t1 STRING, t2 DATE>>)s)) AS `source`
+        ON `target`.`t1` = `source`.`t1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`source`.`t2`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (`source`.`t1`, `source`.`t2`)
+        """
+
+    assert len(query) == 1
+
+    compiled = query[0].compile(dialect=BigQueryDialect(paramstyle="pyformat"))
+    assert str(compiled) == dedent(expected)
+    assert compiled.params == {"rows_1": [{"t1": "a", "t2": date(2020, 1, 1)}, {"t1": "it's", "t2": None}]}
+
+
+def test_rows_parameter_is_understood_by_the_dbapi():
+    query, = MergeInto.from_rows(target, rows, key_columns=["t1"])
+    compiled = query.compile(dialect=BigQueryDialect(paramstyle="pyformat"))
+
+    _, types = cursor._extract_types(str(compiled))
+    parameter, = _helpers.to_query_parameters(compiled.params, types)
+
+    assert parameter.to_api_repr()["parameterType"] == {
+        "type": "ARRAY",
+        "arrayType": {
+            "type": "STRUCT",
+            "structTypes": [{"name": "t1", "type": {"type": "STRING"}}, {"name": "t2", "type": {"type": "DATE"}}],
+        },
+    }
+
+
+def test_rows_as_literals():
+    query, = MergeInto.from_rows(target, rows, key_columns=["t1"], literal_binds=True)
+
+    expected = """\
+        MERGE INTO `target`
+        USING (SELECT `t1`, `t2` 
+        FROM unnest(ARRAY<STRUCT<t1 STRING, t2 DATE>>[STRUCT('a', DATE '2020-01-01'), STRUCT("it's", NULL)])) AS `source`
+        ON `target`.`t1` = `source`.`t1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`source`.`t2`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (`source`.`t1`, `source`.`t2`)
+        """
+
+    assert str(query.compile(dialect=BigQueryDialect())) == dedent(expected)
+
+
+def test_unrenderable_literals_are_sent_as_a_parameter():
+    rows = [{"product": "dryer", "quantity": 3, "comments": [{"note": "x"}], "specifications": {"color": "white"}}]
+
+    query, = MergeInto.from_rows(detailed_inventory, rows, key_columns=["product"], literal_binds=True)
+    compiled = query.compile(dialect=BigQueryDialect(paramstyle="pyformat"))
+
+    assert "unnest(%(rows_1:ARRAY<STRUCT<" in str(compiled)
+    assert compiled.params["rows_1"] == [{**rows[0], "supply_constrained": None}]
+    with pytest.raises(AssertionError, match="can't be rendered as literals"):
+        rows_source(list(detailed_inventory.c), rows, literal_binds=True)
+
+
+def test_several_key_columns_and_column_subset():
+    query, = MergeInto.from_rows(
+        inventory,
+        [{"product": "oven", "supply_constrained": True, "quantity": 1}],
+        key_columns=["product", "supply_constrained"],
+        columns=["product", "supply_constrained", "quantity"],
+    )
+
+    compiled = str(query.compile(dialect=BigQueryDialect()))
+
+    assert "ON `dataset.Inventory`.`product` = `source`.`product` AND " \
+           "`dataset.Inventory`.`supply_constrained` = `source`.`supply_constrained`" in compiled
+    assert "UPDATE SET `quantity`=`source`.`quantity`" in compiled
+
+
+def test_only_key_columns():
+    query, = MergeInto.from_rows(target, rows, key_columns=["t1", "t2"])
+
+    assert "WHEN MATCHED" not in str(query.compile(dialect=BigQueryDialect()))
+
+
+def test_custom_when_clauses():
+    query, = MergeInto.from_rows(
+        target,
+        rows,
+        key_columns=["t1"],
+        when_clauses=lambda source: [WhenNotMatchedBySource(delete(target), condition=target.c.t2 < date.today())],
+    )
+
+    assert query.when_clauses[0].when_type() == "WHEN NOT MATCHED BY SOURCE"
+
+
+def test_chunks_share_a_cache_key():
+    first, second = MergeInto.from_rows(target, rows, key_columns=["t1"], max_rows=1)
+
+    first_key, second_key = first._generate_cache_key(), second._generate_cache_key()
+
+    assert first_key == second_key
+    assert first_key.bindparams[0].value == [{"t1": "a", "t2": date(2020, 1, 1)}]
+    assert second_key.bindparams[0].value == [{"t1": "it's", "t2": None}]
+
+
+def test_chunk_by_row_count():
+    chunks = list(chunk_rows(list(target.c), ({"t1": str(i)} for i in range(10)), max_rows=4))
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+
+
+@pytest.mark.parametrize("literal_binds", [True, False])
+def test_chunk_by_size(literal_binds):
+    columns = list(target.c)
+    many_rows = [{"t1": "x" * 100, "t2": date(2020, 1, 1)}] * 1000
+    max_size = 10_000
+
+    chunks = list(chunk_rows(columns, many_rows, literal_binds=literal_binds, max_size=max_size))
+
+    assert sum(len(chunk) for chunk in chunks) == len(many_rows)
+    assert len(chunks) > 1
+
+    if literal_binds:
+        # the estimation is supposed to be pessimistic
+        dialect = BigQueryDialect()
+        for chunk in chunks:
+            assert len(str(rows_source(columns, chunk, literal_binds=True).compile(dialect=dialect))) < max_size
+
+
+def test_row_too_big():
+    with pytest.raises(AssertionError):
+        list(chunk_rows(list(target.c), [{"t1": "x" * 1000}], max_size=100))
+
+
+def test_no_rows():
+    assert list(MergeInto.from_rows(target, [], key_columns=["t1"])) == []
+
+
+def test_limits_are_checked_before_submission(monkeypatch):
+    check_limits("SELECT 1", {"a": 1})
+
+    with pytest.raises(StatementTooLarge) as error:
+        check_limits("x" * (client.MAX_QUERY_LENGTH + 1), {f"p{i}": i for i in range(client.MAX_QUERY_PARAMETERS + 1)})
+    assert error.value.problems == [
+        f"{client.MAX_QUERY_LENGTH + 1} characters > {client.MAX_QUERY_LENGTH}",
+        f"{client.MAX_QUERY_PARAMETERS + 1} parameters > {client.MAX_QUERY_PARAMETERS}",
+    ]
+
+    monkeypatch.setattr(client, "MAX_REQUEST_SIZE", 500)
+    merge = MergeInto.upsert(target, rows_source(list(target.c), [{"t1": "x" * 100}] * 5), ["t1"])
+    with pytest.raises(StatementTooLarge, match="request over 500 bytes"):
+        compile_statement(merge)
+
+
+def test_fitted_statements_are_compiled_once():
+    compiled = []
+    events.add_observer(compiled.append)
+    try:
+        merges = list(MergeInto.from_rows(target, rows * 4, key_columns=["t1"], max_rows=4))
+        checked = len(compiled)
+
+        # copies aren't compiled yet
+        execute(FakeJobClient(), merges[0].with_job_options(priority="BATCH"))
+        for merge in merges:
+            execute(FakeJobClient(), merge)
+        # the second execution isn't from_rows' anymore
+        execute(FakeJobClient(), merges[0])
+    finally:
+        events.remove_observer(compiled.append)
+
+    assert checked == 2
+    assert [type(event) for event in compiled[checked:]] == [
+        events.MergeCompiled, events.StatementExecuted,
+        events.StatementExecuted, events.StatementExecuted,
+        events.MergeCompiled, events.StatementExecuted,
+    ]
+
+
+def test_oversized_literals_become_a_parameter(monkeypatch):
+    monkeypatch.setattr(client, "MAX_QUERY_LENGTH", 2000)
+    many_rows = [{"t1": "x" * 100, "t2": date(2020, 1, 1)}] * 30
+
+    # the chunk's estimated size fits, the statement doesn't
+    merge, = MergeInto.from_rows(target, many_rows, key_columns=["t1"], literal_binds=True, max_size=100_000)
+
+    sql, parameters = compile_statement(merge)
+    assert "FROM unnest(%(rows_1:ARRAY<STRUCT<t1 STRING, t2 DATE>>)s)" in sql
+    assert len(parameters["rows_1"]) == 30
+
+
+def test_oversized_parameters_are_split(monkeypatch):
+    monkeypatch.setattr(client, "MAX_QUERY_LENGTH", 2000)
+    monkeypatch.setattr(client, "MAX_REQUEST_SIZE", 2000)
+    many_rows = [{"t1": str(i) * 50, "t2": date(2020, 1, 1)} for i in range(30)]
+
+    merges = list(MergeInto.from_rows(target, many_rows, key_columns=["t1"], literal_binds=True, max_size=100_000))
+
+    assert len(merges) > 1
+    chunks = [compile_statement(merge)[1]["rows_1"] for merge in merges]
+    assert [row["t1"] for chunk in chunks for row in chunk] == [row["t1"] for row in many_rows]
+
+    monkeypatch.setattr(client, "MAX_REQUEST_SIZE", 100)
+    with pytest.raises(StatementTooLarge):
+        list(MergeInto.from_rows(target, many_rows, key_columns=["t1"]))
@@ -0,0 +1,100 @@
+from datetime import date
+from textwrap import dedent
+
+from sqlalchemy import Boolean, Column, Date, Integer, MetaData, String, Table
+
+from pybigquery_merge_into.client import compile_statement
+from pybigquery_merge_into.emulator import MergeEmulator
+from pybigquery_merge_into.merge_clause import MergeInto
+
+metadata = MetaData()
+
+customers = Table(
+    "customers",
+    metadata,
+    Column("id", Integer),
+    Column("city", String),
+    Column("tier", String),
+    Column("valid_from", Date),
+    Column("valid_to", Date),
+    Column("current", Boolean),
+)
+
+updates = Table(
+    "updates",
+    metadata,
+    Column("id", Integer),
+    Column("city", String),
+    Column("tier", String),
+    Column("loaded_on", Date),
+)
+
+
+def test_scd2_merge():
+    # `current` is left out, it's a plain column without `current_flag`
+    merge = MergeInto.scd2(
+        customers, updates, ["id"], tracked_columns=["city"], columns=["id", "city", "tier"], effective_at="loaded_on",
+    )
+
+    expected = """\
+        MERGE INTO `customers`
+        USING (SELECT `updates`.`id` AS `_merge_key_id`, `updates`.`id` AS `id`, `updates`.`city` AS `city`, `updates`.`tier` AS `tier`, `updates`.`loaded_on` AS `loaded_on` 
+        FROM `updates` UNION ALL SELECT NULL AS `_merge_key_id`, `updates`.`id` AS `id`, `updates`.`city` AS `city`, `updates`.`tier` AS `tier`, `updates`.`loaded_on` AS `loaded_on` 
+        FROM `updates` JOIN `customers` AS `_current` ON `_current`.`id` = `updates`.`id` AND `_current`.`valid_to` IS NULL 
+        WHERE `_current`.`city` IS DISTINCT FROM `updates`.`city`) AS `updates`
+        ON `customers`.`id` = `updates`.`_merge_key_id` AND `customers`.`valid_to` IS NULL
+        WHEN MATCHED AND `customers`.`city` IS DISTINCT FROM `updates`.`city` THEN 
+        \tUPDATE SET `valid_to`=`updates`.`loaded_on`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`id`, `city`, `tier`, `valid_from`, `valid_to`) VALUES (`updates`.`id`, `updates`.`city`, `updates`.`tier`, `updates`.`loaded_on`, NULL)
+        """
+
+    assert compile_statement(merge)[0] == dedent(expected)
+
+
+def test_open_valid_to_and_default_effective_time():
+    merge = MergeInto.scd2(
+        customers, updates, ["id"], columns=["id", "city", "tier"], open_valid_to=date(9999, 12, 31),
+    )
+
+    sql, parameters = compile_statement(merge)
+
+    assert "ON `customers`.`id` = `updates`.`_merge_key_id` AND `customers`.`valid_to` = %(valid_to_2:DATE)s" in sql
+    # every non-key column is tracked by default
+    assert "WHEN MATCHED AND (`customers`.`city` IS DISTINCT FROM `updates`.`city` " \
+           "OR `customers`.`tier` IS DISTINCT FROM `updates`.`tier`) THEN \n\tUPDATE SET `valid_to`=CURRENT_DATE()" in sql
+    assert "VALUES (`updates`.`id`, `updates`.`city`, `updates`.`tier`, CURRENT_DATE(), %(param_1:DATE)s)" in sql
+    assert set(parameters.values()) == {date(9999, 12, 31)}
+
+
+def test_history():
+    emulator = MergeEmulator()
+    emulator.create_table(customers)
+    merge = MergeInto.scd2(
+        customers, updates, ["id"], tracked_columns=["city"], current_flag="current", effective_at="loaded_on",
+    )
+
+    loads = [
+        (date(2021, 1, 1), [(1, "Paris", "a"), (2, "Lyon", "a")]),
+        (date(2021, 2, 1), [(1, "Nice", "a"), (2, "Lyon", "b"), (3, "Lille", "a")]),
+        (date(2021, 3, 1), [(1, "Paris", "a")]),
+    ]
+    stats = []
+    for day, rows in loads:
+        emulator.create_table(updates, [{"id": i, "city": city, "tier": tier, "loaded_on": day} for i, city, tier in rows])
+        stats.append(emulator.execute(merge))
+
+    history = sorted(
+        ((row["id"], row["city"], row["tier"], row["valid_from"], row["valid_to"], row["current"])
+         for row in emulator.rows(customers)),
+        key=lambda row: (row[0], row[3]),
+    )
+    assert history == [
+        (1, "Paris", "a", date(2021, 1, 1), date(2021, 2, 1), False),
+        (1, "Nice", "a", date(2021, 2, 1), date(2021, 3, 1), False),
+        (1, "Paris", "a", date(2021, 3, 1), None, True),
+        # `tier` isn't tracked
+        (2, "Lyon", "a", date(2021, 1, 1), None, True),
+        (3, "Lille", "a", date(2021, 2, 1), None, True),
+    ]
+    assert [(s.inserted_row_count, s.updated_row_count) for s in stats] == [(2, 0), (2, 1), (1, 1)]
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from sqlalchemy import update
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched
+from pybigquery_merge_into.scheduler import DmlScheduler, is_conflict
+from pybigquery_merge_into.testing import ConflictingDml, FakeJobClient, SerializationConflict
+from tests.conftest import inventory, max_overlap, new_arrivals, update_merge
+
+
+def _inventory_merge(quantity: int) -> MergeInto:
+    T = inventory.alias("T")
+    return MergeInto(T, new_arrivals, T.c.product == new_arrivals.c.product, [
+        WhenMatched(update(T).values(quantity=quantity)),
+    ])
+
+
+def _run(scheduler: DmlScheduler, statements):
+    async def main():
+        return await asyncio.gather(*(scheduler.execute(statement) for statement in statements))
+
+    return asyncio.run(main())
+
+
+def test_per_table_concurrency():
+    client = FakeJobClient(latency=0.05)
+    scheduler = DmlScheduler(client, max_per_table=2, poll_interval=0.005)
+
+    _run(scheduler, [update_merge(t1=str(i)) for i in range(6)] + [_inventory_merge(i) for i in range(6)])
+
+    target_jobs = [job for job, (sql, _, _) in zip(client.jobs, client.queries) if "`target`" in sql]
+    inventory_jobs = [job for job, (sql, _, _) in zip(client.jobs, client.queries) if "`dataset.Inventory`" in sql]
+
+    assert max_overlap(target_jobs) == max_overlap(inventory_jobs) == 2
+    # the tables don't wait for each other
+    assert max_overlap(client.jobs) == 4
+
+    metrics = scheduler.metrics
+    assert set(metrics) == {"target", "dataset.Inventory"}
+    assert metrics["target"].completed == metrics["dataset.Inventory"].completed == 6
+    assert metrics["target"].max_queue_depth == 4  # 2 of them ran right away
+    assert metrics["target"].queued == metrics["target"].running == 0
+    assert metrics["target"].max_wait >= 0.1  # the last ones waited for 2 rounds of jobs
+    assert 0 < metrics["target"].mean_wait < metrics["target"].max_wait
+
+
+def test_conflicts_are_retried():
+    conflicts = ConflictingDml(duration=0.02, seed=0)
+    client = FakeJobClient(on_query=conflicts)
+    scheduler = DmlScheduler(client, max_per_table=2, max_attempts=20, backoff=0.01, poll_interval=0.005, seed=0)
+
+    stats = _run(scheduler, [update_merge(t1=str(i)) for i in range(5)])
+
+    assert len(stats) == 5
+    assert conflicts.conflicts > 0
+    assert scheduler.metrics["target"].retries == conflicts.conflicts
+    assert scheduler.metrics["target"].completed == 5
+    assert len(client.queries) == 5 + conflicts.conflicts
+
+
+def test_no_conflicts_one_at_a_time():
+    conflicts = ConflictingDml(duration=0.01)
+    scheduler = DmlScheduler(FakeJobClient(on_query=conflicts), max_per_table=1, poll_interval=0.005)
+
+    _run(scheduler, [update_merge(t1=str(i)) for i in range(4)])
+
+    assert conflicts.conflicts == 0
+
+
+def test_other_errors_are_not_retried():
+    client = FakeJobClient(on_query=lambda sql, parameters, options: {"error": ValueError("Syntax error")})
+    scheduler = DmlScheduler(client, poll_interval=0.005)
+
+    with pytest.raises(ValueError):
+        _run(scheduler, [update_merge(t1="a")])
+
+    assert len(client.queries) == 1
+    assert scheduler.metrics["target"].failed == 1
+
+
+def test_gives_up_after_max_attempts():
+    client = FakeJobClient(on_query=lambda sql, parameters, options: {"error": SerializationConflict("target")})
+    scheduler = DmlScheduler(client, max_attempts=3, backoff=0.001, poll_interval=0.005)
+
+    with pytest.raises(SerializationConflict):
+        _run(scheduler, [update_merge(t1="a")])
+
+    assert len(client.queries) == 3
+    assert (scheduler.metrics["target"].retries, scheduler.metrics["target"].failed) == (2, 1)
+
+
+def test_is_conflict():
+    assert is_conflict(SerializationConflict("dataset.table"))
+    assert is_conflict(Exception("Transaction is aborted due to concurrent update against table dataset.table"))
+    assert not is_conflict(Exception("Syntax error: Unexpected end of script"))
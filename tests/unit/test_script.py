@@ -0,0 +1,162 @@
+from textwrap import dedent
+
+import pytest
+from sqlalchemy import Column, Date, MetaData, String, Table, func, select, text, update
+
+from pybigquery_merge_into._dialect import bigquery_dialect
+from pybigquery_merge_into.client import execute
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched
+from pybigquery_merge_into.script import CreateTempTable, MergeScript, materialize_source
+from pybigquery_merge_into.testing import FakeJobClient
+from tests.conftest import CachingBigQueryDialect, compile_w_cache, source, target
+
+
+def _merge(value: str) -> MergeInto:
+    # every merge has a CTE of the same name, each statement has to render its own
+    changes = select(source).where(source.c.s1 != value).cte("changes")
+    sub = select(changes).subquery("sub")
+
+    return MergeInto(
+        target=target,
+        source=sub,
+        onclause=target.c.t1 == sub.c.s1,
+        when_clauses=[WhenMatched(update(target).values(t1=value))],
+    )
+
+
+def test_statements_get_their_own_parameters():
+    expected = """\
+        MERGE INTO `target`
+        USING (WITH `changes` AS 
+        (SELECT `source`.`s1` AS `s1`, `source`.`s2` AS `s2` 
+        FROM `source` 
+        WHERE `source`.`s1` != %(s1_1:STRING)s)
+         SELECT `changes`.`s1` AS `s1`, `changes`.`s2` AS `s2` 
+        FROM `changes`) AS `sub`
+        ON `target`.`t1` = `sub`.`s1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t1`=%(t1:STRING)s;
+        MERGE INTO `target`
+        USING (WITH `changes` AS 
+        (SELECT `source`.`s1` AS `s1`, `source`.`s2` AS `s2` 
+        FROM `source` 
+        WHERE `source`.`s1` != %(s1_2:STRING)s)
+         SELECT `changes`.`s1` AS `s1`, `changes`.`s2` AS `s2` 
+        FROM `changes`) AS `sub`
+        ON `target`.`t1` = `sub`.`s1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t1`=%(param_1:STRING)s;
+        """
+
+    compiled = MergeScript([_merge("a"), _merge("b")]).compile(dialect=bigquery_dialect())
+
+    assert str(compiled) == dedent(expected)
+    assert compiled.params == {"s1_1": "a", "t1": "a", "s1_2": "b", "param_1": "b"}
+
+
+def test_transaction_and_temp_table():
+    new_rows = CreateTempTable("new_rows", select(source.c.s1.label("t1"), source.c.s2.label("t2")))
+    merge = MergeInto.upsert(target, new_rows.table, ["t1"])
+
+    expected = """\
+        BEGIN
+        BEGIN TRANSACTION;
+        CREATE TEMP TABLE `new_rows` AS
+        SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`;
+        MERGE INTO `target`
+        USING `new_rows`
+        ON `target`.`t1` = `new_rows`.`t1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`new_rows`.`t2`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (`new_rows`.`t1`, `new_rows`.`t2`);
+        SELECT 1;
+        COMMIT TRANSACTION;
+        EXCEPTION WHEN ERROR THEN
+        ROLLBACK TRANSACTION;
+        RAISE;
+        END;
+        """
+
+    script = MergeScript([new_rows, merge, text("SELECT 1")], transaction=True)
+
+    assert str(script.compile(dialect=bigquery_dialect())) == dedent(expected)
+
+
+def test_runs_as_a_single_job():
+    client = FakeJobClient()
+
+    execute(client, MergeScript([_merge("a"), _merge("b"), _merge("c")]))
+
+    assert len(client.queries) == 1
+    assert client.queries[0][0].count("MERGE INTO") == 3
+
+
+def test_cached():
+    dialect = CachingBigQueryDialect()
+    cache: dict = {}
+
+    first, _, _ = compile_w_cache(MergeScript([_merge("a"), _merge("b")]), dialect, cache)
+    second, params, hit = compile_w_cache(MergeScript([_merge("c"), _merge("d")]), dialect, cache)
+
+    assert hit == dialect.CACHE_HIT
+    assert first.construct_params(extracted_parameters=params) == {"s1_1": "c", "t1": "c", "s1_2": "d", "param_1": "d"}
+    assert MergeScript([_merge("a")])._generate_cache_key() != \
+           MergeScript([_merge("a")], transaction=True)._generate_cache_key()
+
+
+def test_temp_tables_have_no_dataset():
+    with pytest.raises(AssertionError):
+        CreateTempTable("dataset.new_rows", select(source))
+
+
+def test_materialized_source_is_scanned_once():
+    s = select(source.c.s1.label("t1"), func.max(source.c.s2).label("t2")).group_by(source.c.s1).subquery("s")
+    other = Table("other", MetaData(), Column("t1", String), Column("t2", Date))
+
+    expected = """\
+        CREATE TEMP TABLE `merge_source` AS
+        SELECT `s`.`t1`, `s`.`t2` 
+        FROM (SELECT `source`.`s1` AS `t1`, max(`source`.`s2`) AS `t2` 
+        FROM `source` GROUP BY `source`.`s1`) AS `s`;
+        MERGE INTO `target`
+        USING `merge_source` AS `s`
+        ON `target`.`t1` = `s`.`t1` AND `target`.`t2` IN (SELECT DISTINCT `s`.`t2` 
+        FROM `merge_source` AS `s`)
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`s`.`t2`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (`s`.`t1`, `s`.`t2`);
+        MERGE INTO `other`
+        USING `merge_source` AS `s`
+        ON `other`.`t1` = `s`.`t1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`s`.`t2`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT (`t1`, `t2`) VALUES (`s`.`t1`, `s`.`t2`);
+        DROP TABLE `merge_source`;
+        """
+
+    script = materialize_source([
+        MergeInto.upsert(target, s, ["t1"], partition_column="t2"),
+        MergeInto.upsert(other, s, ["t1"]),
+    ])
+
+    compiled = str(script.compile(dialect=bigquery_dialect(), compile_kwargs={"literal_binds": True}))
+
+    assert compiled == dedent(expected)
+    assert compiled.count("FROM `source`") == 1
+
+
+def test_materialized_source_options():
+    script = materialize_source([_merge("a")], name="sub", transaction=True)
+
+    compiled = str(script.compile(dialect=bigquery_dialect()))
+
+    # named after the source already, no alias required
+    assert "MERGE INTO `target`\nUSING `sub`\nON `target`.`t1` = `sub`.`s1`" in compiled
+    assert compiled.startswith("BEGIN\nBEGIN TRANSACTION;\nCREATE TEMP TABLE `sub` AS\nWITH `changes` AS")
+
+    with pytest.raises(AssertionError):
+        materialize_source([_merge("a"), _merge("b")])
@@ -0,0 +1,111 @@
+import asyncio
+from textwrap import dedent
+
+import pytest
+from sqlalchemy import delete, select, update
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatchedBySource
+from pybigquery_merge_into.sharding import execute_sharded, shard_merge
+from pybigquery_merge_into.scheduler import DmlScheduler
+from pybigquery_merge_into.testing import ConflictingDml, FakeJobClient
+from tests.conftest import source, target
+
+sub = select(source.c.s1.label("t1"), source.c.s2.label("t2")).subquery("sub")
+
+
+def _merge(**kwargs) -> MergeInto:
+    return MergeInto(
+        target=target,
+        source=sub,
+        onclause=target.c.t1 == sub.c.t1,
+        when_clauses=[
+            WhenMatched(update(target).values(t2=sub.c.t2)),
+            WhenNotMatchedBySource(delete(target), condition=target.c.t2.is_(None)),
+        ],
+        **kwargs
+    )
+
+
+def _compile(query: MergeInto) -> str:
+    return str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_range_shards():
+    expected = """\
+        MERGE INTO `target`
+        USING (SELECT `sub`.`t1` AS `t1`, `sub`.`t2` AS `t2` 
+        FROM (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` 
+        FROM `source`) AS `sub` 
+        WHERE `sub`.`t1` >= 'g' AND `sub`.`t1` < 'p') AS `sub`
+        ON `target`.`t1` = `sub`.`t1` AND `target`.`t1` >= 'g' AND `target`.`t1` < 'p'
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`sub`.`t2`
+        WHEN NOT MATCHED BY SOURCE AND `target`.`t2` IS NULL AND `target`.`t1` >= 'g' AND `target`.`t1` < 'p' THEN 
+        \tDELETE
+        """
+
+    first, middle, last = shard_merge(_merge(), "t1", boundaries=["g", "p"])
+
+    assert _compile(middle) == dedent(expected)
+    assert "WHERE `sub`.`t1` < 'g' OR `sub`.`t1` IS NULL) AS `sub`\n" \
+           "ON `target`.`t1` = `sub`.`t1` AND (`target`.`t1` < 'g' OR `target`.`t1` IS NULL)\n" in _compile(first)
+    assert "WHEN NOT MATCHED BY SOURCE AND `target`.`t2` IS NULL AND `target`.`t1` >= 'p' THEN" in _compile(last)
+
+
+def test_hash_shards():
+    shards = shard_merge(_merge(), "t1", shards=4)
+
+    assert len(shards) == 4
+    assert "WHERE abs(mod(farm_fingerprint(to_json_string(`sub`.`t1`)), 4)) = 3) AS `sub`\n" \
+           "ON `target`.`t1` = `sub`.`t1` AND abs(mod(farm_fingerprint(to_json_string(`target`.`t1`)), 4)) = 3\n" \
+           in _compile(shards[3])
+    # the shard's index is a parameter
+    assert all(shard._generate_cache_key() == shards[0]._generate_cache_key() for shard in shards)
+
+
+def test_partition_semi_join_reads_the_shard():
+    _, last = shard_merge(_merge(partition_column="t2"), "t1", boundaries=["m"])
+
+    assert "`target`.`t2` IN (SELECT DISTINCT `sub`.`t2` \n" \
+           "FROM (SELECT `sub`.`t1` AS `t1`, `sub`.`t2` AS `t2` \n" \
+           "FROM (SELECT `source`.`s1` AS `t1`, `source`.`s2` AS `t2` \n" \
+           "FROM `source`) AS `sub` \n" \
+           "WHERE `sub`.`t1` >= 'm') AS `sub`)" in _compile(last)
+
+
+def test_original_merge_is_left_untouched():
+    merge = _merge()
+    before = _compile(merge)
+
+    shard_merge(merge, "t1", shards=2)
+
+    assert _compile(merge) == before
+
+
+def test_execute_sharded():
+    client = FakeJobClient(latency=0.01)
+
+    stats = asyncio.run(execute_sharded(client, _merge(), "t1", shards=3, poll_interval=0.01, priority="BATCH"))
+
+    assert len(stats) == len(client.queries) == 3
+    assert all(options == {"priority": "BATCH"} for _, _, options in client.queries)
+
+
+def test_sharded_conflicts_are_retried():
+    conflicts = ConflictingDml(duration=0.02, seed=0)
+    client = FakeJobClient(on_query=conflicts)
+    scheduler = DmlScheduler(client, max_attempts=20, backoff=0.01, poll_interval=0.005, seed=0)
+
+    stats = asyncio.run(execute_sharded(client, _merge(), "t1", shards=4, scheduler=scheduler))
+
+    assert len(stats) == 4
+    assert conflicts.conflicts > 0
+    assert scheduler.metrics["target"].retries == conflicts.conflicts
+    assert scheduler.metrics["target"].completed == 4
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"shards": 2, "boundaries": ["m"]}, {"boundaries": ["p", "g"]}])
+def test_invalid_sharding(kwargs):
+    with pytest.raises(AssertionError):
+        shard_merge(_merge(), "t1", **kwargs)
@@ -0,0 +1,103 @@
+from datetime import date
+from textwrap import dedent
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, update
+from sqlalchemy_bigquery import STRUCT, BigQueryDialect
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatchedBySource
+from tests.conftest import CachingBigQueryDialect, compile_w_cache, detailed_inventory, new_arrivals, source, target
+
+
+def test_condition_covers_the_updated_columns():
+    expected = """\
+        MERGE INTO `target`
+        USING `source`
+        ON `target`.`t1` = `source`.`s1`
+        WHEN MATCHED AND `source`.`s2` > DATE '2020-01-01' AND `target`.`t2` IS DISTINCT FROM `source`.`s2` THEN 
+        \tUPDATE SET `t2`=`source`.`s2`
+        """
+
+    query = MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.t1 == source.c.s1,
+        when_clauses=[
+            WhenMatched(update(target).values(t2=source.c.s2), condition=source.c.s2 > date(2020, 1, 1), skip_unchanged=True),
+        ],
+    )
+
+    assert str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True})) == dedent(expected)
+
+
+def test_non_comparable_types_are_compared_as_json():
+    metadata = MetaData()
+    struct_target = Table("structs", metadata, Column("id", Integer), Column("s", STRUCT(a=Integer, b=String)))
+    struct_source = Table("new_structs", metadata, Column("id", Integer), Column("s", STRUCT(a=Integer, b=String)))
+
+    new_inventory = detailed_inventory.alias("new_inventory")
+    arrays = MergeInto.upsert(detailed_inventory, new_inventory, ["product"], ["product", "comments"], skip_unchanged=True)
+    structs = MergeInto.upsert(struct_target, struct_source, ["id"], skip_unchanged=True)
+
+    assert "WHEN MATCHED AND to_json_string(`dataset.DetailedInventory`.`comments`) IS DISTINCT FROM " \
+           "to_json_string(`new_inventory`.`comments`) THEN" in str(arrays.compile(dialect=BigQueryDialect()))
+    assert "WHEN MATCHED AND to_json_string(`structs`.`s`) IS DISTINCT FROM " \
+           "to_json_string(`new_structs`.`s`) THEN" in str(structs.compile(dialect=BigQueryDialect()))
+
+
+def test_literal_values_are_rendered_twice():
+    query = MergeInto(
+        target=target,
+        source=source,
+        onclause=target.c.t1 == source.c.s1,
+        when_clauses=[WhenMatched(update(target).values(t1="a", t2=source.c.s2), skip_unchanged=True)],
+    )
+
+    compiled = query.compile(dialect=BigQueryDialect(paramstyle="pyformat"))
+
+    assert "WHEN MATCHED AND `target`.`t1` IS DISTINCT FROM %(param_1:STRING)s OR " \
+           "`target`.`t2` IS DISTINCT FROM `source`.`s2` THEN \n" \
+           "\tUPDATE SET `t1`=%(param_1:STRING)s, `t2`=`source`.`s2`" in str(compiled)
+    assert compiled.params == {"param_1": "a"}
+
+
+def test_literal_values_are_cached_as_parameters():
+    def merge(value: str) -> MergeInto:
+        return MergeInto(target, source, target.c.t1 == source.c.s1, [
+            WhenMatched(update(target).values(t1=value), skip_unchanged=True),
+        ])
+
+    dialect = CachingBigQueryDialect()
+    cache: dict = {}
+
+    first, _, _ = compile_w_cache(merge("a"), dialect, cache)
+    second, second_params, hit = compile_w_cache(merge("b"), dialect, cache)
+
+    assert hit == dialect.CACHE_HIT
+    assert first.construct_params(extracted_parameters=second_params) == {"param_1": "b"}
+    assert merge("a")._generate_cache_key() != MergeInto(target, source, target.c.t1 == source.c.s1, [
+        WhenMatched(update(target).values(t1="a")),
+    ])._generate_cache_key()
+
+
+def test_flag_survives_partition_pruning():
+    sub = new_arrivals.alias("sub")
+    query = MergeInto(
+        target=detailed_inventory,
+        source=sub,
+        onclause=detailed_inventory.c.product == sub.c.product,
+        when_clauses=[
+            WhenMatched(update(detailed_inventory).values(quantity=sub.c.quantity), skip_unchanged=True),
+            WhenNotMatchedBySource(delete(detailed_inventory)),
+        ],
+        partition_column="quantity",
+        prune_source_columns=True,
+    )
+
+    assert "WHEN MATCHED AND `dataset.DetailedInventory`.`quantity` IS DISTINCT FROM `sub`.`quantity` THEN" \
+           in str(query.compile(dialect=BigQueryDialect()))
+
+
+def test_requires_an_update():
+    with pytest.raises(AssertionError):
+        WhenMatched(delete(target), skip_unchanged=True)
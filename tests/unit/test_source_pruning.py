@@ -0,0 +1,118 @@
+from textwrap import dedent
+
+from sqlalchemy import delete, insert, literal, select, update
+from sqlalchemy_bigquery import BigQueryDialect
+
+from pybigquery_merge_into.merge_clause import MergeInto, WhenMatched, WhenNotMatched, WhenNotMatchedBySource
+from tests.conftest import detailed_inventory, inventory, new_arrivals, target
+
+
+def _compile(query: MergeInto) -> str:
+    return str(query.compile(dialect=BigQueryDialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_table_source_is_pruned():
+    I, D = inventory.alias("I"), detailed_inventory.alias("D")
+
+    expected = """\
+        MERGE INTO `dataset.Inventory` AS `I`
+        USING (SELECT `D`.`product` AS `product`, `D`.`quantity` AS `quantity` 
+        FROM `dataset.DetailedInventory` AS `D`) AS `D`
+        ON `I`.`product` = `D`.`product`
+        WHEN MATCHED AND `D`.`quantity` > 0 THEN 
+        \tUPDATE SET `quantity`=`D`.`quantity`
+        WHEN NOT MATCHED BY SOURCE THEN 
+        \tDELETE
+        """
+
+    query = MergeInto(
+        target=I,
+        source=D,
+        onclause=I.c.product == D.c.product,
+        when_clauses=[
+            WhenMatched(update(I).values(quantity=D.c.quantity), condition=D.c.quantity > 0),
+            WhenNotMatchedBySource(delete(I)),
+        ],
+        prune_source_columns=True,
+    )
+
+    assert _compile(query) == dedent(expected)
+
+
+def test_unnamed_table_source_keeps_its_name():
+    query = MergeInto.upsert(inventory, detailed_inventory, ["product"], ["product", "quantity"], prune_source_columns=True)
+
+    compiled = _compile(query)
+
+    assert "FROM `dataset.DetailedInventory`) AS `DetailedInventory`\n" \
+           "ON `dataset.Inventory`.`product` = `DetailedInventory`.`product`" in compiled
+    assert "`comments`" not in compiled and "`supply_constrained`" not in compiled
+
+
+def test_insert_row_is_not_pruned():
+    # INSERT ROW is positional: the source's columns are kept, in the source's order
+    s = select(target.c.t2, target.c.t1, literal("extra").label("extra")).subquery("s")
+
+    expected = """\
+        MERGE INTO `target`
+        USING (SELECT `target`.`t2` AS `t2`, `target`.`t1` AS `t1`, 'extra' AS `extra` 
+        FROM `target`) AS `s`
+        ON `target`.`t1` = `s`.`t1`
+        WHEN MATCHED THEN 
+        \tUPDATE SET `t2`=`s`.`t2`
+        WHEN NOT MATCHED BY TARGET THEN 
+        \tINSERT ROW
+        """
+
+    query = MergeInto(
+        target=target,
+        source=s,
+        onclause=target.c.t1 == s.c.t1,
+        when_clauses=[WhenMatched(update(target).values(t2=s.c.t2)), WhenNotMatched(insert(target))],
+        prune_source_columns=True,
+    )
+
+    assert _compile(query) == dedent(expected)
+
+
+def test_insert_row_without_the_target_columns_is_not_pruned():
+    query = MergeInto(
+        target=inventory,
+        source=new_arrivals,
+        onclause=inventory.c.product == new_arrivals.c.product,
+        when_clauses=[WhenNotMatched(insert(inventory))],
+        prune_source_columns=True,
+    )
+
+    assert "USING `dataset.NewArrivals`\n" in _compile(query)
+
+
+def test_partition_semi_join_uses_the_projection():
+    query = MergeInto.upsert(
+        inventory, detailed_inventory, ["product"], ["product", "quantity"],
+        partition_column="quantity", prune_source_columns=True,
+    )
+
+    compiled = _compile(query)
+
+    assert "`dataset.Inventory`.`quantity` IN (SELECT DISTINCT `DetailedInventory`.`quantity` \n" \
+           "FROM (SELECT `dataset.DetailedInventory`.`product` AS `product`, " \
+           "`dataset.DetailedInventory`.`quantity` AS `quantity` \n" \
+           "FROM `dataset.DetailedInventory`) AS `DetailedInventory`)" in compiled
+
+
+def test_pruning_is_part_of_the_cache_key():
+    def merge(**kwargs) -> MergeInto:
+        return MergeInto.upsert(inventory, detailed_inventory, ["product"], ["product", "quantity"], **kwargs)
+
+    assert merge(prune_source_columns=True)._generate_cache_key() == merge(prune_source_columns=True)._generate_cache_key()
+    assert merge(prune_source_columns=True)._generate_cache_key() != merge()._generate_cache_key()
+
+
+def test_when_clauses_are_left_untouched():
+    query = MergeInto.upsert(inventory, detailed_inventory, ["product"], ["product", "quantity"], prune_source_columns=True)
+    _compile(query)
+
+    assert query.source is detailed_inventory
+    assert str(query.when_clauses[0].action.compile()) == \
+           'UPDATE "dataset.Inventory" SET quantity="dataset.DetailedInventory".quantity'
@@ -0,0 +1,81 @@
+import pytest
+
+from pybigquery_merge_into import events
+from pybigquery_merge_into.staging import staged_merge
+from pybigquery_merge_into.testing import FakeJobClient
+from tests.conftest import target
+
+batches = [
+    [{"t1": "a"}, {"t1": "b"}],
+    [{"t1": "c"}],
+    [{"t1": "d"}],
+]
+
+
+def _kinds(client: FakeJobClient):
+    return [kind for kind, _ in client.events]
+
+
+def test_staged_merge():
+    client = FakeJobClient()
+
+    merges = staged_merge(client, target, batches, key_columns=["t1"], staging_dataset="staging")
+
+    assert len(merges) == 3
+    # the loads run one batch ahead of the merges
+    assert _kinds(client) == ["load", "load", "query", "delete", "load", "query", "delete", "query", "delete"]
+
+    loaded = [table for kind, table in client.events if kind == "load"]
+    deleted = [table for kind, table in client.events if kind == "delete"]
+    assert loaded == deleted
+    assert all(table.startswith("staging.target_staging_") for table in loaded)
+    assert client.tables == {}
+
+    for table, (sql, _, _) in zip(loaded, client.queries):
+        assert sql.startswith(f"MERGE INTO `target`\nUSING `{table}`\nON `target`.`t1` = `{table}`.`t1`\n")
+
+
+def test_merges_are_executed_with_the_options():
+    client = FakeJobClient()
+    received = []
+    events.add_observer(received.append)
+    try:
+        staged_merge(client, target, batches, key_columns=["t1"], staging_dataset="staging", priority="BATCH")
+    finally:
+        events.remove_observer(received.append)
+
+    assert [options for _, _, options in client.queries] == [{"priority": "BATCH"}] * 3
+    assert sum(isinstance(event, events.StatementExecuted) for event in received) == 3
+
+
+def test_no_loads_ahead():
+    client = FakeJobClient()
+
+    staged_merge(client, target, batches, key_columns=["t1"], staging_dataset="staging", loads_ahead=0)
+
+    assert _kinds(client) == ["load", "query", "delete"] * 3
+
+
+def test_loaded_data():
+    client = FakeJobClient()
+    loaded = []
+    client.delete_table = loaded.append  # keep the tables around
+
+    staged_merge(client, target, batches, key_columns=["t1"], staging_dataset="staging", columns=["t1"])
+
+    assert [data for (_, data), in client.tables.values()] == batches
+    assert all([c.name for c in columns] == ["t1"] for (columns, _), in client.tables.values())
+
+
+def test_staging_tables_are_dropped_on_failure():
+    def on_query(sql, parameters, options):
+        return {"error": RuntimeError("boom")}
+
+    client = FakeJobClient(on_query=on_query)
+
+    with pytest.raises(RuntimeError, match="boom"):
+        staged_merge(client, target, batches, key_columns=["t1"], staging_dataset="staging")
+
+    # the first merge failed, its table & the one loaded ahead are dropped
+    assert _kinds(client) == ["load", "load", "query", "delete", "delete"]
+    assert client.tables == {}